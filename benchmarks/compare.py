@@ -0,0 +1,73 @@
+"""
+Compare two result files written by benchmarks.suite
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Prints the change of every metric measured in both, and exits with a
+non-zero status if any got worse by more than the threshold, in percent.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    """
+    Read the metrics from a result file, by backend, benchmark and name
+    """
+    with open(path, encoding='utf-8') as results:
+        report = json.load(results)
+    return dict(
+        ((result['backend'], result['benchmark'], metric), value)
+        for result in report['results']
+        for (metric, value) in result['metrics'].items()
+    )
+
+
+def regression(metric, old, new):
+    """
+    How much worse, in percent, a metric got; negative if it got better
+    """
+    if not old:
+        return 0
+    if metric.endswith('_per_s'):
+        return (old - new) / old * 100
+    return (new - old) / old * 100
+
+
+def main(argv=None):
+    """
+    Compare the result files and report the regressions
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before', help="results of the baseline")
+    parser.add_argument('after', help="results to compare to the baseline")
+    parser.add_argument('--threshold', type=float, default=10,
+                        help="percentage of a slowdown to fail on "
+                        "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    before = load(args.before)
+    after = load(args.after)
+
+    regressions = 0
+    for key in sorted(set(before) & set(after)):
+        (backend, benchmark, metric) = key
+        change = regression(metric, before[key], after[key])
+        failed = change > args.threshold
+        regressions += failed
+        print("%-20s %-12s %-28s %14.3f %14.3f %+8.1f%%%s" % (
+            backend, benchmark, metric, before[key], after[key], change,
+            ' REGRESSION' if failed else ''))
+
+    if regressions:
+        print("%d metric(s) worse by more than %s%%." %
+              (regressions, args.threshold), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
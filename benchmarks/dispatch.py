@@ -0,0 +1,75 @@
+"""
+Measure the overhead of receiving a command and dispatching it to its handler
+
+The transport hands out already decoded messages and discards the replies,
+so only the work done by the endpoint's receive loop is timed.
+
+    python -m benchmarks.dispatch
+"""
+
+from __future__ import print_function
+
+import timeit
+
+from eurydice.endpoint import Endpoint
+from eurydice.transport import Transport
+
+
+class Target(object):
+    """
+    An object to call methods on
+    """
+    def concat(self, *args):  # pylint:disable=no-self-use
+        """
+        Return the first argument
+        """
+        return args[0]
+
+
+class ReplayTransport(Transport):
+    """
+    A transport receiving the same message over and over
+    """
+    def __init__(self, endpoint):
+        super(ReplayTransport, self).__init__(endpoint)
+        self.message = None
+
+    def send_message(self, message):
+        pass
+
+    def receive(self):
+        return self.message
+
+
+class ReplayEndpoint(Endpoint):
+    """
+    An endpoint using the replaying transport
+    """
+    def __init__(self):
+        super(ReplayEndpoint, self).__init__(ReplayTransport(self))
+
+
+def main(number=100000, repeat=5):
+    """
+    Print the time taken to receive and process each kind of command
+    """
+    endpoint = ReplayEndpoint()
+    target = Target()
+
+    cases = (
+        ('return', ('return', ['result'])),
+        ('ping', ('ping', [])),
+        ('call', ('call', [target, 'concat', 'two'])),
+        ('call, 5 arguments', ('call', [target, 'concat', 1, 2, 3, 4, 5])),
+        ('tagged call', ('tagged', [1, 'call', target, 'concat', 'two'])),
+        ('delete_many', ('delete_many', [[]])),
+    )
+    receive_one = endpoint._receive_one  # pylint:disable=protected-access
+    for (name, message) in cases:
+        endpoint.transport.message = message
+        best = min(timeit.repeat(receive_one, number=number, repeat=repeat))
+        print("%-20s %8.3f us" % (name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
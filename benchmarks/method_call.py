@@ -0,0 +1,73 @@
+"""
+Measure the local overhead of calling a method of a remote object
+
+The transport doesn't send anything and replies to every call immediately,
+so only the work done by the proxy, the endpoint and the serializer is
+timed. A round trip to an in-process server is timed as well, for the
+overhead of the protocol without any I/O.
+
+    python -m benchmarks.method_call
+"""
+
+from __future__ import print_function
+
+import timeit
+
+import eurydice.local
+from eurydice.endpoint import Endpoint
+from eurydice.transport import JSONTransport
+
+
+class LoopbackTransport(JSONTransport):
+    """
+    A transport replying to every message with the same value
+    """
+    def __init__(self, endpoint):
+        super(LoopbackTransport, self).__init__(endpoint)
+        self.reply = self.encode('return', 'result')
+
+    def send_chunk(self, chunk):
+        pass
+
+    def receive_chunk(self):
+        return self.reply
+
+
+class LoopbackEndpoint(Endpoint):
+    """
+    An endpoint using the loopback transport
+    """
+    def __init__(self):
+        super(LoopbackEndpoint, self).__init__(LoopbackTransport(self))
+
+
+def main(number=100000, repeat=5):
+    """
+    Print the time taken by a method call and by a method lookup
+    """
+    endpoint = LoopbackEndpoint()
+    robj = endpoint.remote_object(endpoint, {
+        '_remote_proxy': {'id': 1, 'instance': 'remote'},
+    })
+
+    cases = (
+        ('lookup', lambda: robj.concat),
+        ('call', lambda: robj.concat('two')),
+        ('call, 5 arguments', lambda: robj.concat(1, 2, 3, 4, 5)),
+    )
+    for (name, func) in cases:
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        print("%-20s %8.3f us" % (name, best / number * 1e6))
+
+    client = eurydice.local.Client()
+    rconcat = client.use('tests.objects').Concat('one')
+    # Round trips involve switching threads, time fewer of them
+    number //= 10
+    best = min(timeit.repeat(lambda: rconcat.concat('two'),
+                             number=number, repeat=repeat))
+    print("%-20s %8.3f us" % ('in-process call', best / number * 1e6))
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
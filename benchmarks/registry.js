@@ -0,0 +1,65 @@
+/**
+ * Measure exporting and releasing callbacks in the JavaScript object
+ * registry, compared to the array scanned on every export it replaced
+ *
+ *     node benchmarks/registry.js [count]
+ */
+var Registry = require('../javascript/registry.js');
+
+/**
+ * The registry as it used to be: an array scanned for the object
+ */
+function ArrayRegistry() {
+  this.objects = [];
+}
+
+ArrayRegistry.prototype.export = function (obj) {
+  for (var i = 0; i < this.objects.length; i++) {
+    if (this.objects[i] === obj) {
+      return i;
+    }
+  }
+  return this.objects.push(obj) - 1;
+};
+
+ArrayRegistry.prototype.release = function (id) {
+  delete this.objects[id];
+};
+
+function callbacks(count) {
+  var result = [];
+  for (var i = 0; i < count; i++) {
+    result.push(function () { return i; });
+  }
+  return result;
+}
+
+function measure(name, registry, count) {
+  var objs = callbacks(count);
+  var ids = new Array(count);
+
+  var start = process.hrtime();
+  for (var i = 0; i < count; i++) {
+    ids[i] = registry.export(objs[i]);
+  }
+  var exported = process.hrtime(start);
+
+  start = process.hrtime();
+  for (i = 0; i < count; i++) {
+    registry.release(ids[i]);
+  }
+  var released = process.hrtime(start);
+
+  function ms(time) {
+    return (time[0] * 1e3 + time[1] / 1e6).toFixed(1) + ' ms';
+  }
+  console.log(name + ', ' + count + ' callbacks: export ' + ms(exported) +
+              ', release ' + ms(released));
+}
+
+var count = parseInt(process.argv[2], 10) || 100000;
+
+// The array is too slow for the full count
+measure('array', new ArrayRegistry(), Math.min(count, 10000));
+measure('registry', new Registry(), Math.min(count, 10000));
+measure('registry', new Registry(), count);
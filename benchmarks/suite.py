@@ -0,0 +1,379 @@
+"""
+Measure the performance of the bridge against each backend and transport
+
+The servers are started the same way as in the tests, and the remote objects
+are the test ones. The results are written as JSON, to be compared between
+commits with benchmarks.compare:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --backend perl-unix --benchmark latency
+
+Metrics ending with '_us' are times in microseconds (lower is better), the
+ones ending with '_per_s' are rates (higher is better).
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import gc
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from eurydice.common import TransportException
+from eurydice.endpoint import RemoteError
+from eurydice.serializer import msgpack
+
+from tests import (
+    JavaScriptInteractionTest,
+    PerlInteractionTest,
+    PythonInteractionTest,
+)
+from tests.objects import Bouncer
+from tests.test_local import LocalServerClient
+from tests.test_socket import (
+    JSONPerlServerClient,
+    JSONPythonServerClient,
+    ModeServerClient,
+    PerlServerClient,
+    ProcessServerClient,
+    PythonServerClient,
+    UnixPerlServerClient,
+    UnixPythonServerClient,
+)
+
+
+class JavaScriptServerClient(ProcessServerClient):
+    """
+    JavaScript server using length-prefixed messages over TCP
+    """
+    arguments = ['node',
+                 '-harmony-proxies',
+                 '-harmony-collections',
+                 '-expose-gc',
+                 'javascript/server.js',
+                 '--framed']
+
+
+class Backend(object):
+    """
+    A server to measure against: how to start it, the interaction test
+    providing the remote objects, and whether it serves several clients at
+    once
+    """
+    def __init__(self, server_client, interaction, concurrent=False):
+        self.server_client = server_client
+        self.interaction = interaction
+        self.concurrent = concurrent
+
+    def available(self):
+        """
+        Whether the server can be started
+        """
+        arguments = getattr(self.server_client, 'arguments', None)
+        return not arguments or shutil.which(arguments[0]) is not None
+
+
+BACKENDS = {
+    'python-tcp': Backend(PythonServerClient, PythonInteractionTest),
+    'python-tcp-json': Backend(JSONPythonServerClient, PythonInteractionTest),
+    'python-tcp-threads': Backend(lambda: ModeServerClient('thread'),
+                                  PythonInteractionTest, concurrent=True),
+    'python-unix': Backend(UnixPythonServerClient, PythonInteractionTest),
+    'python-local': Backend(LocalServerClient, PythonInteractionTest,
+                            concurrent=True),
+    'perl-tcp': Backend(PerlServerClient, PerlInteractionTest),
+    'perl-tcp-json': Backend(JSONPerlServerClient, PerlInteractionTest),
+    'perl-unix': Backend(UnixPerlServerClient, PerlInteractionTest),
+    'javascript-tcp': Backend(JavaScriptServerClient,
+                              JavaScriptInteractionTest, concurrent=True),
+}
+
+
+class Run(object):
+    """
+    The state of the benchmarks against one backend
+    """
+    def __init__(self, backend, server_client, client, scale):
+        self.backend = backend
+        self.server_client = server_client
+        self.client = client
+        self.test = backend.interaction()
+        self.scale = scale
+
+    def count(self, count):
+        """
+        The number of repetitions, scaled
+        """
+        return max(1, int(count * self.scale))
+
+
+def timed(func, count):
+    """
+    Call the function a number of times, returning the time taken
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return time.perf_counter() - start
+
+
+def percentiles(samples):
+    """
+    Summarize the times taken, in seconds, as microseconds
+    """
+    samples = sorted(samples)
+
+    def at(fraction):
+        """
+        The sample at the fraction of the sorted ones
+        """
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    return {
+        'mean_us': sum(samples) / len(samples) * 1e6,
+        'p50_us': at(0.5) * 1e6,
+        'p90_us': at(0.9) * 1e6,
+        'p99_us': at(0.99) * 1e6,
+    }
+
+
+def bench_latency(run):
+    """
+    Round trip time of an empty call
+    """
+    samples = []
+    for _ in range(run.count(2000)):
+        start = time.perf_counter()
+        run.client.ping()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_throughput(run):
+    """
+    Method calls per second, one at a time and batched
+    """
+    robj = run.test.concat_object(run.client)
+    count = run.count(2000)
+    elapsed = timed(lambda: robj.concat('x'), count)
+
+    def batch():
+        """
+        Make a batch of 100 calls
+        """
+        with run.client.batch() as calls:
+            for _ in range(100):
+                calls.call(robj, 'concat', 'x')
+
+    batches = max(1, count // 100)
+    batched = timed(batch, batches)
+    return {
+        'calls_per_s': count / elapsed,
+        'batched_calls_per_s': batches * 100 / batched,
+    }
+
+
+PAYLOAD_SIZES = (16, 1024, 65536, 1048576)
+
+
+def bench_payload(run):
+    """
+    Time of a call passing a string, and binary data, of each size
+    """
+    robj = run.test.concat_object(run.client)
+    reverse = run.test.reverse_bytes(run.client)
+    serializer = run.client.transport.serializer
+    binary = serializer.buffers or serializer.name != 'json'
+
+    metrics = {}
+    for size in PAYLOAD_SIZES:
+        count = run.count(max(20, 1000 // (1 + size // 16384)))
+        text = 'x' * size
+        elapsed = timed(lambda text=text: robj.concat(text), count)
+        metrics['string_%d_us' % size] = elapsed / count * 1e6
+        if binary:
+            data = b'x' * size
+            elapsed = timed(lambda data=data: reverse(data), count)
+            metrics['bytes_%d_us' % size] = elapsed / count * 1e6
+    return metrics
+
+
+CALLBACK_DEPTHS = (1, 4, 16, 64)
+
+
+def bench_callbacks(run):
+    """
+    Time of a call bouncing between the sides to each depth
+    """
+    rbounce = run.test.bounce(run.client)
+    bouncer = Bouncer(rbounce)
+
+    metrics = {}
+    for depth in CALLBACK_DEPTHS:
+        count = run.count(max(10, 1000 // depth))
+        elapsed = timed(lambda depth=depth: rbounce(bouncer, depth), count)
+        metrics['depth_%d_us' % depth] = elapsed / count * 1e6
+    return metrics
+
+
+def bench_proxies(run):
+    """
+    Rates of creating remote objects and of releasing their proxies
+    """
+    factory = run.test.concat_factory(run.client)
+    count = run.count(2000)
+
+    start = time.perf_counter()
+    proxies = [factory('x') for _ in range(count)]
+    created = time.perf_counter() - start
+
+    start = time.perf_counter()
+    del proxies[:]
+    gc.collect()
+    run.client.ping()
+    released = time.perf_counter() - start
+
+    return {
+        'created_per_s': count / created,
+        'released_per_s': count / released,
+    }
+
+
+CONCURRENT_CLIENTS = (1, 2, 4, 8)
+
+
+def bench_concurrency(run):
+    """
+    Method calls per second with several clients calling at once
+    """
+    metrics = {}
+    count = run.count(1000)
+    for clients in CONCURRENT_CLIENTS:
+        endpoints = [run.server_client.client() for _ in range(clients)]
+        robjs = [run.test.concat_object(endpoint) for endpoint in endpoints]
+        threads = [
+            threading.Thread(target=timed,
+                             args=(lambda robj=robj: robj.concat('x'), count))
+            for robj in robjs
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        metrics['clients_%d_calls_per_s' % clients] = \
+            clients * count / elapsed
+        del robjs[:]
+        for endpoint in endpoints:
+            endpoint.close()
+    return metrics
+
+
+BENCHMARKS = {
+    'latency': bench_latency,
+    'throughput': bench_throughput,
+    'payload': bench_payload,
+    'callbacks': bench_callbacks,
+    'proxies': bench_proxies,
+    'concurrency': bench_concurrency,
+}
+
+
+def run_backend(name, benchmarks, scale):
+    """
+    Run the benchmarks against a backend, returning the results
+    """
+    backend = BACKENDS[name]
+    results = []
+    server_client = backend.server_client()
+    with server_client as client:
+        run = Run(backend, server_client, client, scale)
+        for benchmark in benchmarks:
+            if benchmark == 'concurrency' and not backend.concurrent:
+                continue
+            metrics = BENCHMARKS[benchmark](run)
+            results.append({
+                'backend': name,
+                'benchmark': benchmark,
+                'metrics': metrics,
+            })
+            for (metric, value) in sorted(metrics.items()):
+                print("%-20s %-12s %-28s %14.3f" %
+                      (name, benchmark, metric, value), file=sys.stderr)
+    return results
+
+
+def metadata():
+    """
+    Describe the code and the environment measured
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'msgpack': msgpack is not None,
+    }
+
+
+def main(argv=None):
+    """
+    Run the benchmarks and write the results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help="backend to measure (default: all available)")
+    parser.add_argument('--benchmark', action='append', choices=BENCHMARKS,
+                        help="benchmark to run (default: all)")
+    parser.add_argument('--quick', action='store_true',
+                        help="run a tenth of the repetitions")
+    parser.add_argument('--output', help="file to write the results to "
+                        "(default: standard output)")
+    args = parser.parse_args(argv)
+
+    backends = args.backend or \
+        [name for (name, backend) in BACKENDS.items() if backend.available()]
+    benchmarks = args.benchmark or list(BENCHMARKS)
+    scale = 0.1 if args.quick else 1
+
+    results = []
+    errors = {}
+    for name in backends:
+        try:
+            results.extend(run_backend(name, benchmarks, scale))
+        except (OSError, RemoteError, TransportException,
+                pytest.fail.Exception) as exc:
+            # The server could not be started or broke down
+            errors[name] = str(exc)
+            print("%-20s failed: %s" % (name, exc), file=sys.stderr)
+
+    report = {
+        'meta': metadata(),
+        'results': results,
+        'errors': errors,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,592 @@
+"""
+Endpoints running on an asyncio event loop
+
+Every outgoing call is tagged, so any number of calls can be outstanding on
+a single connection. The commands arriving from the remote side are handled
+by the same handlers as in Endpoint; the ones returning awaitables (such as
+the calls to coroutine functions) are awaited in separate tasks, so they can
+call back to the remote side. Methods of remote objects return awaitables:
+
+    client = await eurydice.asyncio.connect(('localhost', 5000))
+    robjects = await client.use('tests.objects')
+    robj = await robjects.Concat('one')
+    result = await robj.concat('two')
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import collections
+import inspect
+import socket
+
+from eurydice.cache import MISSING
+from eurydice.common import RemoteSnapshot, TransportException, clock
+from eurydice.endpoint import RECEIVE_AGAIN, Endpoint, Future, RemoteError, \
+    import_module
+from eurydice.socket import parse_address
+from eurydice.transport import JSONCoding, SocketFrameTransport
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class AsyncTransport(JSONCoding):
+    """
+    Base class for transports used with asyncio
+
+    Messages are sent without waiting, so that the command handlers shared
+    with Endpoint can reply; drain() waits for them to be written out.
+    """
+    def send(self, command, *args):
+        """
+        Send a command to the remote side
+        """
+        message = [command]
+        message.extend(args)
+        self.send_message(message)
+
+    def send_message(self, message):
+        """
+        Send a message - a list of the command and its arguments - to the
+        remote side
+        """
+        stats = self.endpoint.stats
+        if stats is not None:
+            start = clock()
+        chunk = self.compress(self.serializer.encode(message))
+        if stats is not None:
+            stats.sent(len(chunk), clock() - start)
+        self.write_chunk(chunk)
+
+    async def receive(self):
+        """
+        Receive a command from the remote side
+        """
+        try:
+            chunk = await self.receive_chunk()
+        except IOError as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+        stats = self.endpoint.stats
+        if stats is None:
+            return self.parse(self.decompress(chunk))
+        start = clock()
+        result = self.parse(self.decompress(chunk))
+        stats.received(len(chunk), clock() - start)
+        return result
+
+    async def close(self):
+        """
+        Close the underlying connection
+        """
+        raise NotImplementedError("Please override close().")
+
+    def write_chunk(self, chunk):
+        """
+        Queue a chunk of data to be sent across
+        """
+        raise NotImplementedError("Please override write_chunk().")
+
+    async def drain(self):
+        """
+        Wait for the chunks queued to be sent
+        """
+        raise NotImplementedError("Please override drain().")
+
+    async def receive_chunk(self):
+        """
+        Receive a chunk of data
+        """
+        raise NotImplementedError("Please override receive_chunk().")
+
+
+class AsyncSocketTransport(AsyncTransport):
+    """
+    Transport sending length-prefixed messages through asyncio streams
+    """
+    HEADER = SocketFrameTransport.HEADER
+
+    binary = True
+
+    def __init__(self, reader, writer, endpoint):
+        super(AsyncSocketTransport, self).__init__(endpoint)
+        self.reader = reader
+        self.writer = writer
+
+    def write_chunk(self, chunk):
+        if self.writer.is_closing():
+            raise TransportException("Connection closed.")
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        # Both parts are buffered at once, so messages never interleave
+        self.writer.writelines([self.HEADER.pack(len(chunk)), chunk])
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except IOError as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+
+    async def receive_chunk(self):
+        try:
+            header = await self.reader.readexactly(self.HEADER.size)
+            (size,) = self.HEADER.unpack(header)
+            self.check_size(size)
+            return await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise TransportException("Connection closed.")
+
+    async def close(self):
+        self.writer.close()
+
+
+class AsyncWebSocketTransport(AsyncTransport):
+    """
+    Transport communicating through a websocket from the 'websockets'
+    library. The messages are sent in order by a task of their own.
+    """
+    binary = True
+
+    def __init__(self, websocket, endpoint):
+        super(AsyncWebSocketTransport, self).__init__(endpoint)
+        self.websocket = websocket
+        self.outgoing = asyncio.Queue()
+        self.sender = None
+        self.error = None
+
+    def write_chunk(self, chunk):
+        if self.error is not None:
+            raise self.error
+        if self.sender is None:
+            self.sender = asyncio.ensure_future(self._send_queued())
+        self.outgoing.put_nowait(chunk)
+
+    async def _send_queued(self):
+        """
+        Send the queued chunks, until the connection fails
+        """
+        while True:
+            chunk = await self.outgoing.get()
+            try:
+                if self.error is None:
+                    await self.websocket.send(chunk)
+            except Exception as exc:  # pylint:disable=broad-except
+                # Nothing is sent past a failure
+                self.error = TransportException(
+                    "Transport error: '%s'" % exc)
+            finally:
+                self.outgoing.task_done()
+
+    async def drain(self):
+        await self.outgoing.join()
+        if self.error is not None:
+            raise self.error
+
+    async def receive_chunk(self):
+        try:
+            return await self.websocket.recv()
+        except websockets.ConnectionClosed as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+
+    async def close(self):
+        if self.sender is not None:
+            self.sender.cancel()
+        await self.websocket.close()
+
+
+class AsyncFuture(Future):
+    """
+    The result of a tagged command sent from an event loop, to be awaited
+    """
+    def __init__(self, endpoint):
+        super(AsyncFuture, self).__init__(endpoint)
+        self.future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, command, value, elapsed=None):
+        super(AsyncFuture, self).resolve(command, value, elapsed)
+        if self.future.done():
+            return
+        if command == 'error':
+            self.future.set_exception(RemoteError(value))
+        else:
+            self.future.set_result(value)
+
+    def fail(self, exc):
+        """
+        Fail the call as the connection is lost
+        """
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+    def __await__(self):
+        return self.future.__await__()
+
+    def wait(self):
+        raise TransportException("Await the result on the event loop.")
+
+
+class AsyncEndpoint(Endpoint):
+    """
+    An endpoint processing the commands from the remote side on an event
+    loop
+
+    The commands are handled as in Endpoint, only sending and receiving
+    differ; the methods sending commands are coroutines.
+    """
+    # The API of Endpoint, made of coroutines
+    # pylint:disable=invalid-overridden-method
+    future_class = AsyncFuture
+
+    def __init__(self):
+        super(AsyncEndpoint, self).__init__(None)
+        # Futures waiting for untagged replies, innermost last
+        self.untagged = []
+        self.reader = None
+        self.tasks = set()
+        self.flush_scheduled = False
+
+    def start(self, transport):
+        """
+        Start processing the commands arriving through the transport
+        """
+        self.transport = transport
+        self.reader = asyncio.ensure_future(self.serve_forever())
+
+    async def serve_forever(self):
+        """
+        Process the commands from the remote side until the connection
+        is closed or a message cannot be processed
+        """
+        try:
+            while True:
+                (command, args) = await self.transport.receive()
+                self._handle(command, args)
+        except Exception as exc:  # pylint:disable=broad-except
+            if not isinstance(exc, TransportException):
+                exc = TransportException("Invalid data received: %r" % exc)
+            self._fail_pending(exc)
+            # The session is over, nothing can reference the objects
+            self.objects.clear()
+
+    def _handle(self, command, args):
+        """
+        Act on a command, handing an untagged reply to the call waiting
+        for it
+        """
+        try:
+            value = self._dispatch(command, args)
+        except RemoteError as exc:
+            (command, value) = ('error', str(exc))
+        else:
+            if value is RECEIVE_AGAIN:
+                return
+            command = 'return'
+        if not self.untagged:
+            raise TransportException("Unexpected untagged reply.")
+        self.untagged.pop().resolve(command, value)
+
+    def _fail_pending(self, exc):
+        """
+        Fail all the calls waiting for the replies
+        """
+        futures = list(self.pending.values()) + self.untagged
+        self.pending.clear()
+        del self.untagged[:]
+        for future in futures:
+            future.fail(exc)
+
+    async def close(self):
+        """
+        Close the connection
+        """
+        self.modules.clear()
+        self.objects.clear()
+        await self.transport.close()
+        if self.reader is not None:
+            self.reader.cancel()
+        self._fail_pending(TransportException("Connection closed."))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    async def _send_receive(self, command, *args):
+        """
+        Send a command tagged with a correlation ID and wait for the reply
+        """
+        future = self._send_tagged(command, *args)
+        await self.transport.drain()
+        return await future
+
+    def _reply(self, tag, command, value, elapsed=None):
+        """
+        Send the reply to a command, once the value is resolved if it is
+        awaitable
+        """
+        if inspect.isawaitable(value):
+            self._spawn(self._reply_awaited(tag, value, elapsed))
+        else:
+            super(AsyncEndpoint, self)._reply(tag, command, value, elapsed)
+
+    async def _reply_awaited(self, tag, value, elapsed):
+        """
+        Await the value of a command and send the reply
+        """
+        start = clock()
+        try:
+            value = await value
+            command = 'return'
+        except Exception as exc:  # pylint:disable=broad-except
+            (command, value) = ('error', str(exc))
+        if elapsed is not None:
+            elapsed += clock() - start
+        try:
+            self._reply(tag, command, value, elapsed)
+        except TransportException:
+            # The connection is lost, nobody to reply to
+            pass
+
+    def _spawn(self, coroutine):
+        """
+        Run a coroutine in a separate task, keeping a reference to it
+        """
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handshake(self):
+        """
+        Agree on the protocol options with the remote side, see
+        Endpoint.handshake()
+        """
+        options = self._hello_options()
+        if not options:
+            return
+        future = self.future_class(self)
+        self.untagged.append(future)
+        self._send('hello', options)
+        await self.transport.drain()
+        try:
+            accepted = await future
+        except RemoteError:
+            accepted = {}
+        self._configure(accepted)
+
+    async def use(self, module):
+        """
+        Import a module. The proxy is reused for the rest of the session.
+        """
+        if module not in self.modules:
+            self.modules[module] = await self._send_receive('import', module)
+        return self.modules[module]
+
+    async def get_attr(self, obj, name):
+        """
+        Return the value of an attribute of an object, without a round trip
+        for the public attributes of immutable objects
+        """
+        if isinstance(obj, RemoteSnapshot):
+            fields = obj._fields  # pylint:disable=protected-access
+            if name in fields:
+                return fields[name]
+        return await self._send_receive('getattr', obj, name)
+
+    async def call_method(self, obj, method, args):
+        """
+        Call a method on an object, with the arguments as a sequence. The
+        results of pure methods are cached if the endpoint has a cache.
+        """
+        cache = self.cache
+        if cache is None:
+            return await self._call_method(obj, method, args)
+        key = cache.key(obj, method, args)
+        if key is None:
+            return await self._call_method(obj, method, args)
+        value = cache.lookup(key)
+        if value is MISSING:
+            value = await self._call_method(obj, method, args)
+            cache.store(key, value)
+        return value
+
+    async def _call_method(self, obj, method, args):
+        """
+        Send a method call and wait for the result
+        """
+        future = self.call_future(obj, method, *args)
+        await self.transport.drain()
+        return await future
+
+    async def iterate(self, obj, chunk_size=None, prefetch=None):
+        """
+        Iterate over a remote iterable, fetching the items in chunks. While
+        a chunk is processed, up to 'prefetch' next ones are requested in
+        the background.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if prefetch is None:
+            prefetch = self.prefetch
+
+        (iterator, items, done) = \
+            await self._send_receive('iter', obj, chunk_size)
+        requested = collections.deque()
+        while True:
+            while not done and len(requested) < prefetch:
+                requested.append(
+                    self._send_tagged('next_chunk', iterator, chunk_size))
+            for item in items:
+                yield item
+            if not requested:
+                if done:
+                    return
+                requested.append(
+                    self._send_tagged('next_chunk', iterator, chunk_size))
+            (items, done) = await requested.popleft()
+
+    def batch(self):
+        """
+        Not available on an event loop, gather the calls instead
+        """
+        raise NotImplementedError("Use asyncio.gather() instead.")
+
+    def release(self, obj_id, count=1):
+        """
+        Queue the references to the remote object with the ID to be deleted
+        on the remote side, once its proxy is garbage collected.
+        Safe to call from any thread; the references released during an
+        iteration of the event loop are sent together as a single
+        'delete_many' command.
+        """
+        super(AsyncEndpoint, self).release(obj_id, count)
+        if self.flush_scheduled or self.reader is None or self.reader.done():
+            return
+        self.flush_scheduled = True
+        try:
+            self.reader.get_loop().call_soon_threadsafe(self._flush_scheduled)
+        except RuntimeError:
+            # The event loop is closed
+            pass
+
+    def _flush_scheduled(self):
+        """
+        Send the references released since the flush was scheduled
+        """
+        self.flush_scheduled = False
+        try:
+            self.flush_released()
+        except TransportException:
+            pass
+
+
+# Seconds to wait for the reply to the handshake before connecting again
+# without one, for the servers not knowing about it
+HANDSHAKE_TIMEOUT = 10
+
+
+async def _handshake(endpoint, reconnect):
+    """
+    Make the handshake on a new connection, returning the endpoint to use:
+    a new one connected without a handshake if the remote side dropped the
+    connection or did not reply
+    """
+    try:
+        await asyncio.wait_for(endpoint.handshake(), HANDSHAKE_TIMEOUT)
+    except (TransportException, asyncio.TimeoutError):
+        await endpoint.close()
+        endpoint = await reconnect()
+    return endpoint
+
+
+async def connect(address, serializers=None, compression=(), stats=None):
+    """
+    Connect to a socket server, returning the started endpoint. The address
+    is a (host, port) tuple or a URL, see eurydice.socket.parse_address().
+    The serializers and the compression codecs to offer, and the statistics
+    to collect, are as for eurydice.socket.Client.
+    """
+    (family, address) = parse_address(address)
+
+    async def start():
+        """
+        Connect an endpoint
+        """
+        if family == socket.AF_UNIX:
+            (reader, writer) = await asyncio.open_unix_connection(address)
+        else:
+            (reader, writer) = await asyncio.open_connection(*address)
+        endpoint = AsyncEndpoint()
+        endpoint.stats = stats
+        endpoint.start(AsyncSocketTransport(reader, writer, endpoint))
+        return endpoint
+
+    endpoint = await start()
+    endpoint.transport.allowed_serializers = serializers
+    endpoint.transport.compression = compression
+    return await _handshake(endpoint, start)
+
+
+async def connect_websocket(url, serializers=None, compression=(),
+                            stats=None):
+    """
+    Connect to a WebSocket server, returning the started endpoint
+    """
+    async def start():
+        """
+        Connect an endpoint
+        """
+        websocket = await websockets.connect(url)
+        endpoint = AsyncEndpoint()
+        endpoint.stats = stats
+        endpoint.start(AsyncWebSocketTransport(websocket, endpoint))
+        return endpoint
+
+    endpoint = await start()
+    endpoint.transport.allowed_serializers = serializers
+    endpoint.transport.compression = compression
+    return await _handshake(endpoint, start)
+
+
+async def _serve_connection(reader, writer):
+    """
+    Serve the commands arriving on a socket connection
+    """
+    endpoint = AsyncEndpoint()
+    endpoint.start(AsyncSocketTransport(reader, writer, endpoint))
+    await endpoint.reader
+    writer.close()
+
+
+async def serve(address, preload=()):
+    """
+    Start a socket server, returning the asyncio Server. The address is a
+    (host, port) tuple or a URL, see eurydice.socket.parse_address().
+    The modules listed in 'preload' are imported beforehand.
+    """
+    for module in preload:
+        import_module(module)
+    (family, address) = parse_address(address)
+    if family == socket.AF_UNIX:
+        return await asyncio.start_unix_server(_serve_connection, address)
+    return await asyncio.start_server(_serve_connection, *address)
+
+
+async def _serve_websocket(websocket, *args):
+    # pylint:disable=unused-argument
+    """
+    Serve the commands arriving through a websocket
+    """
+    endpoint = AsyncEndpoint()
+    endpoint.start(AsyncWebSocketTransport(websocket, endpoint))
+    await endpoint.reader
+
+
+async def serve_websocket(address):
+    """
+    Start a WebSocket server, returning the 'websockets' Server
+    """
+    return await websockets.serve(_serve_websocket, *address)
@@ -0,0 +1,201 @@
+"""
+Caching the results of the calls to pure remote methods
+
+Calls to the methods declared pure are answered from the cache when the same
+method of the same object was called with the same arguments before:
+
+    client.cache = eurydice.cache.ResultCache(max_size=1000, ttl=60)
+    rlocale = client.use('tests.objects').Locale()
+    rlocale.format(1)  # Sent to the remote side
+    rlocale.format(1)  # Answered from the cache
+
+The methods are declared pure by the remote side (see eurydice.pure), by
+the caller for a proxy with cacheable(), or for all the objects by passing
+their names as 'methods'. Only the calls whose arguments are plain values are
+cached, and the cached results are shared between the callers, which must not
+modify them. The results for an object are forgotten once its proxies are
+released, as the remote side can reuse its ID.
+"""
+
+import collections
+import threading
+import time
+
+from eurydice.common import RemoteObject
+
+# Types of the arguments making up the cache keys as they are
+SCALAR_TYPES = (type(None), bool, int, float, str, bytes)
+
+# Returned by ResultCache.lookup() when there is no result cached
+MISSING = object()
+
+
+def argument_key(value):
+    """
+    A hashable value standing for an argument, None if the argument cannot
+    be part of the key. The types are included so that e.g. 1 and True are
+    told apart.
+    """
+    if isinstance(value, SCALAR_TYPES):
+        return (type(value), value)
+    if isinstance(value, (list, tuple)):
+        items = tuple(argument_key(item) for item in value)
+        if None in items:
+            return None
+        return (list, items)
+    if isinstance(value, dict):
+        items = tuple(sorted((key, argument_key(item))
+                             for (key, item) in value.items()
+                             if isinstance(key, str)))
+        if len(items) != len(value) or \
+                any(item is None for (_, item) in items):
+            return None
+        return (dict, items)
+    return None
+
+
+def object_key(obj):
+    """
+    The identity of a remote object in the cache
+    """
+    proxy = obj.ref['_remote_proxy']
+    return (proxy['instance'], proxy['id'])
+
+
+def cacheable(obj, *methods):
+    """
+    Declare methods of a remote object pure, so that the results of calling
+    them through this proxy are cached
+    """
+    # pylint:disable=protected-access
+    obj._pure = frozenset(methods).union(obj._pure or ())
+
+
+class ResultCache(object):
+    """
+    The results of the calls to pure methods, evicting the least recently
+    used ones beyond 'max_size' of them, and the ones older than 'ttl'
+    seconds if given
+    """
+    # The settings, the entries with their index and the hit counters
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, max_size=1024, ttl=None, methods=()):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Names of the methods pure for all the objects
+        self.methods = frozenset(methods)
+        # Results with the times they were stored, by object, method and
+        # arguments, the least recently used first
+        self.entries = collections.OrderedDict()
+        # Keys of the entries by the object ID
+        self.by_id = collections.defaultdict(set)
+        # Shared by the threads of multiplexed endpoints
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, obj, method, args):
+        """
+        The key to cache the result of a call under, None if it is not
+        to be cached
+        """
+        if not isinstance(obj, RemoteObject):
+            return None
+        pure = obj._pure  # pylint:disable=protected-access
+        if method not in self.methods and (pure is None or method not in pure):
+            return None
+        args = argument_key(args)
+        if args is None:
+            return None
+        return (object_key(obj), method, args)
+
+    def fetch(self, key, call):
+        """
+        Return the cached result for the key, or the result of the call,
+        caching it
+        """
+        value = self.lookup(key)
+        if value is MISSING:
+            value = call()
+            self.store(key, value)
+        return value
+
+    def lookup(self, key):
+        """
+        Return the cached result for the key, MISSING if there is none
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                (value, stored) = entry
+                if self.ttl is None or time.time() - stored < self.ttl:
+                    # Most recently used last
+                    del self.entries[key]
+                    self.entries[key] = entry
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+        return MISSING
+
+    def store(self, key, value):
+        """
+        Cache the result for the key
+        """
+        with self.lock:
+            # Most recently used last
+            self.entries.pop(key, None)
+            self.entries[key] = (value, time.time())
+            self.by_id[key[0][1]].add(key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        """
+        Remove an entry, with the lock held
+        """
+        del self.entries[key]
+        keys = self.by_id[key[0][1]]
+        keys.discard(key)
+        if not keys:
+            del self.by_id[key[0][1]]
+
+    def invalidate(self, obj=None, method=None):
+        """
+        Forget the cached results of a method, of all the methods of an
+        object, or of a method of an object. Without either, forget all the
+        results.
+        """
+        obj = None if obj is None else object_key(obj)
+        with self.lock:
+            if obj is None and method is None:
+                self.entries.clear()
+                self.by_id.clear()
+                return
+            if obj is None:
+                keys = list(self.entries)
+            else:
+                keys = list(self.by_id.get(obj[1], ()))
+            for key in keys:
+                if (obj is None or key[0] == obj) and \
+                        (method is None or key[1] == method):
+                    self._remove(key)
+
+    def forget(self, ids):
+        """
+        Forget the cached results for the objects with the given IDs, whose
+        proxies were released
+        """
+        with self.lock:
+            for obj_id in ids:
+                for key in list(self.by_id.get(obj_id, ())):
+                    self._remove(key)
+
+    def clear(self):
+        """
+        Forget all the cached results
+        """
+        self.invalidate()
+
+    def __len__(self):
+        return len(self.entries)
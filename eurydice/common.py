@@ -2,6 +2,14 @@
 Generic routines
 """
 
+import types
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    # Python 2
+    from time import time as clock
+
 
 class TransportException(Exception):
     """
@@ -10,19 +18,168 @@ class TransportException(Exception):
     pass
 
 
+def _mark(obj, name):
+    """
+    Set a flag used by Eurydice on a class or a function
+    """
+    setattr(obj, '_eurydice_' + name, True)
+
+
+def _marked(obj, name):
+    """
+    Check a flag set by _mark()
+    """
+    return getattr(obj, '_eurydice_' + name, False)
+
+
+def immutable(cls):
+    """
+    Class decorator marking the objects of the class as immutable. Their
+    public attributes are sent along with the references to them, and are
+    read on the remote side without a round trip.
+    """
+    _mark(cls, 'immutable')
+    return cls
+
+
+def snapshot_fields(obj):
+    """
+    The public attributes of an immutable object, None for other objects
+    """
+    if not _marked(type(obj), 'immutable'):
+        return None
+    return dict((name, value)
+                for (name, value) in getattr(obj, '__dict__', {}).items()
+                if not name.startswith('_'))
+
+
+def pure(func):
+    """
+    Decorator marking a function or a method as pure: the results of the
+    calls to it only depend on the arguments, and can be cached by the
+    remote side (see eurydice.cache)
+    """
+    _mark(func, 'pure')
+    return func
+
+
+# Names of the pure methods, by class or module
+PURE_METHODS = {}
+
+
+def pure_methods(obj):
+    """
+    The names of the pure methods of an object - or the functions of a
+    module - None if there are none
+    """
+    owner = obj if isinstance(obj, types.ModuleType) else type(obj)
+    try:
+        return PURE_METHODS[owner]
+    except KeyError:
+        pass
+    except TypeError:
+        # Unhashable
+        return None
+    names = sorted(name for name in dir(owner)
+                   if _marked(getattr(owner, name, None), 'pure'))
+    PURE_METHODS[owner] = names = names or None
+    return names
+
+
+def method_stub(method):
+    """
+    A function calling the named method of the remote object it is bound to
+    """
+    def stub(self, *args):
+        """
+        Call the remote method
+        """
+        return self.endpoint.call_method(self, method, args)
+    stub.__name__ = str(method)
+    return stub
+
+
+def endpoint_class(cls):
+    """
+    A subclass of the proxy class to keep the method stubs of a single
+    endpoint on
+    """
+    return type(cls.__name__, (cls,), {
+        '__slots__': (),
+        '__module__': cls.__module__,
+        '_own_stubs': True,
+    })
+
+
 class RemoteObject(object):
     """
     A representation of a transport object
+
+    Methods are called through stubs, created on first use and kept on the
+    class, so subsequent calls don't go through __getattr__ at all. Every
+    endpoint proxies through its own subclasses (see endpoint_class), so the
+    stubs of one endpoint don't show up on the proxies of the others. Names
+    starting with an underscore are not cached, not to define special
+    methods on the class.
+
+    '_pure' holds the names of the methods whose results can be cached.
+
+    The endpoints keep a single proxy for every remote object (see
+    eurydice.registry.ProxyRegistry), so proxies are equal when they stand
+    for the same object.
     """
-    def __init__(self, endpoint, ref):
+    __slots__ = ('endpoint', 'ref', '_pure', '__weakref__')
+
+    def __init__(self, endpoint, ref, pure_names=None):
         self.endpoint = endpoint
         self.ref = ref
+        self._pure = pure_names
 
     def __getattr__(self, method):
-        return lambda *args: self.endpoint.call(self, method, *args)
+        cls = type(self)
+        if hasattr(cls, method):
+            # A slot not set yet, e.g. when __init__ failed
+            raise AttributeError(method)
+        stub = method_stub(method)
+        if not method.startswith('_') and cls.__dict__.get('_own_stubs'):
+            setattr(cls, method, stub)
+        return stub.__get__(self, cls)
+
+    def __iter__(self):
+        return self.endpoint.iterate(self)
+
+    def __aiter__(self):
+        return self.endpoint.iterate(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, RemoteObject):
+            return NotImplemented
+        if self.endpoint is not other.endpoint:
+            return False
+        (proxy, other_proxy) = (self.ref['_remote_proxy'],
+                                other.ref['_remote_proxy'])
+        return (proxy['instance'], proxy['id']) == \
+            (other_proxy['instance'], other_proxy['id'])
+
+    def __hash__(self):
+        proxy = self.ref['_remote_proxy']
+        return hash((proxy['instance'], proxy['id']))
+
+
+class RemoteSnapshot(RemoteObject):
+    """
+    A representation of an immutable remote object, with its public
+    attributes available locally
+    """
+    __slots__ = ('_fields',)
+
+    def __init__(self, endpoint, ref, fields, pure_names=None):
+        super(RemoteSnapshot, self).__init__(endpoint, ref, pure_names)
+        self._fields = fields
 
-    def __del__(self):
-        try:
-            self.endpoint.delete(self)
-        except TransportException:
-            pass
+    def __getattribute__(self, name):
+        if not name.startswith('_'):
+            fields = object.__getattribute__(self, '_fields')
+            if name in fields:
+                return fields[name]
+        return object.__getattribute__(self, name)
@@ -0,0 +1,91 @@
+"""
+Codecs compressing large messages
+
+Clients offer the codecs to use in the handshake, and the remote side picks
+the first one it knows. Messages of at least the transport's
+'compression_threshold' bytes are then sent compressed, prefixed with a zero
+byte, which neither JSON nor MessagePack messages start with.
+"""
+
+import zlib
+
+# Prefix of the compressed messages
+COMPRESSED = b'\x00'
+
+# Preset dictionary with the strings repeated in most messages, in the ways
+# each language writes them. Shared by all the implementations, so never to
+# be changed; use a codec with a new name instead.
+DICTIONARY = (
+    b'{"_remote_proxy":{"instance":"server","id":'
+    b'{"_remote_proxy":{"id":,"instance":"PY0.","fields":{"pure":['
+    b'"delete_many",["context",["tagged",["call",["return",'
+    b'{"_remote_proxy": {"id": , "instance": "PY0.'
+)
+
+
+class ZlibCodec(object):
+    """
+    Compression with zlib
+    """
+    name = 'zlib'
+
+    # Preset dictionary, if any
+    dictionary = None
+
+    level = 6
+
+    def compress(self, data):
+        """
+        Compress a message
+        """
+        if self.dictionary is None:
+            return zlib.compress(data, self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data, limit=None):
+        """
+        Decompress a message, raising ValueError if it is invalid. With a
+        limit, at most one byte more than it is decompressed, so that larger
+        messages can be refused without inflating them whole.
+        """
+        if isinstance(data, memoryview) and bytes is str:
+            # Python 2's zlib only takes strings
+            data = data.tobytes()
+        try:
+            if self.dictionary is None:
+                decompressor = zlib.decompressobj()
+            else:
+                decompressor = zlib.decompressobj(zdict=self.dictionary)
+            if limit is None:
+                output = decompressor.decompress(data) + decompressor.flush()
+            else:
+                output = decompressor.decompress(data, limit + 1)
+                if len(output) > limit:
+                    return output
+        except zlib.error as exc:
+            raise ValueError(str(exc))
+        # Python 2 cannot tell whether the data was complete
+        if not getattr(decompressor, 'eof', True):
+            raise ValueError("Incomplete compressed data")
+        return output
+
+
+class ZlibDictionaryCodec(ZlibCodec):
+    """
+    Compression with zlib, using the preset dictionary of the strings common
+    to all messages, so that even short messages shrink
+    """
+    name = 'zlib-dict'
+
+    dictionary = DICTIONARY
+
+
+# Available codecs in the order of preference; Python 2's zlib has no preset
+# dictionaries
+try:
+    zlib.compressobj(zdict=DICTIONARY)
+except TypeError:
+    CODECS = [ZlibCodec]
+else:
+    CODECS = [ZlibDictionaryCodec, ZlibCodec]
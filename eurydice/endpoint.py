@@ -4,9 +4,17 @@ Shared code for endpoints - clients and servers
 
 from functools import wraps
 
+import collections
+
 import importlib
 
-from eurydice.common import TransportException
+import itertools
+
+import threading
+
+from eurydice.common import RemoteObject, RemoteSnapshot, \
+    TransportException, clock, endpoint_class
+from eurydice.registry import ObjectRegistry, ProxyRegistry
 
 
 class RemoteError(Exception):
@@ -21,25 +29,34 @@ def callback(func):
     Within Endpoint, execute a function, send its result (or an error)
     back and continue listening for the next command
     """
+    # A function wrapped with unpack_args is called directly, saving a call
+    unpacked = getattr(func, 'unpacked', None)
+
     @wraps(func)
-    def decorated(self, *args):
+    def decorated(self, args, tag=None):
         """
         Wrapped function
         """
+        start = clock() if self.timing else None
         try:
-            val = func(self, *args)
+            if unpacked is None:
+                val = func(self, args)
+            else:
+                val = unpacked(self, *args)
             returned = True
         except Exception as exc:  # pylint:disable=broad-except
             val = exc
             returned = False
+        elapsed = None if start is None else clock() - start
 
         # pylint:disable=protected-access
         # This will be a part of the Endpoint class
         if returned:
-            self._send('return', val)
+            self._reply(tag, 'return', val, elapsed)
         else:
-            self._send('error', str(val))
+            self._reply(tag, 'error', str(val), elapsed)
         return RECEIVE_AGAIN
+    decorated.callback = True
     return decorated
 
 
@@ -53,41 +70,341 @@ def unpack_args(func):
         Wrapped function
         """
         return func(self, *args)
+    decorated.unpacked = func
     return decorated
 
 
 RECEIVE_AGAIN = object()
 
 
+def class_commands(cls):
+    """
+    The handlers of the commands of an endpoint class, its methods named
+    'command_<name>', by the command name. Built once for every class.
+    """
+    table = cls.__dict__.get('_command_table')
+    if table is None:
+        table = dict((name[len('command_'):], getattr(cls, name))
+                     for name in dir(cls) if name.startswith('command_'))
+        setattr(cls, '_command_table', table)
+    return table
+
+
+# The endpoint serving in the current thread
+serving = threading.local()  # pylint:disable=invalid-name
+
+
+def current():
+    """
+    The endpoint serving the commands in the current thread, for the code
+    called from the remote side to send commands back, e.g. invalidate().
+    None outside of serve_forever().
+    """
+    return getattr(serving, 'endpoint', None)
+
+
+def next_chunk(iterator, size):
+    """
+    Take up to 'size' items from an iterator, returning them and whether the
+    iterator is exhausted
+    """
+    items = list(itertools.islice(iterator, size))
+    return [items, len(items) < size]
+
+
+# Modules imported for the remote side, shared by all the sessions in the
+# process, so that every session gets the same module objects
+MODULES = {}
+
+
+def import_module(module):
+    """
+    Import a module for the remote side, once per process
+    """
+    try:
+        return MODULES[module]
+    except KeyError:
+        return MODULES.setdefault(module, importlib.import_module(module))
+
+
+def preload(modules):
+    """
+    Import the modules before serving any session. Servers forking worker
+    processes preload them beforehand, so that the workers share them.
+    """
+    for module in modules:
+        import_module(module)
+
+
+class Future(object):
+    """
+    The result of a call, available once the remote side replies
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.done = False
+        self.value = None
+        self.error = None
+        # The method called and the time of the call, if traced
+        self.method = None
+        self.started = None
+
+    def resolve(self, command, value, elapsed=None):
+        """
+        Store the reply received from the remote side, along with the time
+        the remote side took if it reported it
+        """
+        stats = self.endpoint.stats
+        if stats is not None:
+            if elapsed is not None:
+                stats.executed(elapsed)
+            if self.started is not None:
+                stats.called(self.method, clock() - self.started)
+        self.done = True
+        if command == 'error':
+            self.error = value
+        else:
+            self.value = value
+
+    def wait(self):
+        """
+        Process the incoming commands until the reply arrives
+        """
+        # pylint:disable=protected-access
+        self.endpoint._wait(self)
+
+    def result(self):
+        """
+        Return the value of the call, waiting for it if necessary
+        """
+        self.wait()
+        if self.error is not None:
+            raise RemoteError(self.error)
+        return self.value
+
+
+class Batch(object):
+    """
+    Calls sent to the remote side without waiting for each reply. The
+    replies are collected on leaving the context.
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.futures = []
+
+    def get_attr(self, obj, name):
+        """
+        Read an attribute of an object, returning a Future. The public
+        attributes of immutable objects are resolved without a round trip.
+        """
+        if isinstance(obj, RemoteSnapshot):
+            fields = obj._fields  # pylint:disable=protected-access
+            if name in fields:
+                future = Future(self.endpoint)
+                future.resolve('return', fields[name])
+                return future
+        return self._send('getattr', obj, name)
+
+    def set_attr(self, obj, name, value):
+        """
+        Set an attribute of an object, returning a Future
+        """
+        return self._send('setattr', obj, name, value)
+
+    def call(self, obj, method, *args):
+        """
+        Call a method on an object, returning a Future
+        """
+        future = self.endpoint.call_future(obj, method, *args)
+        self.futures.append(future)
+        return future
+
+    def _send(self, command, *args):
+        """
+        Send a tagged command, returning a Future
+        """
+        # pylint:disable=protected-access
+        future = self.endpoint._send_tagged(command, *args)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """
+        Wait for the replies to all the calls
+        """
+        for future in self.futures:
+            future.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.wait()
+        return False
+
+
 class Endpoint(object):
     """
     Base class for clients and servers
     """
+    # The session state and the public API of the protocol belong together
+    # pylint:disable=too-many-instance-attributes,too-many-public-methods
+    # Class of the proxies for the remote objects
+    remote_object = RemoteObject
+    # Class of the proxies for the immutable remote objects
+    remote_snapshot = RemoteSnapshot
+    # Class of the results of the tagged commands
+    future_class = Future
+
+    # Number of released references sent without waiting for another command
+    release_batch = 100
+
+    # Number of items fetched at once when iterating over remote objects, and
+    # the number of chunks requested in advance
+    chunk_size = 100
+    prefetch = 1
+
+    # Statistics to collect, see eurydice.stats
+    stats = None
+
+    # Cached results of the calls to pure methods, see eurydice.cache
+    cache = None
+
     def __init__(self, transport):
-        self.objects = {}
+        self.objects = ObjectRegistry()
+        self.proxies = ProxyRegistry(self.release)
         self.transport = transport
+        # Futures waiting for the replies to tagged commands
+        self.pending = {}
+        self.tags = itertools.count()
+        # Context of the command being processed, see _receive_one
+        self.context = None
+        # Replies which arrived for a context waiting further up the stack
+        self.stashed = {}
+        # Proxies for the modules imported in this session
+        self.modules = {}
+        # IDs of the remote objects no longer referenced, see release()
+        self.released = collections.deque()
+        # Whether the replies carry the time taken to execute the commands,
+        # as agreed upon in the handshake
+        self.timing = False
+        self.commands = self.command_table()
+        # Proxy classes holding the method stubs of this endpoint
+        self.remote_object = endpoint_class(self.remote_object)
+        self.remote_snapshot = endpoint_class(self.remote_snapshot)
+
+    @classmethod
+    def command_table(cls):
+        """
+        The handlers of the commands, see class_commands()
+        """
+        return class_commands(cls)
 
     def _send(self, command, *args):
         """
-        Send a command to the remote side
+        Send a command to the remote side, in the current context if there
+        is one
         """
-        self.transport.send(command, *args)
+        message = [command]
+        message.extend(args)
+        self._send_message(message)
+
+    def _send_message(self, message):
+        """
+        Send a message - a list of the command and its arguments - to the
+        remote side, in the current context if there is one
+        """
+        self.flush_released()
+        if self.context is not None:
+            message = ['context', self.context] + message
+        self.transport.send_message(message)
+
+    def _send_tagged(self, command, *args):
+        """
+        Send a command tagged with a correlation ID, returning the Future
+        for its reply
+        """
+        tag = next(self.tags)
+        future = self.future_class(self)
+        self.pending[tag] = future
+        self._send('tagged', tag, command, *args)
+        return future
+
+    def _reply(self, tag, command, value, elapsed=None):
+        """
+        Send the reply to a command, tagged if the command was, with the
+        time taken to execute it if known
+        """
+        message = [command, value]
+        if elapsed is not None:
+            message.append(elapsed)
+        if tag is not None:
+            message = ['tagged', tag] + message
+        self._send_message(message)
+
+    def _receive_one(self):
+        """
+        Receive a single command from the remote side and act on it
+
+        Commands can be wrapped as ['context', context, command, ...] by
+        clients issuing calls from several threads. The context is kept
+        while the command is processed, so the replies and the nested calls
+        are sent in it as well. An untagged reply in a context other than
+        the one waiting is kept until the call waiting for it is on top of
+        the stack again.
+        """
+        if len(self.released) >= self.release_batch:
+            self.flush_released()
+
+        context = self.context
+        if context in self.stashed:
+            (command, args) = self.stashed.pop(context)
+        else:
+            (command, args) = self.transport.receive()
+            if command == 'context':
+                (context, command), args = args[:2], args[2:]
+
+            if command in ('return', 'error') and context != self.context:
+                self.stashed[context] = (command, args)
+                return RECEIVE_AGAIN
+
+        outer = self.context
+        self.context = context
+        try:
+            return self._dispatch(command, args)
+        finally:
+            self.context = outer
+
+    def _dispatch(self, command, args):
+        """
+        Act on a command received from the remote side
+        """
+        handler = self.commands.get(command)
+        if handler is None:
+            self._send('error', "Invalid command: '%s'" % command)
+            return RECEIVE_AGAIN
+        return handler(self, args)
 
     def _receive(self):
         """
-        Receive a command from the remote side and act on it
+        Receive commands from the remote side and act on them until a
+        result arrives
         """
         result = RECEIVE_AGAIN
         while result is RECEIVE_AGAIN:
-            (command, args) = self.transport.receive()
-
-            command_function = 'command_%s' % command
-            if hasattr(self, command_function):
-                result = getattr(self, command_function)(args)
-            else:
-                raise TransportException("Invalid command: '%s'" % command)
+            result = self._receive_one()
         return result
 
+    def _wait(self, future):
+        """
+        Receive commands from the remote side and act on them until the
+        future is resolved
+        """
+        while not future.done:
+            if self._receive_one() is not RECEIVE_AGAIN:
+                raise TransportException("Unexpected untagged reply.")
+
     def _send_receive(self, command, *args):
         """
         Send a command to the remote side and return the result received
@@ -95,11 +412,61 @@ class Endpoint(object):
         self._send(command, *args)
         return self._receive()
 
+    def handshake(self):
+        """
+        Agree on the protocol options with the remote side. Peers not
+        knowing about the handshake and replying with an error are talked
+        to with the defaults (JSON). The ones dropping the connection, or
+        never replying, make it raise TransportException instead; the
+        clients then connect again without a handshake.
+        """
+        options = self._hello_options()
+        if not options:
+            return
+        try:
+            accepted = self._send_receive('hello', options)
+        except RemoteError:
+            accepted = {}
+        self._configure(accepted)
+
+    def _hello_options(self):
+        """
+        The options to offer in the handshake, none if there is nothing to
+        agree upon
+        """
+        options = self.transport.options()
+        if self.stats is not None and self.stats.remote_time:
+            options['timing'] = True
+        return options
+
+    def _configure(self, accepted):
+        """
+        Switch to the options the remote side accepted in the handshake
+        """
+        self.transport.configure(accepted)
+        self.timing = bool(accepted.get('timing'))
+
     def use(self, module):
         """
-        Import a module
+        Import a module. The proxy is reused for the rest of the session.
+        """
+        if module not in self.modules:
+            self.modules[module] = self._send_receive('import', module)
+        return self.modules[module]
+
+    def ping(self):
+        """
+        Check the remote side is responding
+        """
+        return self._send_receive('ping')
+
+    def close(self):
+        """
+        Close the connection to the remote side
         """
-        return self._send_receive('import', module)
+        self.modules.clear()
+        self.objects.clear()
+        self.transport.close()
 
     def get_global(self, obj):
         """
@@ -107,11 +474,101 @@ class Endpoint(object):
         """
         return self._send_receive('global', obj)
 
+    def get_attr(self, obj, name):
+        """
+        Return the value of an attribute of an object, without a round trip
+        for the public attributes of immutable objects
+        """
+        if isinstance(obj, RemoteSnapshot):
+            fields = obj._fields  # pylint:disable=protected-access
+            if name in fields:
+                return fields[name]
+        return self._send_receive('getattr', obj, name)
+
+    def set_attr(self, obj, name, value):
+        """
+        Set an attribute of an object
+        """
+        return self._send_receive('setattr', obj, name, value)
+
     def call(self, obj, method, *args):
         """
         Call a method on an object
         """
-        return self._send_receive('call', obj, method, *args)
+        return self.call_method(obj, method, args)
+
+    def call_method(self, obj, method, args):
+        """
+        Call a method on an object, with the arguments as a sequence. The
+        results of pure methods are cached if the endpoint has a cache.
+        """
+        cache = self.cache
+        if cache is not None:
+            key = cache.key(obj, method, args)
+            if key is not None:
+                return cache.fetch(
+                    key, lambda: self._call_method(obj, method, args))
+        return self._call_method(obj, method, args)
+
+    def _call_method(self, obj, method, args):
+        """
+        Send a method call and wait for the result
+        """
+        message = ['call', obj, method]
+        message.extend(args)
+        if self.stats is None:
+            self._send_message(message)
+            return self._receive()
+        start = clock()
+        try:
+            self._send_message(message)
+            return self._receive()
+        finally:
+            self.stats.called(method, clock() - start)
+
+    def call_future(self, obj, method, *args):
+        """
+        Call a method on an object without waiting for the result, returning
+        a Future
+        """
+        if self.stats is None:
+            return self._send_tagged('call', obj, method, *args)
+        started = clock()
+        future = self._send_tagged('call', obj, method, *args)
+        future.method = method
+        future.started = started
+        return future
+
+    def iterate(self, obj, chunk_size=None, prefetch=None):
+        """
+        Iterate over a remote iterable, fetching the items in chunks. While
+        a chunk is processed, up to 'prefetch' next ones are requested.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if prefetch is None:
+            prefetch = self.prefetch
+
+        (iterator, items, done) = self._send_receive('iter', obj, chunk_size)
+        requested = collections.deque()
+        while True:
+            while not done and len(requested) < prefetch:
+                requested.append(self._send_tagged('next_chunk', iterator,
+                                                   chunk_size))
+            for item in items:
+                yield item
+            if not requested:
+                if done:
+                    return
+                requested.append(self._send_tagged('next_chunk', iterator,
+                                                   chunk_size))
+            (items, done) = requested.popleft().result()
+
+    def batch(self):
+        """
+        Start a batch of calls to be sent without waiting for the replies
+        """
+        return Batch(self)
 
     def delete(self, obj):
         """
@@ -119,6 +576,34 @@ class Endpoint(object):
         """
         return self._send_receive('delete', obj)
 
+    def release(self, obj_id, count=1):
+        """
+        Queue the references to the remote object with the ID to be deleted
+        on the remote side. The references are sent together as a single
+        'delete_many' command before the next command sent, or once
+        'release_batch' of them are queued.
+
+        Called when the proxy for the object is garbage collected, which can
+        happen anywhere, including in the middle of sending or receiving
+        another message, so the references are only queued.
+        """
+        self.released.extend([obj_id] * count)
+
+    def flush_released(self):
+        """
+        Send the queued references to be deleted on the remote side
+        """
+        ids = []
+        while True:
+            try:
+                ids.append(self.released.popleft())
+            except IndexError:
+                break
+        if ids:
+            if self.cache is not None:
+                self.cache.forget(ids)
+            self.transport.send('delete_many', ids)
+
     # Command handlers only use 'self' via the decorator
     # pylint:disable=no-self-use
 
@@ -144,7 +629,49 @@ class Endpoint(object):
         """
         Process an 'import module' command
         """
-        return importlib.import_module(module)
+        return import_module(module)
+
+    @callback
+    @unpack_args
+    def command_getattr(self, obj, name):
+        """
+        Process a 'get attribute value' command
+        """
+        return getattr(obj, name)
+
+    @callback
+    @unpack_args
+    def command_setattr(self, obj, name, value):
+        """
+        Process a 'set attribute value' command
+        """
+        setattr(obj, name, value)
+
+    @callback
+    @unpack_args
+    def command_iter(self, obj, size):
+        """
+        Process a 'start iterating' command, returning the iterator and the
+        first chunk of items
+        """
+        iterator = iter(obj)
+        return [iterator] + next_chunk(iterator, size)
+
+    @callback
+    @unpack_args
+    def command_next_chunk(self, iterator, size):
+        """
+        Process a 'get next items' command
+        """
+        return next_chunk(iterator, size)
+
+    @callback
+    @unpack_args
+    def command_ping(self):
+        """
+        Process a 'ping' command
+        """
+        return None
 
     @callback
     def command_delete(self, args):
@@ -153,28 +680,106 @@ class Endpoint(object):
         """
         obj_id = id(args[0])
         del args[0]
-        del self.objects[obj_id]
+        if not self.objects.release(obj_id):
+            raise KeyError("Object not found.")
+
+    @unpack_args
+    def command_delete_many(self, ids):
+        """
+        Release the references to several objects, without replying
+        """
+        for obj_id in ids:
+            self.objects.release(obj_id)
+        return RECEIVE_AGAIN
+
+    def command_tagged(self, args):
+        """
+        Process a command tagged with a correlation ID
+        """
+        (tag, command), args = args[:2], args[2:]
+
+        if command in ('return', 'error'):
+            try:
+                future = self.pending.pop(tag)
+            except KeyError:
+                raise TransportException("Unexpected reply tag: '%s'" % tag)
+            future.resolve(command, *args)
+            return RECEIVE_AGAIN
+
+        handler = self.commands.get(command)
+        if getattr(handler, 'callback', False):
+            return handler(self, args, tag)
+
+        self._reply(tag, 'error', "Invalid command: '%s'" % command)
+        return RECEIVE_AGAIN
+
+    @unpack_args
+    def command_hello(self, options):
+        """
+        Process a handshake, switching to the accepted options after
+        replying
+        """
+        accepted = self.transport.negotiate(options)
+        if options.get('timing'):
+            accepted['timing'] = True
+        self._send('return', accepted)
+        self.transport.configure(accepted)
+        self.timing = bool(accepted.get('timing'))
+        return RECEIVE_AGAIN
+
+    def _executed(self, elapsed):
+        """
+        Record the time the remote side reported taking to execute a command
+        """
+        if elapsed is not None and self.stats is not None:
+            self.stats.executed(elapsed)
 
     @unpack_args
-    def command_error(self, err):
+    def command_error(self, err, elapsed=None):
         """
         Process a 'raise error' command
         """
+        self._executed(elapsed)
         raise RemoteError(err)
 
     @unpack_args
-    def command_return(self, value):
+    def command_return(self, value, elapsed=None):
         """
         Process 'return a value' command
         """
+        self._executed(elapsed)
         return value
 
+    def invalidate(self, obj=None, method=None):
+        """
+        Make the remote side forget the cached results of a method, of all
+        the methods of an object, or of a method of an object; without
+        either, all the cached results
+        """
+        self._send('invalidate', obj, method)
+
+    @unpack_args
+    def command_invalidate(self, obj, method):
+        """
+        Forget the cached results as requested by the remote side, without
+        replying
+        """
+        if self.cache is not None and \
+                (obj is None or isinstance(obj, RemoteObject)):
+            self.cache.invalidate(obj, method)
+        return RECEIVE_AGAIN
+
     def serve_forever(self):
         """
         Indefinitely execute commands from the remote side
         """
+        outer = current()
+        serving.endpoint = self
         try:
             while True:
                 self._receive()
         except TransportException:
-            pass
+            # The session is over, nothing can reference the objects
+            self.objects.clear()
+        finally:
+            serving.endpoint = outer
@@ -0,0 +1,288 @@
+"""
+Incremental JSON decoding
+
+IncrementalDecoder builds a value out of the pieces of its text as they are
+read, instead of parsing the whole text at once, so a message never needs
+to be held as one string next to the value decoded from it:
+
+    decoder = IncrementalDecoder(object_hook=hook)
+    for piece in pieces:
+        decoder.feed(piece)
+    value = decoder.close()
+
+Only the unparsed tail of the text is kept, which is a single token at most
+(a long string can still be as large as the value it stands for). The
+containers found whole in a piece are decoded at once by the json module;
+the hook only runs on them once they are known to be whole.
+"""
+
+import json
+import json.decoder
+import json.scanner
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+# Characters a number can continue with
+NUMBER_PART = re.compile(r'[-+.eE\d]*')
+
+# Literals, as accepted by the json module
+LITERALS = (
+    ('true', True),
+    ('false', False),
+    ('null', None),
+    ('NaN', float('nan')),
+    ('Infinity', float('inf')),
+    ('-Infinity', float('-inf')),
+)
+
+# What the parser expects next
+VALUE, VALUE_OR_CLOSE, KEY, KEY_OR_CLOSE, COLON, COMMA, END = range(7)
+
+
+class IncrementalDecoder(object):
+    """
+    A JSON decoder fed with the text of a value piece by piece
+    """
+    # The parser state is kept between the pieces
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, object_hook=None):
+        self.object_hook = object_hook
+        self.scan = json.scanner.make_scanner(
+            json.JSONDecoder(object_pairs_hook=self.make_object))
+        # Checks whether a container is whole without running the hook,
+        # which can have side effects
+        self.check = json.scanner.make_scanner(json.JSONDecoder())
+        # The keys of the objects, shared between them as by the json module
+        self.memo = {}
+        # The text not parsed yet starts at 'pos'
+        self.text = ''
+        self.pos = 0
+        # Pieces received while waiting for the end of a string, not joined
+        # to the text until it can end
+        self.pending = []
+        # Where to look for the end of the string being waited for, relative
+        # to 'pos', None if not waiting for one
+        self.search = None
+        # Containers being built, the innermost last, with the keys to store
+        # their next values under
+        self.stack = []
+        self.keys = []
+        self.expect = VALUE
+        self.value = None
+
+    def feed(self, text):
+        """
+        Parse the next piece of the text, raising ValueError if it is invalid
+        """
+        if self.search is not None and '"' not in text:
+            self.pending.append(text)
+            return
+        self.pending.append(text)
+        self.text = self.text[self.pos:] + ''.join(self.pending)
+        self.pos = 0
+        self.pending = []
+        self.parse(final=False)
+
+    def close(self):
+        """
+        Return the decoded value, raising ValueError if the text is
+        incomplete
+        """
+        if self.pending:
+            self.text = self.text[self.pos:] + ''.join(self.pending)
+            self.pos = 0
+            self.pending = []
+        self.parse(final=True)
+        if self.expect != END:
+            raise ValueError("Unexpected end of JSON data")
+        return self.value
+
+    def error(self, message):
+        """
+        Raise an error about the current position
+        """
+        raise ValueError("%s: %r" %
+                         (message, self.text[self.pos:self.pos + 20]))
+
+    def parse(self, final):
+        """
+        Parse as much of the text as possible. Unless this is the final
+        piece, a token at the end of the text might be incomplete and is
+        left for the next time.
+        """
+        # pylint:disable=too-many-branches,too-many-statements
+        text = self.text
+        size = len(text)
+        while True:
+            pos = WHITESPACE.match(text, self.pos).end()
+            self.pos = pos
+            if pos == size:
+                return
+            char = text[pos]
+            expect = self.expect
+
+            if expect == END:
+                self.error("Extra data")
+
+            elif expect == COLON:
+                if char != ':':
+                    self.error("Expecting ':'")
+                self.pos = pos + 1
+                self.expect = VALUE
+
+            elif expect == COMMA:
+                if char == ',':
+                    self.pos = pos + 1
+                    self.expect = KEY if self.keys[-1] is not None else VALUE
+                elif char in ']}':
+                    self.pos = pos + 1
+                    self.end_container(char)
+                else:
+                    self.error("Expecting ',' or the end of a container")
+
+            elif expect in (KEY, KEY_OR_CLOSE):
+                if char == '}' and expect == KEY_OR_CLOSE:
+                    self.pos = pos + 1
+                    self.end_container(char)
+                elif char == '"':
+                    key = self.string(final)
+                    if key is None:
+                        return
+                    self.keys[-1] = self.memo.setdefault(key, key)
+                    self.expect = COLON
+                else:
+                    self.error("Expecting a property name")
+
+            elif char == ']' and expect == VALUE_OR_CLOSE:
+                self.pos = pos + 1
+                self.end_container(char)
+            elif char in '[{' and self.whole(pos):
+                pass
+            elif char == '[':
+                self.pos = pos + 1
+                self.stack.append([])
+                self.keys.append(None)
+                self.expect = VALUE_OR_CLOSE
+            elif char == '{':
+                self.pos = pos + 1
+                self.stack.append({})
+                self.keys.append('')
+                self.expect = KEY_OR_CLOSE
+            elif char == '"':
+                value = self.string(final)
+                if value is None:
+                    return
+                self.add(value)
+            else:
+                if not self.scalar(final):
+                    return
+
+    def whole(self, pos):
+        """
+        Decode the container starting at the given position if it is
+        entirely in the text, returning whether it was
+        """
+        try:
+            self.check(self.text, pos)
+        except (StopIteration, ValueError):
+            return False
+        (value, self.pos) = self.scan(self.text, pos)
+        self.add(value)
+        return True
+
+    def make_object(self, pairs):
+        """
+        Create an object decoded by the json module, sharing its keys with
+        the other objects
+        """
+        memo = self.memo
+        obj = dict((memo.setdefault(key, key), value)
+                   for (key, value) in pairs)
+        if self.object_hook is not None:
+            obj = self.object_hook(obj)
+        return obj
+
+    def string(self, final):
+        """
+        Parse a string starting at the current position, returning None if
+        its end has not been received yet
+        """
+        text = self.text
+        start = self.pos
+        search = start + 1 if self.search is None else start + self.search
+        while True:
+            end = text.find('"', search)
+            if end < 0:
+                if final:
+                    self.error("Unterminated string")
+                self.search = len(text) - start
+                return None
+            escapes = 0
+            while text[end - 1 - escapes] == '\\':
+                escapes += 1
+            if escapes % 2 == 0:
+                break
+            search = end + 1
+        self.search = None
+        (value, self.pos) = json.decoder.scanstring(text, start + 1)
+        return value
+
+    def scalar(self, final):
+        """
+        Parse a number or a literal starting at the current position,
+        returning False if it might continue past the end of the text
+        """
+        text = self.text
+        pos = self.pos
+        for (literal, value) in LITERALS:
+            if text.startswith(literal, pos):
+                self.pos = pos + len(literal)
+                self.add(value)
+                return True
+            if not final and len(text) - pos < len(literal) and \
+                    literal.startswith(text[pos:]):
+                return False
+
+        match = NUMBER.match(text, pos)
+        if match is None:
+            self.error("Expecting a value")
+        if not final and \
+                NUMBER_PART.match(text, match.end()).end() == len(text):
+            return False
+        (integer, fraction, exponent) = match.groups()
+        if fraction or exponent:
+            value = float(integer + (fraction or '') + (exponent or ''))
+        else:
+            value = int(integer)
+        self.pos = match.end()
+        self.add(value)
+        return True
+
+    def add(self, value):
+        """
+        Store a complete value in the innermost container
+        """
+        if not self.stack:
+            self.value = value
+            self.expect = END
+            return
+        container = self.stack[-1]
+        key = self.keys[-1]
+        if key is None:
+            container.append(value)
+        else:
+            container[key] = value
+        self.expect = COMMA
+
+    def end_container(self, char):
+        """
+        Finish the innermost container, closed with the given character
+        """
+        container = self.stack.pop()
+        key = self.keys.pop()
+        if (key is None) != (char == ']'):
+            self.error("Mismatched '%s'" % char)
+        if key is not None and self.object_hook is not None:
+            container = self.object_hook(container)
+        self.add(container)
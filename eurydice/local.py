@@ -0,0 +1,189 @@
+"""
+In-process endpoints
+
+A client and a server endpoint in the same interpreter, passing messages
+through queues. The objects in the messages are still converted to proxies
+and back, so they behave as with any other transport, but nothing is
+encoded: the messages are only copied as they would be by JSON.
+
+    client = eurydice.local.Client()
+    robjects = client.use('tests.objects')
+"""
+
+import random
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from eurydice.common import (
+    RemoteObject,
+    TransportException,
+    pure_methods,
+    snapshot_fields,
+)
+from eurydice.endpoint import Endpoint
+from eurydice.multiplex import MultiplexedEndpoint
+from eurydice.serializer import BUFFER_TYPES, Serializer, numpy, proxy_ref
+from eurydice.transport import Transport
+
+# Values passed as they are
+SCALAR_TYPES = (type(None), bool, int, float, str)
+
+
+class LocalSerializer(Serializer):
+    """
+    Serializer replacing the objects in a message with their references and
+    back, without encoding it
+    """
+    name = 'local'
+
+    def __init__(self, endpoint, identity):
+        super(LocalSerializer, self).__init__(endpoint, identity)
+        # Binary data can always be passed along
+        self.buffers = True
+
+    def encode(self, message):
+        """
+        Copy a message, replacing the objects with their references
+        """
+        if isinstance(message, SCALAR_TYPES):
+            return message
+        if isinstance(message, (list, tuple)):
+            return [self.encode(item) for item in message]
+        if isinstance(message, dict):
+            return dict((key, self.encode(value))
+                        for (key, value) in message.items())
+        if isinstance(message, bytes):
+            # Immutable, so can be shared
+            return memoryview(message)
+        if isinstance(message, BUFFER_TYPES):
+            if numpy is not None and isinstance(message, numpy.ndarray):
+                return message.copy()
+            return memoryview(bytearray(message))
+        if isinstance(message, RemoteObject):
+            return message.ref
+        fields = snapshot_fields(message)
+        if fields is not None:
+            fields = self.encode(fields)
+        return proxy_ref(self.identity, self.export(message), fields,
+                         pure_methods(message))
+
+    def decode(self, data):
+        """
+        Replace the references in an encoded message with the objects, in
+        place
+        """
+        if isinstance(data, list):
+            for (index, item) in enumerate(data):
+                data[index] = self.decode(item)
+        elif isinstance(data, dict):
+            # Only a reference alone in a dictionary stands for an object,
+            # anything else is the caller's data
+            if len(data) == 1 and isinstance(data.get('_remote_proxy'), dict):
+                proxy = data['_remote_proxy']
+                if 'fields' in proxy:
+                    proxy['fields'] = self.decode(proxy['fields'])
+                return self.thaw(proxy)
+            for (key, value) in data.items():
+                data[key] = self.decode(value)
+        return data
+
+
+class LocalTransport(Transport):
+    """
+    Transport putting the messages into the queue of the other transport
+    of a pair
+    """
+    def __init__(self, endpoint):
+        super(LocalTransport, self).__init__(endpoint)
+        self.identity = 'PY' + str(random.random())
+        self.serializer = LocalSerializer(endpoint, self.identity)
+        # Received messages, None once the connection is closed
+        self.queue = queue.Queue()
+        self.peer = None
+
+    def connect(self, peer):
+        """
+        Connect the transport to another one
+        """
+        self.peer = peer
+        peer.peer = self
+
+    def options(self):  # pylint:disable=no-self-use
+        """
+        Protocol options to offer to the remote side, none needed
+        """
+        return {}
+
+    def negotiate(self, options):  # pylint:disable=no-self-use,unused-argument
+        """
+        Choose the options to use out of the ones offered by the remote side
+        """
+        return {}
+
+    def configure(self, accepted):
+        """
+        Switch to the options agreed upon with the remote side
+        """
+        pass
+
+    def send_message(self, message):
+        peer = self.peer
+        if peer is None:
+            raise TransportException("Connection closed.")
+        peer.queue.put(self.serializer.encode(message))
+
+    def receive(self):
+        message = self.queue.get()
+        if message is None:
+            raise TransportException("Connection closed.")
+        message = self.serializer.decode(message)
+        command = message.pop(0)
+        return (command, message)
+
+    def close(self):
+        peer = self.peer
+        self.peer = None
+        self.queue.put(None)
+        if peer is not None:
+            peer.peer = None
+            peer.queue.put(None)
+
+
+class LocalEndpoint(Endpoint):
+    """
+    An endpoint using an in-process transport
+    """
+    def __init__(self):
+        super(LocalEndpoint, self).__init__(LocalTransport(self))
+
+
+class Client(LocalEndpoint):
+    """
+    A client connected to a server endpoint serving in a thread of its own
+
+    'stats' is a eurydice.stats.Stats object to collect the statistics of the
+    calls into; the messages are not encoded, so they are not measured.
+    """
+    def __init__(self, stats=None):
+        super(Client, self).__init__()
+        self.server = LocalEndpoint()
+        self.transport.connect(self.server.transport)
+        self.server_thread = threading.Thread(target=self.server.serve_forever,
+                                              name='eurydice-local-server')
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.stats = stats
+        self.handshake()
+
+
+class MultiplexedClient(Client, MultiplexedEndpoint):
+    """
+    An in-process client which can be shared between threads
+    """
+    def __init__(self, stats=None):
+        super(MultiplexedClient, self).__init__(stats)
+        self.start()
@@ -0,0 +1,187 @@
+"""
+Endpoints shared between threads
+
+Every thread sends its commands wrapped as ['context', context, command,
+...], with a context ID of its own. A single reader thread receives all the
+messages and hands each one to the thread whose context it is in, so the
+replies, and the callbacks made by the remote side while processing a
+thread's call, are processed by the thread that made the call. The
+messages outside of any context are processed by a bounded pool of threads.
+"""
+
+import itertools
+import threading
+import weakref
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from eurydice.common import TransportException
+from eurydice.endpoint import Endpoint
+
+
+class Context(object):
+    """
+    The context of a thread using a multiplexed endpoint
+    """
+    def __init__(self, context_id):
+        self.id = context_id  # pylint:disable=invalid-name
+        self.queue = queue.Queue()
+
+
+class MultiplexedEndpoint(Endpoint):
+    """
+    An endpoint which can be used from several threads at once, once the
+    reader thread is started
+    """
+    # The threads share the state of the session
+    # pylint:disable=too-many-instance-attributes
+    # Number of threads processing the messages outside of any context
+    answer_threads = 4
+
+    def __init__(self, transport):
+        super(MultiplexedEndpoint, self).__init__(transport)
+        # Held while a message is being sent; re-entrant as garbage
+        # collection can release remote objects in the middle of a send
+        self.send_lock = threading.RLock()
+        self.local = threading.local()
+        self.context_ids = itertools.count()
+        self.contexts = weakref.WeakValueDictionary()
+        self.contexts_lock = threading.Lock()
+        self.reader = None
+        self.error = None
+        # Messages outside of any context, and the threads processing them
+        self.unanswered = queue.Queue()
+        self.answerers = []
+
+    def start(self):
+        """
+        Start the thread receiving the messages
+        """
+        self.reader = threading.Thread(target=self._read,
+                                       name='eurydice-reader')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _context(self):
+        """
+        The context of the current thread
+        """
+        try:
+            return self.local.context
+        except AttributeError:
+            context = Context(next(self.context_ids))
+            with self.contexts_lock:
+                self.contexts[context.id] = context
+            self.local.context = context
+            return context
+
+    def _read(self):
+        """
+        Receive the messages and route them to the threads
+        """
+        # Replies to the commands sent from the reader thread itself are
+        # never waited for
+        own = self._context()
+        try:
+            while True:
+                (command, args) = self.transport.receive()
+                if command == 'context':
+                    (context_id, command), args = args[:2], args[2:]
+                    with self.contexts_lock:
+                        context = self.contexts.get(context_id)
+                    if context is not None and context is not own:
+                        context.queue.put((command, args))
+                else:
+                    self.unanswered.put((command, args))
+                    if len(self.answerers) < self.answer_threads:
+                        self._start_answerer()
+        except Exception as exc:  # pylint:disable=broad-except
+            # Nothing can be received past a message which failed, so the
+            # threads waiting are woken up with the error either way
+            if not isinstance(exc, TransportException):
+                exc = TransportException("Invalid data received: %r" % exc)
+            self.error = exc
+            with self.contexts_lock:
+                contexts = list(self.contexts.values())
+            for context in contexts:
+                context.queue.put(None)
+            for _ in self.answerers:
+                self.unanswered.put(None)
+
+    def _start_answerer(self):
+        """
+        Start another thread processing the messages outside of any context
+        """
+        answerer = threading.Thread(
+            target=self._answer,
+            name='eurydice-answerer-%s' % len(self.answerers))
+        answerer.daemon = True
+        answerer.start()
+        self.answerers.append(answerer)
+
+    def _answer(self):
+        """
+        Process the commands which arrived outside of any context, replying
+        outside of any context as well
+        """
+        self.local.context = None
+        while True:
+            message = self.unanswered.get()
+            if message is None:
+                return
+            (command, args) = message
+            try:
+                self._dispatch(command, args)
+            except TransportException:
+                return
+
+    def _send_message(self, message):
+        if self.reader is None:
+            super(MultiplexedEndpoint, self)._send_message(message)
+            return
+
+        if self.error is not None:
+            raise self.error
+
+        context = self._context()
+        with self.send_lock:
+            self.flush_released()
+            if context is not None:
+                message = ['context', context.id] + message
+            self.transport.send_message(message)
+
+    def _receive_one(self):
+        if self.reader is None:
+            return super(MultiplexedEndpoint, self)._receive_one()
+
+        if threading.current_thread() is self.reader:
+            raise TransportException(
+                "Cannot wait for replies on the reader thread.")
+
+        context = self._context()
+        if context is None:
+            raise TransportException(
+                "Cannot wait for replies outside of a context.")
+        if len(self.released) >= self.release_batch:
+            self.flush_released()
+        message = context.queue.get()
+        if message is None:
+            raise self.error
+        (command, args) = message
+        return self._dispatch(command, args)
+
+    def flush_released(self):
+        with self.send_lock:
+            super(MultiplexedEndpoint, self).flush_released()
+
+    def serve_forever(self):
+        """
+        Wait for the reader thread to finish
+        """
+        if self.reader is None:
+            super(MultiplexedEndpoint, self).serve_forever()
+        else:
+            self.reader.join()
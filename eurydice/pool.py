@@ -0,0 +1,198 @@
+"""
+A pool of client connections
+"""
+
+from contextlib import contextmanager
+
+import collections
+import threading
+import time
+
+from eurydice.common import TransportException
+from eurydice.endpoint import RemoteError
+
+
+class PoolTimeout(Exception):
+    """
+    No client became available in time
+    """
+    pass
+
+
+class PooledClient(object):
+    """
+    A client together with its bookkeeping in the pool
+    """
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.time()
+
+
+class ClientPool(object):
+    """
+    A pool of clients connected to the same server
+
+    Clients are created by calling the factory, e.g.
+    ClientPool(lambda: eurydice.socket.Client(address)). The modules listed
+    in 'imports' are imported into every new session, so that use() on a
+    checked out client doesn't need a round trip. Clients idle for longer
+    than 'check_after' seconds are pinged before being handed out, and the
+    ones idle for longer than 'idle_timeout' are closed, keeping at least
+    'min_size' clients open.
+    """
+    # pylint:disable=too-many-arguments,too-many-instance-attributes
+    def __init__(self, factory, min_size=0, max_size=10, imports=(),
+                 idle_timeout=300, check_after=30, timeout=None):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.imports = list(imports)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.timeout = timeout
+
+        self.condition = threading.Condition()
+        # Idle clients, most recently used last
+        self.idle = collections.deque()
+        # Number of clients open, including the checked out ones
+        self.size = 0
+        self.closed = False
+
+        for _ in range(min_size):
+            self.size += 1
+            self.idle.append(self._create())
+
+    def _create(self):
+        """
+        Create a new client and import the configured modules into it. The
+        caller must have reserved a place for it in 'size'.
+        """
+        try:
+            client = self.factory()
+            for module in self.imports:
+                client.use(module)
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        return PooledClient(client)
+
+    def _discard(self, pooled):
+        """
+        Close a client and free its place in the pool
+        """
+        try:
+            pooled.client.close()
+        except (IOError, TransportException):
+            pass
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def _healthy(self, pooled):
+        """
+        Check if the client is still usable
+        """
+        if time.time() - pooled.last_used < self.check_after:
+            return True
+        try:
+            pooled.client.ping()
+            return True
+        except (IOError, RemoteError, TransportException):
+            return False
+
+    def evict(self):
+        """
+        Close the clients idle for too long
+        """
+        expired = []
+        with self.condition:
+            now = time.time()
+            while self.idle and self.size - len(expired) > self.min_size and \
+                    now - self.idle[0].last_used >= self.idle_timeout:
+                expired.append(self.idle.popleft())
+        for pooled in expired:
+            self._discard(pooled)
+
+    def acquire(self, timeout=None):
+        """
+        Take a client out of the pool, creating it if needed
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+
+        self.evict()
+        while True:
+            with self.condition:
+                if self.closed:
+                    raise TransportException("The pool is closed.")
+                if self.idle:
+                    pooled = self.idle.pop()
+                elif self.size < self.max_size:
+                    self.size += 1
+                    pooled = None
+                else:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolTimeout(
+                                "No client available in %s seconds." %
+                                timeout)
+                    self.condition.wait(remaining)
+                    continue
+
+            if pooled is None:
+                return self._create().client
+            if self._healthy(pooled):
+                return pooled.client
+            self._discard(pooled)
+
+    def release(self, client, discard=False):
+        """
+        Return a client to the pool, or close it if it is no longer usable
+        """
+        pooled = PooledClient(client)
+        if discard or self.closed:
+            self._discard(pooled)
+            return
+        with self.condition:
+            self.idle.append(pooled)
+            self.condition.notify()
+        self.evict()
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        A context manager taking a client out of the pool and returning it
+        afterwards. A client left by any exception other than an error
+        raised by the remote side is closed instead, as the exception might
+        have interrupted a call, leaving its reply to be read by the next
+        borrower.
+        """
+        client = self.acquire(timeout)
+        try:
+            yield client
+        except RemoteError:
+            self.release(client)
+            raise
+        except BaseException:
+            self.release(client, discard=True)
+            raise
+        else:
+            self.release(client)
+
+    def close(self):
+        """
+        Close all the idle clients; the checked out ones are closed when
+        released. The threads waiting for a client are woken up to fail.
+        """
+        with self.condition:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self.condition.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
@@ -0,0 +1,173 @@
+"""
+Registries of the objects referenced from the remote side, and of the proxies
+for the remote objects
+"""
+
+import sys
+import threading
+import time
+import weakref
+
+
+class Entry(object):
+    """
+    An object referenced from the remote side
+    """
+    __slots__ = ('obj', 'count', 'exported')
+
+    def __init__(self, obj):
+        self.obj = obj
+        # Number of references sent and not released yet
+        self.count = 0
+        self.exported = time.time()
+
+
+class ObjectRegistry(object):
+    """
+    The objects referenced from the remote side, by their IDs
+
+    Every time an object is sent to the remote side counts as a reference,
+    and the object is kept until the remote side releases all of them or
+    the session ends.
+    """
+    def __init__(self):
+        # Entries in the order of the first export, the oldest first
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def export(self, obj):
+        """
+        Add a reference to an object, returning its ID
+        """
+        index = id(obj)
+        with self.lock:
+            entry = self.entries.get(index)
+            if entry is None:
+                entry = self.entries[index] = Entry(obj)
+            entry.count += 1
+        return index
+
+    def __getitem__(self, index):
+        return self.entries[index].obj
+
+    def __contains__(self, index):
+        return index in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def release(self, index, count=1):
+        """
+        Release references to the object with the ID, returning whether it
+        was exported
+        """
+        with self.lock:
+            entry = self.entries.get(index)
+            if entry is None:
+                return False
+            entry.count -= count
+            if entry.count <= 0:
+                del self.entries[index]
+        return True
+
+    def clear(self):
+        """
+        Drop all the objects, e.g. when the session ends, returning their
+        number
+        """
+        with self.lock:
+            count = len(self.entries)
+            self.entries.clear()
+        return count
+
+    def stats(self):
+        """
+        The number of objects, of references to them and the (shallow) size
+        of the objects in bytes
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+        return {
+            'objects': len(entries),
+            'references': sum(entry.count for entry in entries),
+            'bytes': sum(sys.getsizeof(entry.obj) for entry in entries),
+        }
+
+    def oldest(self, limit=10):
+        """
+        The objects exported the longest time ago, as (ID, object, reference
+        count, age in seconds) tuples
+        """
+        now = time.time()
+        with self.lock:
+            entries = list(self.entries.items())[:limit]
+        return [(index, entry.obj, entry.count, now - entry.exported)
+                for (index, entry) in entries]
+
+
+class ProxyEntry(object):
+    """
+    A proxy for a remote object
+    """
+    __slots__ = ('ref', 'count')
+
+    def __init__(self):
+        self.ref = None
+        # Number of references received for the object
+        self.count = 1
+
+
+class ProxyRegistry(object):
+    """
+    The proxies for the remote objects, by their instances and IDs
+
+    The same remote object gets the same proxy for as long as the proxy is
+    used, standing for all the references to the object received in the
+    meantime. Once the proxy is garbage collected, 'release' is called with
+    the ID of the object and the number of references to release.
+    """
+    def __init__(self, release):
+        self.release = release
+        self.entries = {}
+        # Reentrant, as the garbage collector can collect a proxy while the
+        # lock is held
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """
+        Return the proxy for the remote object with the (instance, ID) key,
+        counting another reference to it, or None if there is none
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            proxy = entry.ref()
+            if proxy is not None:
+                entry.count += 1
+            return proxy
+
+    def add(self, key, proxy):
+        """
+        Add the proxy for the remote object with the (instance, ID) key, with
+        one reference to it
+        """
+        entry = ProxyEntry()
+        entry.ref = weakref.ref(
+            proxy, lambda _: self.collected(key, entry))
+        with self.lock:
+            self.entries[key] = entry
+
+    def collected(self, key, entry):
+        """
+        Release the references to the object of a proxy garbage collected.
+        Nothing can get the proxy at this point, so the count is final.
+        """
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+            count = entry.count
+        self.release(key[1], count)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,364 @@
+"""
+Serializers converting messages to and from their wire representation
+"""
+
+from codecs import utf_8_decode
+import json
+
+from eurydice.common import RemoteObject, pure_methods, snapshot_fields
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Tags standing for the instances in the compact references: the side
+# sending the reference and the side receiving it
+SENDER = 0
+RECEIVER = 1
+
+# Types sent as binary buffers; 'bytes' is 'str' on Python 2, sent as text
+BUFFER_TYPES = (bytearray, memoryview)
+if bytes is not str:
+    BUFFER_TYPES += (bytes,)
+if numpy is not None:
+    BUFFER_TYPES += (numpy.ndarray,)
+
+
+def byte_view(obj):
+    """
+    A view of the bytes of a buffer
+    """
+    view = memoryview(obj)
+    if view.format != 'B' or view.ndim != 1:
+        # Only buffers of other types are cast, which Python 2 cannot do
+        view = view.cast('B')
+    return view
+
+
+def proxy_ref(instance, obj_id, fields=None, pure=None):
+    """
+    The reference to a remote object as stored in RemoteObject.ref, with
+    the public attributes of an immutable object and the names of the pure
+    methods if given
+    """
+    proxy = {
+        'id': obj_id,
+        'instance': instance,
+    }
+    if fields is not None:
+        proxy['fields'] = fields
+    if pure is not None:
+        proxy['pure'] = pure
+    return {
+        '_remote_proxy': proxy,
+    }
+
+
+class Serializer(object):
+    """
+    Base class for serializers
+    """
+    name = None
+
+    def __init__(self, endpoint, identity):
+        self.endpoint = endpoint
+        self.identity = identity
+        # Whether binary buffers are sent out of band, after the message
+        self.buffers = False
+        # Buffers to send after the message being encoded, and to receive
+        # after the message decoded
+        self.outgoing = []
+        self.incoming = []
+        # Identity of the remote side once compact references are agreed
+        # upon, see ref_array()
+        self.peer = None
+
+    def buffer_ref(self, obj):
+        """
+        Queue a buffer to be sent after the message, returning its
+        description: the size in bytes and, for NumPy arrays, the type and
+        shape of the elements
+        """
+        ref = {}
+        if numpy is not None and isinstance(obj, numpy.ndarray):
+            ref['dtype'] = obj.dtype.str
+            ref['shape'] = list(obj.shape)
+            obj = numpy.ascontiguousarray(obj).reshape(-1).view(numpy.uint8)
+        view = byte_view(obj)
+        ref['size'] = len(view)
+        self.outgoing.append(view)
+        return ref
+
+    def thaw_buffer(self, ref):
+        """
+        Allocate the memory for a buffer to be received after the message,
+        returning a view of it or a NumPy array using it
+        """
+        data = bytearray(ref['size'])
+        self.incoming.append(data)
+        if numpy is not None and 'dtype' in ref:
+            return numpy.frombuffer(data, dtype=ref['dtype']) \
+                .reshape(ref['shape'])
+        return memoryview(data)
+
+    def take_outgoing(self):
+        """
+        Return the buffers to send after the last encoded message
+        """
+        (buffers, self.outgoing) = (self.outgoing, [])
+        return buffers
+
+    def take_incoming(self):
+        """
+        Return the buffers to receive after the last decoded message
+        """
+        (buffers, self.incoming) = (self.incoming, [])
+        return buffers
+
+    def export(self, obj):
+        """
+        Add a reference to a local object from the remote side and return
+        its ID
+        """
+        return self.endpoint.objects.export(obj)
+
+    def thaw(self, proxy):
+        """
+        Convert a proxy reference back into an object. A remote object
+        gets the proxy already existing for it, if any.
+        """
+        instance = proxy['instance']
+        if instance == self.identity:
+            return self.endpoint.objects[proxy['id']]
+        key = (instance, proxy['id'])
+        proxies = self.endpoint.proxies
+        obj = proxies.get(key)
+        if obj is not None:
+            return obj
+        ref = proxy_ref(instance, proxy['id'])
+        pure = proxy.get('pure')
+        if pure is not None:
+            pure = frozenset(pure)
+        if proxy.get('fields') is not None:
+            obj = self.endpoint.remote_snapshot(self.endpoint, ref,
+                                                proxy['fields'], pure)
+        else:
+            obj = self.endpoint.remote_object(self.endpoint, ref, pure)
+        proxies.add(key, obj)
+        return obj
+
+    def ref_array(self, instance, obj_id, fields=None, pure=None):
+        """
+        The reference to an object as an array: the instance, the ID, the
+        public attributes of an immutable object (or None) and the names of
+        the pure methods, if any. Once compact references are agreed upon,
+        the instances of both sides are sent as the SENDER and RECEIVER
+        tags instead of their full identities.
+        """
+        if self.peer is not None:
+            if instance == self.identity:
+                instance = SENDER
+            elif instance == self.peer:
+                instance = RECEIVER
+        ref = [instance, obj_id]
+        if fields is not None or pure is not None:
+            ref.append(fields)
+        if pure is not None:
+            ref.append(pure)
+        return ref
+
+    def thaw_ref(self, ref):
+        """
+        Convert a reference array (see ref_array()) back into an object
+        """
+        instance = ref[0]
+        if self.peer is not None:
+            if instance == SENDER:
+                instance = self.peer
+            elif instance == RECEIVER:
+                instance = self.identity
+        proxy = {'id': ref[1], 'instance': instance}
+        if len(ref) > 2:
+            proxy['fields'] = ref[2]
+        if len(ref) > 3:
+            proxy['pure'] = ref[3]
+        return self.thaw(proxy)
+
+    def encode(self, message):
+        """
+        Encode a message into a string or bytes
+        """
+        raise NotImplementedError("Please override encode().")
+
+    def decode(self, data):
+        """
+        Decode a message from a string or a bytes-like object
+        """
+        raise NotImplementedError("Please override decode().")
+
+
+class RemoteJSONEncoder(json.JSONEncoder):
+    """
+    An encoder recognizing remote object proxies
+    """
+    def __init__(self, serializer):
+        super(RemoteJSONEncoder, self).__init__()
+        self.serializer = serializer
+
+    def default(self, obj):  # pylint:disable=method-hidden
+        serializer = self.serializer
+        if isinstance(obj, RemoteObject):
+            if serializer.peer is None:
+                return obj.ref
+            proxy = obj.ref['_remote_proxy']
+            return {'_ref': serializer.ref_array(proxy['instance'],
+                                                 proxy['id'])}
+
+        if serializer.buffers and isinstance(obj, BUFFER_TYPES):
+            return {'_buffer': serializer.buffer_ref(obj)}
+
+        if serializer.peer is None:
+            return proxy_ref(serializer.identity,
+                             serializer.export(obj),
+                             snapshot_fields(obj),
+                             pure_methods(obj))
+        return {'_ref': serializer.ref_array(serializer.identity,
+                                             serializer.export(obj),
+                                             snapshot_fields(obj),
+                                             pure_methods(obj))}
+
+
+class RemoteJSONDecoder(json.JSONDecoder):
+    """
+    A decoder recognizing remote object proxies
+    """
+    def __init__(self, serializer):
+        super(RemoteJSONDecoder, self).__init__(object_hook=self.decode_object)
+        self.serializer = serializer
+
+    def decode_object(self, obj):
+        """
+        Decode remote object proxies
+        """
+        # Only a reference alone in an object stands for an object or a
+        # buffer, and only once they are agreed upon; anything else is the
+        # caller's data
+        if len(obj) != 1:
+            return obj
+        serializer = self.serializer
+        if isinstance(obj.get('_remote_proxy'), dict):
+            return serializer.thaw(obj['_remote_proxy'])
+        if serializer.peer is not None and isinstance(obj.get('_ref'), list):
+            return serializer.thaw_ref(obj['_ref'])
+        if serializer.buffers and isinstance(obj.get('_buffer'), dict):
+            return serializer.thaw_buffer(obj['_buffer'])
+        return obj
+
+
+class JSONSerializer(Serializer):
+    """
+    Serializer using JSON
+    """
+    name = 'json'
+
+    def __init__(self, endpoint, identity):
+        super(JSONSerializer, self).__init__(endpoint, identity)
+        self.encoder = RemoteJSONEncoder(self)
+        self.decoder = RemoteJSONDecoder(self)
+
+    def encode(self, message):
+        return self.encoder.encode(message)
+
+    def decode(self, data):
+        if isinstance(data, BUFFER_TYPES):
+            data = utf_8_decode(data, 'strict', True)[0]
+        return self.decoder.decode(data)
+
+
+class MessagePackSerializer(Serializer):
+    """
+    Serializer using MessagePack. Remote object references are encoded as
+    an extension type containing the array from ref_array(). Buffers sent
+    out of band are encoded as another extension type containing a [size]
+    array, followed by the type and the shape of the elements for NumPy
+    arrays.
+    """
+    name = 'msgpack'
+
+    REMOTE_PROXY = 1
+    BUFFER = 2
+
+    def pack_buffers(self, obj):
+        """
+        Replace the buffers in a message with their references, as
+        MessagePack packs them without calling pack_object()
+        """
+        if isinstance(obj, BUFFER_TYPES):
+            ref = self.buffer_ref(obj)
+            ref = [ref['size']] + \
+                ([ref['dtype'], ref['shape']] if 'dtype' in ref else [])
+            return msgpack.ExtType(self.BUFFER, self.encode(ref))
+        if isinstance(obj, (list, tuple)):
+            return [self.pack_buffers(item) for item in obj]
+        if isinstance(obj, dict):
+            return dict((key, self.pack_buffers(value))
+                        for (key, value) in obj.items())
+        return obj
+
+    def pack_object(self, obj):
+        """
+        Encode an object MessagePack doesn't know about as a reference
+        """
+        if isinstance(obj, RemoteObject):
+            proxy = obj.ref['_remote_proxy']
+            ref = self.ref_array(proxy['instance'], proxy['id'])
+        else:
+            ref = self.ref_array(self.identity, self.export(obj),
+                                 snapshot_fields(obj), pure_methods(obj))
+        return msgpack.ExtType(self.REMOTE_PROXY, self.encode(ref))
+
+    def unpack_ext(self, code, data):
+        """
+        Decode a reference to an object
+        """
+        if code == self.BUFFER:
+            ref = self.unpack(data)
+            buffer_ref = {'size': ref[0]}
+            if len(ref) > 2:
+                (buffer_ref['dtype'], buffer_ref['shape']) = ref[1:3]
+            return self.thaw_buffer(buffer_ref)
+        if code != self.REMOTE_PROXY:
+            return msgpack.ExtType(code, data)
+        return self.thaw_ref(self.unpack(data))
+
+    def encode(self, message):
+        if self.buffers:
+            message = self.pack_buffers(message)
+        return msgpack.packb(message,
+                             default=self.pack_object,
+                             use_bin_type=True)
+
+    def unpack(self, data):
+        """
+        Decode a message or the contents of an extension type
+        """
+        return msgpack.unpackb(data,
+                               ext_hook=self.unpack_ext,
+                               raw=False,
+                               strict_map_key=False)
+
+    def decode(self, data):
+        return self.unpack(data)
+
+
+# Available serializers in the order of preference
+SERIALIZERS = [JSONSerializer]
+
+if msgpack is not None:
+    SERIALIZERS.insert(0, MessagePackSerializer)
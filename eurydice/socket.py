@@ -4,22 +4,72 @@ Socket endpoints
 
 from __future__ import absolute_import
 
+import errno
+import gc
+import os
+import signal
 import socket
+import threading
 try:
     import socketserver  # pylint:disable=import-error
 except ImportError:
     import SocketServer as socketserver
 
-from eurydice.endpoint import Endpoint
-from eurydice.transport import StreamLineTransport
+from eurydice.common import TransportException
+from eurydice.endpoint import Endpoint, preload as preload_modules
+from eurydice.multiplex import MultiplexedEndpoint
+from eurydice.transport import SocketFrameTransport
+
+
+def parse_address(address):
+    """
+    Parse a server address, returning the socket family and the address in
+    its format. Addresses are (host, port) tuples or URLs: 'tcp://host:port'
+    or 'unix:///path/to/socket'.
+    """
+    if isinstance(address, (tuple, list)):
+        return (socket.AF_INET, tuple(address))
+    if address.startswith('unix://'):
+        return (socket.AF_UNIX, address[len('unix://'):])
+    if address.startswith('tcp://'):
+        (host, _, port) = address[len('tcp://'):].rpartition(':')
+        return (socket.AF_INET, (host.strip('[]'), int(port)))
+    raise ValueError("Unknown address: '%s'" % address)
+
+
+def tune(sock):
+    """
+    Disable Nagle's algorithm on TCP sockets: messages are written at once,
+    and waiting to coalesce them only delays the replies
+    """
+    if sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def connect(address):
+    """
+    Connect a socket to a server address, see parse_address()
+    """
+    (family, address) = parse_address(address)
+    if family == socket.AF_UNIX:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except socket.error:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(address)
+    tune(sock)
+    return sock
 
 
 class SocketEndpoint(Endpoint):
     """
     An endpoint using a socket for communication
     """
-    def __init__(self, stream):
-        transport = StreamLineTransport(stream, self)
+    def __init__(self, sock):
+        transport = SocketFrameTransport(sock, self)
         super(SocketEndpoint, self).__init__(transport)
 
 
@@ -28,24 +78,297 @@ class ServerHandler(socketserver.BaseRequestHandler):
     Request handler for the Server
     """
     def handle(self):
-        transport = self.request.makefile('rw')
-        endpoint = SocketEndpoint(transport)
+        tune(self.request)
+        endpoint = SocketEndpoint(self.request)
+        endpoint.transport.allowed_serializers = self.server.serializers
+        endpoint.stats = self.server.stats
         endpoint.serve_forever()
 
 
 class Server(socketserver.TCPServer, object):
     """
-    A server listening for commands from the remote side
+    A server listening for commands from the remote side, serving one
+    client at a time
+
+    The address is a (host, port) tuple or a URL, see parse_address(). The
+    serializers to accept from the clients can be restricted by passing a
+    list of their names. 'backlog' is the number of connections the
+    operating system queues before they are accepted. The modules listed in
+    'preload' are imported before serving any client, see
+    eurydice.endpoint.preload().
     """
-    def __init__(self, address):
+    allow_reuse_address = True
+
+    # Statistics to collect from all the connections, see eurydice.stats
+    stats = None
+
+    def __init__(self, address, serializers=None, backlog=None, preload=()):
+        (self.address_family, address) = parse_address(address)
+        self.serializers = serializers
+        if backlog is not None:
+            self.request_queue_size = backlog
         super(Server, self).__init__(address, ServerHandler)
+        preload_modules(preload)
+
+    def server_bind(self):
+        if self.address_family == socket.AF_UNIX:
+            # A socket file left by a previous server prevents binding
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+        super(Server, self).server_bind()
+
+    def server_close(self):
+        super(Server, self).server_close()
+        if self.address_family == socket.AF_UNIX:
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, Server):
+    """
+    A server serving every client in a thread of its own
+
+    At most 'max_connections' clients are served at once, if given; further
+    connections wait to be served, and are closed if the server is shut down
+    meanwhile.
+    """
+    daemon_threads = True
+
+    # Seconds between the checks for shutdown while waiting for a free slot
+    slot_poll_interval = 0.5
+
+    def __init__(self, address, serializers=None, backlog=None,
+                 max_connections=None, preload=()):
+        super(ThreadingServer, self).__init__(address, serializers, backlog,
+                                              preload)
+        self.slots = None
+        if max_connections is not None:
+            self.slots = threading.BoundedSemaphore(max_connections)
+        self.stopping = False
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super(ThreadingServer, self).serve_forever(poll_interval)
+        finally:
+            self.stopping = False
+
+    def shutdown(self):
+        # Let a connection waiting for a slot give up on it
+        self.stopping = True
+        super(ThreadingServer, self).shutdown()
+
+    def process_request(self, request, client_address):
+        if self.slots is not None:
+            while not self.slots.acquire(timeout=self.slot_poll_interval):
+                if self.stopping:
+                    self.shutdown_request(request)
+                    return
+        try:
+            super(ThreadingServer, self).process_request(request,
+                                                         client_address)
+        except Exception:
+            if self.slots is not None:
+                self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super(ThreadingServer, self).process_request_thread(
+                request, client_address)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+
+class ForkingServer(socketserver.ForkingMixIn, Server):
+    """
+    A server serving every client in a process of its own
+
+    At most 'max_connections' clients are served at once, if given; further
+    connections wait to be accepted.
+    """
+    def __init__(self, address, serializers=None, backlog=None,
+                 max_connections=None, preload=()):
+        super(ForkingServer, self).__init__(address, serializers, backlog,
+                                            preload)
+        if max_connections is not None:
+            self.max_children = max_connections
+
+
+class PreforkServer(Server):
+    """
+    A server starting a fixed number of worker processes in advance, each
+    accepting and serving one client at a time from the shared listening
+    socket. Workers which exit are replaced.
+
+    The workers are forked once the modules listed in 'preload' are
+    imported, sharing them (copy-on-write) along with their objects' IDs.
+    The server is stopped by shutdown() or, when serving from the main
+    thread, by SIGTERM.
+    """
+    def __init__(self, address, serializers=None, backlog=None, workers=4,
+                 preload=()):
+        super(PreforkServer, self).__init__(address, serializers, backlog,
+                                            preload)
+        self.workers = workers
+        self.children = set()
+        self.stopping = False
+        # Set when shutdown() is requested, to wake the supervisor up
+        self.stop_request = threading.Event()
+        # Set when serve_forever() has stopped the workers and returned
+        self.stopped = threading.Event()
+        self.stopped.set()
+
+    def _spawn(self, poll_interval):
+        """
+        Start a worker process
+        """
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                super(PreforkServer, self).serve_forever(poll_interval)
+            except BaseException:  # pylint:disable=broad-except
+                status = 1
+            finally:
+                os._exit(status)  # pylint:disable=protected-access
+        self.children.add(pid)
+
+    def _terminate(self, signum, frame):
+        # pylint:disable=unused-argument
+        """
+        Stop the workers and the server on a termination signal
+        """
+        self.stopping = True
+        raise SystemExit(0)
+
+    def serve_forever(self, poll_interval=0.5):
+        # Keep the collector from touching the objects created so far, e.g.
+        # the preloaded modules, which would copy their pages in every worker
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        self.stopped.clear()
+        previous = None
+        if threading.current_thread() is threading.main_thread():
+            previous = signal.signal(signal.SIGTERM, self._terminate)
+        try:
+            while not self.stopping:
+                while len(self.children) < self.workers:
+                    self._spawn(poll_interval)
+                try:
+                    (pid, _) = os.waitpid(-1, os.WNOHANG)
+                except OSError as exc:
+                    if exc.errno != errno.EINTR:
+                        raise
+                    continue
+                if pid == 0:
+                    # No worker has exited, check for shutdown meanwhile
+                    if self.stop_request.wait(poll_interval):
+                        self.stopping = True
+                    continue
+                self.children.discard(pid)
+        finally:
+            self.stopping = True
+            self.shutdown_workers()
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+            self.stopping = False
+            self.stop_request.clear()
+            self.stopped.set()
+
+    def shutdown(self):
+        """
+        Stop serve_forever(), running in another thread, and wait for the
+        workers to exit
+        """
+        self.stop_request.set()
+        self.stopped.wait()
+
+    def shutdown_workers(self):
+        """
+        Terminate the worker processes and wait for them to exit
+        """
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self.children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children.clear()
+
+
+# Server classes by the concurrency mode
+SERVER_MODES = {
+    'single': Server,
+    'thread': ThreadingServer,
+    'fork': ForkingServer,
+    'prefork': PreforkServer,
+}
+
+
+def make_server(address, mode='thread', **options):
+    """
+    Create a server with the given concurrency mode: 'single', 'thread',
+    'fork' or 'prefork'. The options are passed to the server class.
+    """
+    try:
+        server_class = SERVER_MODES[mode]
+    except KeyError:
+        raise ValueError("Unknown server mode: '%s'" % mode)
+    return server_class(address, **options)
 
 
 class Client(SocketEndpoint):
     """
     A client sending commands to the remote side
+
+    The address is a (host, port) tuple or a URL, see parse_address(). The
+    serializers to offer the remote side can be restricted by passing a list
+    of their names. 'compression' lists the names of the codecs to offer for
+    compressing large messages, see eurydice.compression. 'stats' is a
+    eurydice.stats.Stats object to collect the statistics of the connection
+    into.
+
+    Servers not knowing about the handshake may drop the connection or
+    ignore it; the client then connects again and talks JSON, without a
+    handshake. 'handshake_timeout' is how long to wait for the reply, in
+    seconds.
     """
-    def __init__(self, address):
-        sock = socket.create_connection(address)
-        stream = sock.makefile('rw')
-        super(Client, self).__init__(stream)
+    handshake_timeout = 10
+
+    def __init__(self, address, serializers=None, stats=None,
+                 compression=()):
+        sock = connect(address)
+        super(Client, self).__init__(sock)
+        self.transport.allowed_serializers = serializers
+        self.transport.compression = compression
+        self.stats = stats
+        sock.settimeout(self.handshake_timeout)
+        try:
+            self.handshake()
+        except TransportException:
+            self.transport.close()
+            self.transport = SocketFrameTransport(connect(address), self)
+        else:
+            sock.settimeout(None)
+
+
+class MultiplexedClient(Client, MultiplexedEndpoint):
+    """
+    A client which can be shared between threads. Callbacks from the remote
+    side are processed by the thread whose call they are made from.
+    """
+    def __init__(self, address, serializers=None, stats=None,
+                 compression=()):
+        super(MultiplexedClient, self).__init__(address, serializers, stats,
+                                                compression)
+        self.start()
@@ -0,0 +1,171 @@
+"""
+Statistics of the traffic of endpoints
+
+Collecting the statistics is enabled by setting an endpoint's 'stats' (or a
+server's, for all the connections it accepts):
+
+    stats = eurydice.stats.Stats()
+    client = eurydice.socket.Client(address, stats=stats)
+    ...
+    print(stats.snapshot())
+    print(stats.prometheus())
+
+Every event is a method call on the Stats object, so a subclass can pass
+them elsewhere instead. With 'stats' unset, nothing is measured.
+"""
+
+import bisect
+import threading
+
+
+class Histogram(object):
+    """
+    Counts of the durations, in seconds, falling into buckets growing
+    exponentially from 10 microseconds to 10 seconds
+    """
+    BOUNDS = tuple(1e-5 * 2 ** power for power in range(21))
+
+    def __init__(self):
+        # The last bucket is for the values above all the bounds
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Add a value to the histogram
+        """
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """
+        The histogram as a dictionary, with the cumulative bucket counts by
+        their upper bounds
+        """
+        buckets = []
+        total = 0
+        for (bound, count) in zip(self.BOUNDS + ('+Inf',), self.counts):
+            total += count
+            buckets.append([bound, total])
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class Stats(object):
+    """
+    Counters and durations of an endpoint's messages and calls
+
+    'remote_time' requests the remote side to report the time spent
+    executing each command in the reply, if it can.
+    """
+    # One attribute per counter, as reported by snapshot()
+    # pylint:disable=too-many-instance-attributes
+    def __init__(self, remote_time=True):
+        self.remote_time = remote_time
+        # Updated from the threads of multiplexed endpoints and servers
+        self.lock = threading.Lock()
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.messages_received = 0
+        self.bytes_received = 0
+        self.encode_time = Histogram()
+        self.decode_time = Histogram()
+        self.execute_time = Histogram()
+        # Round trip durations of the method calls, by method name
+        self.calls = {}
+
+    def sent(self, size, elapsed):
+        """
+        A message of the given size was encoded in 'elapsed' seconds and
+        sent
+        """
+        with self.lock:
+            self.messages_sent += 1
+            self.bytes_sent += size
+            self.encode_time.observe(elapsed)
+
+    def received(self, size, elapsed):
+        """
+        A message of the given size was received and decoded in 'elapsed'
+        seconds
+        """
+        with self.lock:
+            self.messages_received += 1
+            self.bytes_received += size
+            self.decode_time.observe(elapsed)
+
+    def called(self, method, elapsed):
+        """
+        The reply to a method call arrived 'elapsed' seconds after the call
+        """
+        with self.lock:
+            histogram = self.calls.get(method)
+            if histogram is None:
+                histogram = self.calls[method] = Histogram()
+            histogram.observe(elapsed)
+
+    def executed(self, elapsed):
+        """
+        The remote side reported spending 'elapsed' seconds on a command
+        """
+        with self.lock:
+            self.execute_time.observe(elapsed)
+
+    def snapshot(self):
+        """
+        All the statistics as a dictionary
+        """
+        with self.lock:
+            return {
+                'messages_sent': self.messages_sent,
+                'bytes_sent': self.bytes_sent,
+                'messages_received': self.messages_received,
+                'bytes_received': self.bytes_received,
+                'encode_time': self.encode_time.snapshot(),
+                'decode_time': self.decode_time.snapshot(),
+                'execute_time': self.execute_time.snapshot(),
+                'calls': dict((method, histogram.snapshot())
+                              for (method, histogram) in self.calls.items()),
+            }
+
+    def prometheus(self, prefix='eurydice'):
+        """
+        All the statistics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def counter(name, value):
+            """
+            Add a counter
+            """
+            lines.append('# TYPE %s_%s counter' % (prefix, name))
+            lines.append('%s_%s %s' % (prefix, name, value))
+
+        def histogram(name, value, labels=''):
+            """
+            Add a histogram, or one of its label sets
+            """
+            for (bound, count) in value['buckets']:
+                lines.append('%s_%s_bucket{%sle="%s"} %d' % (
+                    prefix, name, labels, bound, count))
+            labels = labels.rstrip(',')
+            if labels:
+                labels = '{%s}' % labels
+            lines.append('%s_%s_sum%s %r' % (prefix, name, labels,
+                                             value['sum']))
+            lines.append('%s_%s_count%s %d' % (prefix, name, labels,
+                                               value['count']))
+
+        for name in ('messages_sent', 'bytes_sent',
+                     'messages_received', 'bytes_received'):
+            counter(name + '_total', snapshot[name])
+        for name in ('encode_time', 'decode_time', 'execute_time'):
+            lines.append('# TYPE %s_%s_seconds histogram' % (prefix, name))
+            histogram(name + '_seconds', snapshot[name])
+        lines.append('# TYPE %s_call_seconds histogram' % prefix)
+        for (method, value) in sorted(snapshot['calls'].items()):
+            method = method.replace('\\', '\\\\').replace('"', '\\"')
+            histogram('call_seconds', value, 'method="%s",' % method)
+        return '\n'.join(lines) + '\n'
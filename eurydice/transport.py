@@ -4,11 +4,23 @@ Transport
 
 from __future__ import print_function
 
-import json
-
+from codecs import getincrementaldecoder
 import random
 
-from eurydice.common import RemoteObject, TransportException
+import struct
+
+from eurydice.common import TransportException, clock
+from eurydice.compression import CODECS, COMPRESSED
+from eurydice.jsonstream import IncrementalDecoder
+# RemoteJSONEncoder and RemoteJSONDecoder used to live here
+# pylint:disable=unused-import
+from eurydice.serializer import (
+    JSONSerializer,
+    RemoteJSONDecoder,
+    RemoteJSONEncoder,
+    SERIALIZERS,
+    byte_view,
+)
 
 
 class Transport(object):
@@ -26,7 +38,16 @@ class Transport(object):
         """
         Send a command to the remote side
         """
-        raise NotImplementedError("Please override send().")
+        message = [command]
+        message.extend(args)
+        self.send_message(message)
+
+    def send_message(self, message):
+        """
+        Send a message - a list of the command and its arguments - to the
+        remote side
+        """
+        raise NotImplementedError("Please override send_message().")
 
     def receive(self):
         """
@@ -34,89 +55,179 @@ class Transport(object):
         """
         raise NotImplementedError("Please override receive().")
 
+    def close(self):
+        """
+        Close the connection to the remote side
+        """
+        pass
+
 
-class RemoteJSONEncoder(json.JSONEncoder):
+class JSONCoding(object):
     """
-    An encoder recognizing remote object proxies
+    Encoding of the messages by JSON, or another serializer negotiated with
+    the remote side, and their compression. Shared by the synchronous and
+    the asyncio transports, which add the I/O.
     """
-    def __init__(self, endpoint, identity):
-        super(RemoteJSONEncoder, self).__init__()
-        self.endpoint = endpoint
-        self.identity = identity
-
-    def default(self, obj):  # pylint:disable=method-hidden
-        if isinstance(obj, RemoteObject):
-            return obj.ref
+    # Whether the transport can carry binary messages
+    binary = False
 
-        index = id(obj)
-        if index not in self.endpoint.objects:
-            self.endpoint.objects[index] = obj
+    # Whether the transport can send binary buffers after the messages, see
+    # send_buffers() and receive_buffers()
+    out_of_band = False
 
-        return {
-            '_remote_proxy': {
-                'id': index,
-                'instance': self.identity,
-            },
-        }
+    # Size in bytes from which the messages are compressed, once a codec is
+    # agreed upon
+    compression_threshold = 1024
 
+    # Largest message to accept, in bytes (characters for the text
+    # transports), None for no limit
+    max_message_size = None
 
-class RemoteJSONDecoder(json.JSONDecoder):
-    """
-    A decoder recognizing remote object proxies
-    """
-    def __init__(self, endpoint, identity):
-        super(RemoteJSONDecoder, self).__init__(object_hook=self.decode_object)
+    def __init__(self, endpoint):
         self.endpoint = endpoint
-        self.identity = identity
+        self.identity = 'PY' + str(random.random())
+        self.serializer = JSONSerializer(endpoint, self.identity)
+        # Names of the serializers to allow, None for all available
+        self.allowed_serializers = None
+        # Names of the compression codecs to offer, in order of preference,
+        # and the codec agreed upon
+        self.compression = ()
+        self.codec = None
 
-    def decode_object(self, obj):
+    def serializers(self):
         """
-        Decode remote object proxies
+        The serializers usable with this transport, in order of preference
         """
-        if isinstance(obj, dict):
-            if '_remote_proxy' in obj:
-                proxy = obj['_remote_proxy']
-                if proxy['instance'] == self.identity:
-                    return self.endpoint.objects[proxy['id']]
-                else:
-                    return RemoteObject(self.endpoint, obj)
-        return obj
+        # allowed_serializers is set by the endpoints
+        # pylint:disable=unsupported-membership-test
+        return [serializer for serializer in SERIALIZERS
+                if (self.binary or serializer is JSONSerializer) and
+                (self.allowed_serializers is None or
+                 serializer.name in self.allowed_serializers)]
 
+    def options(self):
+        """
+        Protocol options to offer to the remote side
+        """
+        options = {}
+        serializers = self.serializers()
+        if serializers != [JSONSerializer]:
+            options['serializers'] = \
+                [serializer.name for serializer in serializers]
+        if self.out_of_band:
+            options['buffers'] = True
+        if self.binary:
+            codecs = set(codec.name for codec in CODECS)
+            offered = [name for name in self.compression if name in codecs]
+            if offered:
+                options['compression'] = offered
+        # Offered along with the others only, so that peers not knowing
+        # about the handshake are not sent one for its sake
+        if options:
+            options['compact_refs'] = self.identity
+        return options
 
-class JSONTransport(Transport):
-    """
-    Transport encoding messages by JSON
-    """
-    def __init__(self, endpoint):
-        super(JSONTransport, self).__init__(endpoint)
-        self.identity = 'PY' + str(random.random())
-        self.encoder = RemoteJSONEncoder(endpoint, self.identity)
-        self.decoder = RemoteJSONDecoder(endpoint, self.identity)
+    def negotiate(self, options):
+        """
+        Choose the options to use out of the ones offered by the remote side
+        """
+        accepted = {}
+        names = dict((serializer.name, serializer)
+                     for serializer in self.serializers())
+        for name in options.get('serializers', ()):
+            if name in names:
+                accepted['serializer'] = name
+                break
+        if self.out_of_band and options.get('buffers'):
+            accepted['buffers'] = True
+        if options.get('compact_refs'):
+            accepted['compact_refs'] = [options['compact_refs'],
+                                        self.identity]
+        if self.binary:
+            codecs = set(codec.name for codec in CODECS)
+            for name in options.get('compression', ()):
+                if name in codecs:
+                    accepted['compression'] = name
+                    break
+        return accepted
+
+    def configure(self, accepted):
+        """
+        Switch to the options agreed upon with the remote side
+        """
+        self.codec = None
+        if 'compression' in accepted:
+            for codec in CODECS:
+                if codec.name == accepted['compression']:
+                    self.codec = codec()
+                    break
+            else:
+                raise TransportException(
+                    "Unknown compression: '%s'" % accepted['compression'])
+
+        name = accepted.get('serializer', JSONSerializer.name)
+        for serializer in SERIALIZERS:
+            if serializer.name == name:
+                self.serializer = serializer(self.endpoint, self.identity)
+                self.serializer.buffers = bool(accepted.get('buffers'))
+                identities = accepted.get('compact_refs')
+                if identities:
+                    (offered, accepting) = identities
+                    self.serializer.peer = \
+                        accepting if offered == self.identity else offered
+                return
+        raise TransportException("Unknown serializer: '%s'" % name)
 
     def decode(self, message):
         """
-        Decode a message using JSON
+        Decode a message using the current serializer
         """
-        return self.decoder.decode(message)
+        return self.serializer.decode(message)
 
     def encode(self, *args):
         """
-        Encode a message using JSON
+        Encode a message using the current serializer
         """
-        return self.encoder.encode(list(args))
+        return self.serializer.encode(list(args))
 
-    def send(self, command, *args):
-        chunk = self.encode(command, *args)
-        try:
-            self.send_chunk(chunk)
-        except IOError as exc:
-            raise TransportException("Transport error: '%s'" % exc)
+    def compress(self, chunk):
+        """
+        Compress an encoded message if a codec is agreed upon and the
+        message is large enough
+        """
+        if self.codec is None or len(chunk) < self.compression_threshold:
+            return chunk
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        return COMPRESSED + self.codec.compress(chunk)
 
-    def receive(self):
+    def decompress(self, chunk):
+        """
+        Decompress a received message if it is compressed
+        """
+        if self.codec is None or chunk[:1] != COMPRESSED:
+            return chunk
         try:
-            chunk = self.receive_chunk()
-        except IOError as exc:
-            raise TransportException("Transport error: '%s'" % exc)
+            chunk = self.codec.decompress(chunk[1:], self.max_message_size)
+        except ValueError:
+            raise TransportException("Invalid compressed data received.")
+        self.check_size(len(chunk))
+        return chunk
+
+    def check_size(self, size):
+        """
+        Refuse a message larger than allowed
+        """
+        limit = self.max_message_size
+        if limit is not None and size > limit:
+            raise TransportException(
+                "Message of %s bytes is larger than the limit of %s." %
+                (size, limit))
+
+    def parse(self, chunk):
+        """
+        Decode a received chunk into the command and its arguments
+        """
         try:
             args = self.decode(chunk)
         except ValueError:
@@ -124,6 +235,53 @@ class JSONTransport(Transport):
         command = args.pop(0)
         return (command, args)
 
+
+class JSONTransport(JSONCoding, Transport):
+    """
+    Transport encoding messages by JSON, or another serializer negotiated
+    with the remote side
+    """
+    def send_message(self, message):
+        stats = self.endpoint.stats
+        if stats is not None:
+            start = clock()
+        chunk = self.compress(self.serializer.encode(message))
+        buffers = self.serializer.take_outgoing()
+        if stats is not None:
+            # The buffers are byte views, see Serializer.buffer_ref()
+            stats.sent(len(chunk) + sum(len(buf) for buf in buffers),
+                       clock() - start)
+        try:
+            if buffers:
+                self.send_chunk_buffers(chunk, buffers)
+            else:
+                self.send_chunk(chunk)
+        except IOError as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+
+    def receive(self):
+        try:
+            return self.receive_message(self.receive_chunk())
+        except IOError as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+
+    def receive_message(self, chunk):
+        """
+        Decode a received chunk, and receive the buffers following it
+        """
+        stats = self.endpoint.stats
+        if stats is not None:
+            start = clock()
+            size = len(chunk)
+        result = self.parse(self.decompress(chunk))
+        buffers = self.serializer.take_incoming()
+        if stats is not None:
+            stats.received(size + sum(len(buf) for buf in buffers),
+                           clock() - start)
+        if buffers:
+            self.receive_buffers(buffers)
+        return result
+
     def send_chunk(self, chunk):
         """
         Send a chunk of data across
@@ -136,11 +294,29 @@ class JSONTransport(Transport):
         """
         raise NotImplementedError("Please override receive_chunk().")
 
+    def send_chunk_buffers(self, chunk, buffers):
+        """
+        Send a chunk of data followed by the binary buffers
+        """
+        raise NotImplementedError("Please override send_chunk_buffers().")
+
+    def receive_buffers(self, buffers):
+        """
+        Fill the buffers with the data following the received chunk
+        """
+        raise NotImplementedError("Please override receive_buffers().")
+
 
 class StreamLineTransport(JSONTransport):
     """
     Transport sending messages through a file-like object
+
+    Messages are read in pieces of at most 'chunk_size' characters. The ones
+    longer than that are decoded incrementally as the pieces arrive, so the
+    whole line is never held in memory along with the decoded value.
     """
+    chunk_size = 65536
+
     def __init__(self, stream, endpoint):
         super(StreamLineTransport, self).__init__(endpoint)
         self.stream = stream
@@ -149,5 +325,226 @@ class StreamLineTransport(JSONTransport):
         print(chunk, file=self.stream)
         self.stream.flush()
 
+    def close(self):
+        self.stream.close()
+
     def receive_chunk(self):
         return self.stream.readline()
+
+    def receive(self):
+        stats = self.endpoint.stats
+        try:
+            chunk = self.stream.readline(self.chunk_size)
+            if len(chunk) < self.chunk_size or chunk.endswith('\n'):
+                if stats is not None:
+                    start = clock()
+                self.check_size(len(chunk))
+                result = self.parse(chunk)
+                if stats is not None:
+                    stats.received(len(chunk), clock() - start)
+                return result
+            return self.receive_incremental(chunk)
+        except IOError as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+
+    def receive_incremental(self, chunk):
+        """
+        Decode a message longer than a chunk, reading the rest of it
+        """
+        stats = self.endpoint.stats
+        elapsed = 0
+        decoder = IncrementalDecoder(
+            object_hook=self.serializer.decoder.decode_object)
+        size = 0
+        try:
+            while chunk:
+                size += len(chunk)
+                self.check_size(size)
+                if stats is not None:
+                    start = clock()
+                decoder.feed(chunk)
+                if stats is not None:
+                    elapsed += clock() - start
+                if chunk.endswith('\n'):
+                    break
+                chunk = self.stream.readline(self.chunk_size)
+            args = decoder.close()
+        except ValueError as exc:
+            raise TransportException("Invalid data received: %s" % exc)
+        if stats is not None:
+            stats.received(size, elapsed)
+        command = args.pop(0)
+        return (command, args)
+
+
+class SocketFrameTransport(JSONTransport):
+    """
+    Transport sending length-prefixed messages through a socket
+
+    Every message is preceded by its length in bytes as a 32-bit unsigned
+    big-endian integer. Messages are read straight into a reusable buffer,
+    so no newline scanning or text-mode stream is involved. The buffer grows
+    up to 'max_buffer_size' bytes. Longer JSON messages are read in pieces
+    of that size and decoded incrementally as they arrive, so the whole
+    message is never held in memory along with the decoded value; other
+    long messages are read into a buffer of their own, released once they
+    are decoded.
+
+    Binary buffers referenced by a message follow it as raw data, in the
+    order of the references, and are read straight into the memory
+    allocated for them when decoding the message.
+    """
+    HEADER = struct.Struct('!I')
+
+    binary = True
+    out_of_band = True
+
+    # Most buffers a single system call can write
+    IOV_MAX = 1024
+
+    # Largest receive buffer kept between messages
+    max_buffer_size = 65536
+
+    def __init__(self, sock, endpoint):
+        super(SocketFrameTransport, self).__init__(endpoint)
+        self.socket = sock
+        self.header = bytearray(self.HEADER.size)
+        self.buffer = bytearray(4096)
+
+    def send_chunk(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        self.send_buffers([self.HEADER.pack(len(chunk)), chunk])
+
+    def send_chunk_buffers(self, chunk, buffers):
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        self.send_buffers([self.HEADER.pack(len(chunk)), chunk] + buffers)
+
+    def receive_buffers(self, buffers):
+        for buf in buffers:
+            self.receive_into(memoryview(buf))
+
+    def close(self):
+        self.socket.close()
+
+    def send_buffers(self, buffers):
+        """
+        Write all the buffers to the socket in as few system calls as
+        possible
+        """
+        if not hasattr(self.socket, 'sendmsg'):
+            # Joined into one, as Python 2 cannot join memory views
+            data = bytearray()
+            for buf in buffers:
+                data += buf
+            self.socket.sendall(data)
+            return
+
+        buffers = [byte_view(buf) for buf in buffers]
+        while buffers:
+            sent = self.socket.sendmsg(buffers[:self.IOV_MAX])
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and sent:
+                buffers[0] = buffers[0][sent:]
+
+    def receive_into(self, view):
+        """
+        Fill the memory view with data from the socket
+        """
+        received = 0
+        size = len(view)
+        while received < size:
+            count = self.socket.recv_into(view[received:])
+            if not count:
+                raise TransportException("Connection closed.")
+            received += count
+
+    def receive(self):
+        try:
+            size = self.receive_size()
+            if size > self.max_buffer_size and \
+                    self.serializer.name == JSONSerializer.name:
+                return self.receive_incremental(size)
+            return self.receive_message(self.receive_body(size))
+        except IOError as exc:
+            raise TransportException("Transport error: '%s'" % exc)
+
+    def receive_incremental(self, size):
+        """
+        Decode a JSON message longer than the receive buffer, reading it in
+        pieces
+        """
+        if len(self.buffer) < self.max_buffer_size:
+            self.buffer = bytearray(self.max_buffer_size)
+        view = memoryview(self.buffer)[:self.max_buffer_size]
+        self.receive_into(view)
+        if self.codec is not None and view[:1] == COMPRESSED:
+            # Only decompressed whole
+            chunk = bytearray(size)
+            chunk[:len(view)] = view
+            self.receive_into(memoryview(chunk)[len(view):])
+            return self.receive_message(chunk)
+
+        stats = self.endpoint.stats
+        elapsed = 0
+        decoder = IncrementalDecoder(
+            object_hook=self.serializer.decoder.decode_object)
+        text = getincrementaldecoder('utf-8')()
+        received = len(view)
+        piece = view
+        try:
+            while True:
+                if stats is not None:
+                    start = clock()
+                # Copied anyway by the decoder, which Python 2's cannot do
+                decoder.feed(text.decode(piece.tobytes(), received == size))
+                if stats is not None:
+                    elapsed += clock() - start
+                if received == size:
+                    break
+                piece = view[:min(size - received, len(view))]
+                self.receive_into(piece)
+                received += len(piece)
+            args = decoder.close()
+        except ValueError as exc:
+            raise TransportException("Invalid data received: %s" % exc)
+        buffers = self.serializer.take_incoming()
+        if stats is not None:
+            stats.received(size + sum(len(buf) for buf in buffers), elapsed)
+        if buffers:
+            self.receive_buffers(buffers)
+        command = args.pop(0)
+        return (command, args)
+
+    def receive_size(self):
+        """
+        Receive the length of the next message
+        """
+        self.receive_into(memoryview(self.header))
+        (size,) = self.HEADER.unpack(self.header)
+        self.check_size(size)
+        return size
+
+    def receive_chunk(self):
+        """
+        Receive a message. The returned view is only valid until the next
+        call.
+        """
+        return self.receive_body(self.receive_size())
+
+    def receive_body(self, size):
+        """
+        Receive a message of the given length. The returned view is only
+        valid until the next call.
+        """
+        if size > self.max_buffer_size:
+            view = memoryview(bytearray(size))
+        else:
+            if size > len(self.buffer):
+                self.buffer = bytearray(size)
+            view = memoryview(self.buffer)[:size]
+        self.receive_into(view)
+        return view
@@ -7,6 +7,7 @@ from __future__ import absolute_import
 from websocket import create_connection, WebSocketException
 
 from eurydice.endpoint import Endpoint
+from eurydice.multiplex import MultiplexedEndpoint
 from eurydice.transport import JSONTransport, TransportException
 
 
@@ -14,6 +15,8 @@ class WebSocketTransport(JSONTransport):
     """
     Transport communicating through a websocket
     """
+    binary = True
+
     def __init__(self, stream, endpoint):
         super(WebSocketTransport, self).__init__(endpoint)
         self.stream = stream
@@ -23,7 +26,10 @@ class WebSocketTransport(JSONTransport):
             self.stream_receive = self.stream.receive
 
     def send_chunk(self, chunk):
-        self.stream.send(chunk)
+        if isinstance(chunk, bytes) and hasattr(self.stream, 'send_binary'):
+            self.stream.send_binary(chunk)
+        else:
+            self.stream.send(chunk)
 
     def receive_chunk(self):
         try:
@@ -31,6 +37,9 @@ class WebSocketTransport(JSONTransport):
         except WebSocketException as exc:
             raise TransportException("Transport error: '%s'" % exc)
 
+    def close(self):
+        self.stream.close()
+
 
 class WebSocketEndpoint(Endpoint):
     """
@@ -44,10 +53,45 @@ class WebSocketEndpoint(Endpoint):
 class Client(WebSocketEndpoint):
     """
     An endpoint connecting to a WebSocket server
+
+    The serializers to offer the remote side can be restricted by passing a
+    list of their names. 'compression' lists the names of the codecs to offer
+    for compressing large messages, see eurydice.compression. 'stats' is a
+    eurydice.stats.Stats object to collect the statistics of the connection
+    into.
+
+    Servers not knowing about the handshake may drop the connection or
+    ignore it; the client then connects again and talks JSON, without a
+    handshake. 'handshake_timeout' is how long to wait for the reply, in
+    seconds.
     """
-    def __init__(self, url):
-        websocket = create_connection(url)
+    handshake_timeout = 10
+
+    def __init__(self, url, serializers=None, stats=None, compression=()):
+        websocket = create_connection(url, timeout=self.handshake_timeout)
         super(Client, self).__init__(websocket)
+        self.transport.allowed_serializers = serializers
+        self.transport.compression = compression
+        self.stats = stats
+        try:
+            self.handshake()
+        except TransportException:
+            self.transport.close()
+            self.transport = WebSocketTransport(create_connection(url), self)
+        else:
+            websocket.settimeout(None)
+
+
+class MultiplexedClient(Client, MultiplexedEndpoint):
+    """
+    A WebSocket client which can be shared between threads. Callbacks from
+    the remote side are processed by the thread whose call they are made
+    from.
+    """
+    def __init__(self, url, serializers=None, stats=None, compression=()):
+        super(MultiplexedClient, self).__init__(url, serializers, stats,
+                                                compression)
+        self.start()
 
 
 def websocket_endpoint(environ, start_response):
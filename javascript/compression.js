@@ -0,0 +1,89 @@
+var zlib = require('zlib');
+
+/**
+ * Codecs compressing large messages. Compressed messages are prefixed with a
+ * zero byte, which neither JSON nor MessagePack messages start with.
+ */
+
+var COMPRESSED = 0;
+
+// Preset dictionary with the strings repeated in most messages, shared by
+// all the implementations
+var DICTIONARY = new Buffer(
+  '{"_remote_proxy":{"instance":"server","id":' +
+  '{"_remote_proxy":{"id":,"instance":"PY0.","fields":{"pure":[' +
+  '"delete_many",["context",["tagged",["call",["return",' +
+  '{"_remote_proxy": {"id": , "instance": "PY0.'
+);
+
+function Codec(name, dictionary) {
+  var options = dictionary ? {dictionary: dictionary} : {};
+
+  this.name = name;
+
+  // Compress a message if it is large enough
+  this.compress = function (message) {
+    var size = Buffer.isBuffer(message) ?
+      message.length : Buffer.byteLength(message);
+    if (size < exports.threshold) {
+      return message;
+    }
+    if (!Buffer.isBuffer(message)) {
+      message = new Buffer(message, 'utf8');
+    }
+    return Buffer.concat([
+      new Buffer([COMPRESSED]),
+      zlib.deflateSync(message, options)
+    ]);
+  };
+
+  // Decompress a message if it is compressed, passing it to the callback.
+  // The message is inflated as a stream, and refused once the output grows
+  // past exports.maxSize, without inflating the rest.
+  this.decompress = function (message, callback) {
+    if (!Buffer.isBuffer(message) || message[0] !== COMPRESSED) {
+      callback(null, message);
+      return;
+    }
+    var inflate = zlib.createInflate(options);
+    var chunks = [];
+    var size = 0;
+    var done = false;
+
+    function finish(err, result) {
+      if (!done) {
+        done = true;
+        callback(err, result);
+      }
+    }
+
+    inflate.on('data', function (chunk) {
+      size += chunk.length;
+      if (exports.maxSize !== null && size > exports.maxSize) {
+        // Stop reading, the stream stops inflating once its buffer is full
+        inflate.removeAllListeners('data');
+        inflate.pause();
+        chunks = null;
+        finish(new Error('Message too long.'));
+        return;
+      }
+      chunks.push(chunk);
+    });
+    inflate.on('error', finish);
+    inflate.on('end', function () {
+      finish(null, Buffer.concat(chunks, size));
+    });
+    inflate.end(message.slice(1));
+  };
+}
+
+// Size in bytes from which the messages are compressed
+exports.threshold = 1024;
+
+// Largest decompressed message to accept, in bytes, null for no limit
+exports.maxSize = null;
+
+exports.codecs = {
+  'zlib-dict': new Codec('zlib-dict', DICTIONARY),
+  'zlib': new Codec('zlib')
+};
@@ -4,9 +4,11 @@ var Q = require('q');
  * A test class concatentating strings passed in various ways
  */
 function Concat(own) {
-  var _own = own;
+  var self = this;
   var _source;
 
+  this.own = own;
+
   /**
    * Add an object to ask for a string to concatenate from
    */
@@ -29,7 +31,7 @@ function Concat(own) {
     }
 
     return source_str.then(function (str) {
-      return _own + str + other;
+      return self.own + str + other;
     });
   };
 
@@ -42,3 +44,75 @@ function Concat(own) {
 }
 
 exports.create = function (arg) { return new Concat(arg); };
+
+/**
+ * An immutable point
+ */
+exports.point = function (x, y) {
+  return Object.freeze({
+    x: x,
+    y: y,
+    norm2: function () {
+      return x * x + y * y;
+    }
+  });
+};
+
+/**
+ * An iterator over the numbers from 0 to count - 1
+ */
+exports.numbers = function (count) {
+  var current = 0;
+  return {
+    next: function () {
+      return current < count ? {value: current++, done: false} : {done: true};
+    }
+  };
+};
+
+/**
+ * Return the bytes in the reverse order
+ */
+exports.reverse_bytes = function (data) {
+  var result = new Buffer(data.length);
+  for (var i = 0; i < data.length; i++) {
+    result[i] = data[data.length - 1 - i];
+  }
+  return result;
+};
+
+/**
+ * Reverse every one of several byte sequences
+ */
+exports.reverse_all = function (buffers) {
+  return buffers.map(exports.reverse_bytes);
+};
+
+/**
+ * Call back the object with one level less, returning the depth reached
+ */
+exports.bounce = function (other, depth) {
+  if (depth <= 0) {
+    return 0;
+  }
+  return other.bounce(depth - 1).then(function (reached) {
+    return reached + 1;
+  });
+};
+
+/**
+ * Squares numbers, counting the calls
+ */
+exports.squarer = function () {
+  var count = 0;
+  return {
+    eurydicePure: ['square'],
+    square: function (value) {
+      count++;
+      return value * value;
+    },
+    calls: function () {
+      return count;
+    }
+  };
+};
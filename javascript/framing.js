@@ -0,0 +1,138 @@
+var EventEmitter = require('events').EventEmitter;
+var util = require('util');
+
+var HEADER_SIZE = 4;
+
+/**
+ * Wrap a TCP socket into an object with the same interface as a WebSocket
+ * (send() and a 'message' event), delimiting messages by a 32-bit
+ * big-endian length prefix. Messages are emitted as Buffers.
+ *
+ * Binary buffers can follow a message as raw data; the listener calls
+ * receiveBuffers() with the buffers to fill before the next message. A
+ * listener which needs time to tell whether buffers follow calls hold(),
+ * and then receiveBuffers() or release().
+ */
+function FramedSocket(socket) {
+  var self = this;
+
+  EventEmitter.call(this);
+
+  // Received data not yet assembled into messages
+  var chunks = [];
+  var buffered = 0;
+
+  // Take exactly the given number of bytes from the received chunks
+  function take(size) {
+    var result;
+    if (chunks[0].length === size) {
+      result = chunks.shift();
+    } else if (chunks[0].length > size) {
+      result = chunks[0].slice(0, size);
+      chunks[0] = chunks[0].slice(size);
+    } else {
+      result = Buffer.concat(chunks, buffered);
+      chunks = [result.slice(size)];
+      result = result.slice(0, size);
+    }
+    buffered -= size;
+    return result;
+  }
+
+  var expected = null;
+
+  // Buffers to fill with the data following the last message, and the
+  // function to call once they are
+  var pending = [];
+  var onFilled = null;
+
+  // Whether the data is left alone until the listener releases it, and
+  // whether it is being processed already
+  var held = false;
+  var processing = false;
+
+  this.receiveBuffers = function (buffers, callback) {
+    pending = buffers.slice();
+    onFilled = callback;
+    self.release();
+  };
+
+  this.hold = function () {
+    held = true;
+  };
+
+  this.release = function () {
+    held = false;
+    if (!processing) {
+      processing = true;
+      try {
+        drain();
+      } finally {
+        processing = false;
+      }
+    }
+  };
+
+  this.close = function () {
+    socket.destroy();
+  };
+
+  function drain() {
+    while (!held) {
+      if (pending.length) {
+        var buffer = pending[0];
+        if (buffered < buffer.length) {
+          return;
+        }
+        if (buffer.length) {
+          take(buffer.length).copy(buffer);
+        }
+        pending.shift();
+        if (!pending.length) {
+          var callback = onFilled;
+          onFilled = null;
+          callback();
+        }
+        continue;
+      }
+      if (expected === null) {
+        if (buffered < HEADER_SIZE) {
+          return;
+        }
+        expected = take(HEADER_SIZE).readUInt32BE(0);
+      }
+      if (buffered < expected) {
+        return;
+      }
+      var message = expected ? take(expected) : new Buffer(0);
+      expected = null;
+      self.emit('message', message);
+    }
+  }
+
+  socket.on('data', function (data) {
+    chunks.push(data);
+    buffered += data.length;
+    if (!held) {
+      self.release();
+    }
+  });
+
+  socket.on('close', function () {
+    self.emit('close');
+  });
+
+  this.send = function (message, buffers) {
+    var payload = Buffer.isBuffer(message) ? message : new Buffer(message, 'utf8');
+    var header = new Buffer(HEADER_SIZE);
+    header.writeUInt32BE(payload.length, 0);
+    socket.write(Buffer.concat([header, payload]));
+    (buffers || []).forEach(function (buffer) {
+      socket.write(buffer);
+    });
+  };
+}
+
+util.inherits(FramedSocket, EventEmitter);
+
+module.exports = FramedSocket;
@@ -1,16 +1,49 @@
 var Q = require('q');
 
+var compression = require('./compression.js');
+var Iterator = require('./iterator.js');
+var Registry = require('./registry.js');
+
+var msgpack;
+try {
+  msgpack = require('msgpack-lite');
+} catch (e) {
+  // MessagePack is optional
+}
+
+// MessagePack extension type for remote object references
+var REMOTE_PROXY = 1;
+// ...and for binary buffers sent out of band
+var BUFFER = 2;
+
+// Tags standing for the instances in the compact references: the side
+// sending the reference and the side receiving it
+var SENDER = 0;
+var RECEIVER = 1;
+
+// Buffers to send after the message being encoded, or to receive after the
+// message being decoded; null when they are sent inline
+var segments = null;
+
+// Modules imported before serving any session, see preload(); every
+// session exports them first, so they get the same IDs in all of them
+var preloaded = [];
+
 function noop() {}
 
 function constant(value) {
   return function () { return value; };
 }
 
-var remoteDescriptor = function (endpoint, obj) {
+var remoteDescriptor = function (endpoint, obj, fields) {
   return function (method) {
     if (method === 'inspect') {
       return constant('[Remote proxy]');
     }
+    if (fields && fields.hasOwnProperty(method)) {
+      // Public field of an immutable object
+      return {value: fields[method]};
+    }
     return {
       get: function () {
         return function () {
@@ -24,10 +57,10 @@ var remoteDescriptor = function (endpoint, obj) {
   };
 };
 
-var remoteProxy = function (endpoint, obj) {
+var remoteProxy = function (endpoint, obj, fields) {
   return {
-    getOwnPropertyDescriptor: remoteDescriptor(endpoint, obj),
-    getPropertyDescriptor: remoteDescriptor(endpoint, obj),
+    getOwnPropertyDescriptor: remoteDescriptor(endpoint, obj, fields),
+    getPropertyDescriptor: remoteDescriptor(endpoint, obj, fields),
     getOwnPropertyNames: constant([]),
     getPropertyNames: constant([]),
     defineProperty: noop,
@@ -36,97 +69,416 @@ var remoteProxy = function (endpoint, obj) {
   };
 };
 
+/**
+ * A reference to an object in the MessagePack representation
+ */
+function RemoteRef(data) {
+  this.data = data;
+}
+
+/**
+ * A buffer sent out of band, in the MessagePack representation
+ */
+function BufferRef(size) {
+  this.size = size;
+}
+
+/**
+ * Allocate a buffer to be filled with the data following the message
+ */
+function thawBuffer(ref) {
+  var buffer = new Buffer(ref.size);
+  segments.push(buffer);
+  return buffer;
+}
+
+/**
+ * Whether a value is an object holding nothing but a reference under the
+ * key, as opposed to the caller's data using the same key
+ */
+function tagged(value, key) {
+  return typeof(value) === 'object' && value !== null &&
+    !Array.isArray(value) && Object.keys(value).length === 1 &&
+    typeof(value[key]) === 'object' && value[key] !== null;
+}
+
+/**
+ * Convert the references to objects in a value, including in arrays, to
+ * their MessagePack representation, queueing the buffers sent out of band
+ */
+function toRef(value) {
+  if (Array.isArray(value)) {
+    return value.map(toRef);
+  }
+  if (segments !== null && Buffer.isBuffer(value)) {
+    segments.push(value);
+    return new BufferRef(value.length);
+  }
+  if (tagged(value, '_ref') && Array.isArray(value._ref)) {
+    return new RemoteRef({
+      instance: value._ref[0],
+      id: value._ref[1],
+      fields: value._ref[2] && toRefs(value._ref[2]),
+      pure: value._ref[3]
+    });
+  }
+  if (tagged(value, '_remote_proxy')) {
+    var data = value._remote_proxy;
+    if (data.fields) {
+      data = {
+        instance: data.instance,
+        id: data.id,
+        fields: toRefs(data.fields),
+        pure: data.pure
+      };
+    }
+    return new RemoteRef(data);
+  }
+  return value;
+}
+
+/**
+ * Convert the references to objects in the values of an object to their
+ * MessagePack representation
+ */
+function toRefs(values) {
+  var result = {};
+  Object.keys(values).forEach(function (key) {
+    result[key] = toRef(values[key]);
+  });
+  return result;
+}
+
+var serializers = {
+  json: {
+    encode: function (message) {
+      if (segments === null) {
+        return JSON.stringify(message);
+      }
+      return JSON.stringify(message, function (key, value) {
+        // Buffers are converted by their toJSON() before getting here
+        if (Buffer.isBuffer(this[key])) {
+          segments.push(this[key]);
+          return {_buffer: {size: this[key].length}};
+        }
+        return value;
+      });
+    },
+    decode: function (message) {
+      if (segments === null) {
+        return JSON.parse(message.toString());
+      }
+      return JSON.parse(message.toString(), function (key, value) {
+        if (tagged(value, '_buffer')) {
+          return thawBuffer(value._buffer);
+        }
+        return value;
+      });
+    }
+  }
+};
+
+if (msgpack) {
+  var codec = msgpack.createCodec();
+  codec.addExtPacker(REMOTE_PROXY, RemoteRef, function (ref) {
+    var data = [ref.data.instance, ref.data.id];
+    if (ref.data.fields || ref.data.pure) {
+      data.push(ref.data.fields || null);
+    }
+    if (ref.data.pure) {
+      data.push(ref.data.pure);
+    }
+    return msgpack.encode(data, {codec: codec});
+  });
+  codec.addExtPacker(BUFFER, BufferRef, function (ref) {
+    return msgpack.encode([ref.size], {codec: codec});
+  });
+  codec.addExtUnpacker(BUFFER, function (buffer) {
+    var data = msgpack.decode(buffer, {codec: codec});
+    return thawBuffer({size: data[0]});
+  });
+  codec.addExtUnpacker(REMOTE_PROXY, function (buffer) {
+    var data = msgpack.decode(buffer, {codec: codec});
+    var proxy = {
+      instance: data[0],
+      id: data[1]
+    };
+    if (data.length > 2) {
+      proxy.fields = data[2];
+    }
+    return {_remote_proxy: proxy};
+  });
+
+  serializers.msgpack = {
+    encode: function (message) {
+      return msgpack.encode(toRef(message), {codec: codec});
+    },
+    decode: function (message) {
+      return msgpack.decode(message, {codec: codec});
+    }
+  };
+}
+
 module.exports = function Handler(socket) {
   var self = this;
 
   var instance = 'JS' + Math.random();
 
-  var objects = [];
+  var serializer = serializers.json;
+
+  var objects = new Registry();
+  preloaded.forEach(function (module) {
+    objects.pin(module);
+  });
 
   var commands = {};
 
-  // The unfinished call stack
+  // The unfinished call stack for untagged calls
   var stack = [];
 
+  // Whether binary buffers are sent out of band, after the messages
+  var outOfBand = false;
+
+  // Codec compressing large messages, once agreed upon
+  var codec = null;
+
+  // Identity of the remote side once compact references are agreed upon
+  var peer = null;
+
+  // Unfinished tagged calls
+  var pending = {};
+  var nextTag = 0;
+
+  // The representation of a reference, as an array with the instances of
+  // both sides replaced by their tags once compact references are agreed
+  // upon
+  function reference(proxy) {
+    if (peer === null) {
+      return {
+        _remote_proxy: proxy
+      };
+    }
+    var owner = proxy.instance;
+    if (owner === instance) {
+      owner = SENDER;
+    } else if (owner === peer) {
+      owner = RECEIVER;
+    }
+    var ref = [owner, proxy.id];
+    if (proxy.fields || proxy.pure) {
+      ref.push(proxy.fields || null);
+    }
+    if (proxy.pure) {
+      ref.push(proxy.pure);
+    }
+    return {
+      _ref: ref
+    };
+  }
+
   function freezeObject(obj) {
     var type = typeof(obj);
-    if (type === 'function' || type === 'object') {
+    if (Array.isArray(obj)) {
+      return obj.map(freezeObject);
+    } else if (Buffer.isBuffer(obj)) {
+      // Binary data is passed by value
+      return obj;
+    } else if (obj !== null && (type === 'function' || type === 'object')) {
       // Check if this is a proxy for a remote object and convert it back to
       // its representation
       if ('_remote_proxy' in obj) {
-        return {
-          _remote_proxy: obj._remote_proxy
-        };
+        return reference(obj._remote_proxy);
       }
-      // Actually object, store it in the array (checking if it's there
-      // already first)
-      var id = null;
-      for (var i = 0; i < objects.length; i++) {
-        if (objects[i] === obj) {
-          id = i;
-        }
+      // Actually object, store it in the registry
+      var id = objects.export(obj);
+      var proxy = {
+        id: id,
+        instance: instance
+      };
+      // Public fields of frozen objects are sent along with the reference
+      if (type === 'object' && Object.isFrozen(obj)) {
+        proxy.fields = {};
+        Object.keys(obj).forEach(function (key) {
+          if (key[0] !== '_' && typeof(obj[key]) !== 'function') {
+            proxy.fields[key] = freezeObject(obj[key]);
+          }
+        });
       }
-      if (id === null) {
-        id = objects.push(obj) - 1;
+      // Names of the methods whose results can be cached by the remote side
+      if (Array.isArray(obj.eurydicePure)) {
+        proxy.pure = obj.eurydicePure;
       }
-      return {
-        _remote_proxy: {
-          id: id,
-          instance: instance
-        }
-      };
-    } else if (typeof(obj) === 'array') {
-      return obj.map(freezeObject);
+      return reference(proxy);
     } else {
       return obj;
     }
   }
 
   function thawObject(obj) {
-    if (typeof(obj) === 'object' && obj !== null && '_remote_proxy' in obj) {
+    if (peer !== null && tagged(obj, '_ref') && Array.isArray(obj._ref)) {
+      obj = {
+        _remote_proxy: {
+          instance: obj._ref[0],
+          id: obj._ref[1],
+          fields: obj._ref[2] || undefined
+        }
+      };
+    }
+    if (tagged(obj, '_remote_proxy')) {
+      var owner = obj._remote_proxy.instance;
+      if (peer !== null && typeof(owner) === 'number') {
+        owner = owner === SENDER ? peer : instance;
+      }
       // Proxy for either a remote object or ours
-      if (obj._remote_proxy.instance === instance) {
+      if (owner === instance) {
         // Proxy for our object, get it back
-        return objects[obj._remote_proxy.id];
+        return objects.get(obj._remote_proxy.id);
       } else {
         // Create a proxy for the remote object
-        return Proxy.create(remoteProxy(self, obj));
+        var ref = {
+          _remote_proxy: {
+            id: obj._remote_proxy.id,
+            instance: owner
+          }
+        };
+        var fields = obj._remote_proxy.fields;
+        if (fields) {
+          Object.keys(fields).forEach(function (key) {
+            fields[key] = thawObject(fields[key]);
+          });
+        }
+        return Proxy.create(remoteProxy(self, ref, fields));
       }
     }
     return obj;
   }
 
+  // Received messages waiting for an earlier one to be decompressed
+  var incoming = [];
+  var decompressing = false;
+
   function receive(message) {
-    // parse the message
-    message = JSON.parse(message);
+    incoming.push(message);
+    nextMessage();
+  }
+
+  function nextMessage() {
+    while (!decompressing && incoming.length) {
+      var message = incoming.shift();
+      if (!codec) {
+        decode(message);
+        continue;
+      }
+      // The data following the message is left alone until it is known
+      // whether buffers follow it
+      decompressing = true;
+      if (socket.hold) {
+        socket.hold();
+      }
+      codec.decompress(message, decompressed);
+    }
+  }
+
+  function decompressed(err, message) {
+    decompressing = false;
+    if (err) {
+      // Refuse the message and the connection
+      incoming = [];
+      socket.close();
+      return;
+    }
+    decode(message);
+    nextMessage();
+  }
+
+  function decode(message) {
+    // parse the message, noting the buffers following it
+    segments = outOfBand ? [] : null;
+    try {
+      message = serializer.decode(message);
+    } finally {
+      var buffers = segments;
+      segments = null;
+    }
+    if (buffers && buffers.length) {
+      socket.receiveBuffers(buffers, function () {
+        dispatch(message);
+      });
+    } else {
+      try {
+        dispatch(message);
+      } finally {
+        if (socket.release) {
+          socket.release();
+        }
+      }
+    }
+  }
+
+  function dispatch(message) {
     // get the command
     var command = message.shift();
     // convert arguments
     var args = message.map(thawObject);
     // get the command
-    if (command in commands) {
-      commands[command].apply(void 0, args);
+    if (commands.hasOwnProperty(command)) {
+      commands[command].apply({}, args);
+    } else {
+      send(['error', 'Unknown command ' + command + '.']);
     }
   }
 
-  function send(message) {
+  // Send a message; the arguments of a plain one are sent as they are
+  // rather than as references
+  function send(message, plain) {
     // Freeze just the arguments, not the command
-    for (var i = 1; i < message.length; i++) {
+    for (var i = 1; i < message.length && !plain; i++) {
       message[i] = freezeObject(message[i]);
     }
-    message = JSON.stringify(message);
-    socket.send(message);
+    segments = outOfBand ? [] : null;
+    try {
+      message = serializer.encode(message);
+    } finally {
+      var buffers = segments;
+      segments = null;
+    }
+    if (codec) {
+      message = codec.compress(message);
+    }
+    if (buffers && buffers.length) {
+      socket.send(message, buffers);
+    } else {
+      socket.send(message);
+    }
   }
 
+  // Send a reply, tagged with the correlation ID and in the context of the
+  // command if it had them
+  function reply(meta, command, value) {
+    var message = [command, value];
+    if (meta.tag !== undefined) {
+      message = ['tagged', meta.tag].concat(message);
+    }
+    if (meta.context !== undefined) {
+      message = ['context', meta.context].concat(message);
+    }
+    send(message);
+  }
+
+  // Wrap a command to send its result back; the tag and the context of the
+  // command are passed as 'this'
   function sendResult(func) {
-    return function () {
+    var result = function () {
+      var meta = this;
       Q.fapply(func, arguments)
       .then(function (result) {
-        send(['return', result]);
+        reply(meta, 'return', result);
       }).catch(function (error) {
-        send(['error', error.toString()]);
+        reply(meta, 'error', error.toString());
       });
     };
+    result.callback = true;
+    return result;
   }
 
   commands.call = sendResult(function (obj, method, args) {
@@ -146,16 +498,78 @@ module.exports = function Handler(socket) {
     return require(module);
   });
 
+  commands.getattr = sendResult(function (obj, name) {
+    return obj[name];
+  });
+
+  commands.setattr = sendResult(function (obj, name, value) {
+    obj[name] = value;
+  });
+
+  commands.iter = sendResult(function (obj, size) {
+    var iterator = new Iterator(obj);
+    return [iterator].concat(iterator.nextChunk(size));
+  });
+
+  commands.next_chunk = sendResult(function (iterator, size) {
+    return iterator.nextChunk(size);
+  });
+
+  commands.ping = sendResult(function () {
+    return null;
+  });
+
   commands.delete = sendResult(function (obj) {
-    for (var i = 0; i < objects.length; i++) {
-      if (obj === objects[i]) {
-        delete objects[i];
-        return;
-      }
+    if (!objects.releaseObject(obj)) {
+      throw "Object not found.";
     }
-    throw "Object not found.";
   });
 
+  // Release several objects at once, without replying
+  commands.delete_many = function (ids) {
+    for (var i = 0; i < ids.length; i++) {
+      objects.release(ids[i]);
+    }
+  };
+
+  // Results are not cached on this side, nothing to forget
+  commands.invalidate = function () {
+  };
+
+  commands.hello = function (options) {
+    var accepted = {};
+    var offered = options.serializers || [];
+    for (var i = 0; i < offered.length; i++) {
+      if (serializers.hasOwnProperty(offered[i])) {
+        accepted.serializer = offered[i];
+        break;
+      }
+    }
+    // Buffers are sent after the messages, which must be delimited
+    if (options.buffers && socket.receiveBuffers) {
+      accepted.buffers = true;
+    }
+    // References to the objects of both sides are sent as short tags
+    if (options.compact_refs) {
+      accepted.compact_refs = [options.compact_refs, instance];
+    }
+    var codecs = options.compression || [];
+    for (i = 0; i < codecs.length; i++) {
+      if (compression.codecs.hasOwnProperty(codecs[i])) {
+        accepted.compression = codecs[i];
+        break;
+      }
+    }
+    // Reply with the old serializer, then switch
+    send(['return', accepted], true);
+    if (accepted.serializer) {
+      serializer = serializers[accepted.serializer];
+    }
+    outOfBand = !!accepted.buffers;
+    codec = compression.codecs[accepted.compression] || null;
+    peer = accepted.compact_refs ? options.compact_refs : null;
+  };
+
   commands.error = function (err) {
     var deferred = stack.pop();
     deferred.reject(err);
@@ -166,19 +580,59 @@ module.exports = function Handler(socket) {
     deferred.resolve(value);
   };
 
+  commands.tagged = function (tag, command) {
+    var args = Array.prototype.slice.call(arguments, 2);
+
+    if (command === 'return' || command === 'error') {
+      var deferred = pending[tag];
+      delete pending[tag];
+      if (command === 'return') {
+        deferred.resolve(args[0]);
+      } else {
+        deferred.reject(args[0]);
+      }
+    } else if (commands.hasOwnProperty(command) && commands[command].callback) {
+      commands[command].apply({tag: tag, context: this.context}, args);
+    } else {
+      reply({tag: tag, context: this.context}, 'error',
+            'Invalid tagged command ' + command + '.');
+    }
+  };
+
+  commands.context = function (context, command) {
+    var args = Array.prototype.slice.call(arguments, 2);
+
+    if (commands.hasOwnProperty(command)) {
+      commands[command].apply({context: context}, args);
+    } else {
+      reply({context: context}, 'error', 'Unknown command ' + command + '.');
+    }
+  };
+
   this.do_call = function (obj, method, args) {
     // unpack a variable number of arguments
     args = Array.prototype.slice.call(arguments);
     obj = args.shift();
     method = args.shift();
 
-    // create a deferred to be resolved by the remote side
+    // create a deferred to be resolved by the remote side; several calls
+    // can be outstanding at once, so they are tagged
     var result = Q.defer();
-    stack.push(result);
+    var tag = nextTag++;
+    pending[tag] = result;
 
-    send(['call', obj, method].concat(args));
+    send(['tagged', tag, 'call', obj, method].concat(args));
     return result.promise;
   };
 
   socket.on('message', receive);
 };
+
+/**
+ * Import the modules before serving any session
+ */
+module.exports.preload = function (modules) {
+  modules.forEach(function (module) {
+    preloaded.push(require(module));
+  });
+};
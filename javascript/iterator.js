@@ -0,0 +1,42 @@
+/**
+ * Iteration over an array or an iterator (an object with a 'next' method
+ * returning {value: ..., done: ...}), in chunks
+ */
+function Iterator(iterable) {
+  if (Array.isArray(iterable)) {
+    var index = 0;
+    this.next = function () {
+      return index < iterable.length ?
+          {value: iterable[index++], done: false} : {done: true};
+    };
+  } else if (typeof(Symbol) !== 'undefined' && Symbol.iterator &&
+             iterable !== null && iterable !== undefined &&
+             typeof(iterable[Symbol.iterator]) === 'function') {
+    var iterator = iterable[Symbol.iterator]();
+    this.next = function () { return iterator.next(); };
+  } else if (iterable && typeof(iterable.next) === 'function') {
+    this.next = function () { return iterable.next(); };
+  } else {
+    throw "Object is not iterable.";
+  }
+  this.done = false;
+}
+
+/**
+ * Take up to 'size' items, returning them and whether the iterator is
+ * exhausted
+ */
+Iterator.prototype.nextChunk = function (size) {
+  var items = [];
+  while (!this.done && items.length < size) {
+    var step = this.next();
+    if (step.done) {
+      this.done = true;
+    } else {
+      items.push(step.value);
+    }
+  }
+  return [items, items.length < size];
+};
+
+module.exports = Iterator;
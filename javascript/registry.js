@@ -0,0 +1,84 @@
+/**
+ * The objects referenced from the remote side
+ *
+ * Every object gets an ID when first exported, and keeps it while the remote
+ * side holds references to it. Each export is counted, and the object is
+ * dropped once the remote side releases all of them. The IDs of the dropped
+ * objects are reused.
+ */
+function Registry() {
+  // Object to its entry
+  this.entries = new Map();
+  // ID to the entry, for the objects exported
+  this.byId = [];
+  // IDs not in use
+  this.free = [];
+}
+
+/**
+ * Add a reference to an object, returning its ID
+ */
+Registry.prototype.export = function (obj) {
+  var entry = this.entries.get(obj);
+  if (entry === undefined) {
+    var id = this.free.length ? this.free.pop() : this.byId.length;
+    entry = {id: id, obj: obj, count: 0};
+    this.entries.set(obj, entry);
+    this.byId[id] = entry;
+  }
+  entry.count++;
+  return entry.id;
+};
+
+/**
+ * Export an object for good, e.g. a module preloaded for all the sessions,
+ * returning its ID; the remote side cannot release it
+ */
+Registry.prototype.pin = function (obj) {
+  var id = this.export(obj);
+  this.entries.get(obj).count = Infinity;
+  return id;
+};
+
+/**
+ * Return the object with the ID
+ */
+Registry.prototype.get = function (id) {
+  var entry = this.byId[id];
+  return entry && entry.obj;
+};
+
+/**
+ * Release a reference to the object with the ID, returning whether it was
+ * exported
+ */
+Registry.prototype.release = function (id) {
+  var entry = this.byId[id];
+  if (!entry) {
+    return false;
+  }
+  entry.count--;
+  if (entry.count === 0) {
+    this.entries.delete(entry.obj);
+    this.byId[id] = undefined;
+    this.free.push(id);
+  }
+  return true;
+};
+
+/**
+ * Release a reference to the object, returning whether it was exported
+ */
+Registry.prototype.releaseObject = function (obj) {
+  var entry = this.entries.get(obj);
+  return entry !== undefined && this.release(entry.id);
+};
+
+/**
+ * The number of objects exported
+ */
+Registry.prototype.size = function () {
+  return this.entries.size;
+};
+
+module.exports = Registry;
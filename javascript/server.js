@@ -1,9 +1,51 @@
 var Server = require('./handler.js');
 
-var WebSocketServer = require('ws').Server;
+// A port number or, with --framed, a URL: 'tcp://host:port' or
+// 'unix:///path/to/socket'
+var port = process.argv.slice(2).filter(function (arg) {
+  return arg.slice(0, 2) !== '--';
+})[0];
 
-var wss = new WebSocketServer({port: process.argv[2]});
-
-wss.on('connection', function (ws) {
-  new Server(ws);
+// Modules to import before serving any client: --preload=module,...
+// Largest decompressed message to accept: --max-message-size=bytes
+process.argv.forEach(function (arg) {
+  if (arg.slice(0, 10) === '--preload=') {
+    Server.preload(arg.slice(10).split(','));
+  } else if (arg.slice(0, 19) === '--max-message-size=') {
+    require('./compression.js').maxSize = parseInt(arg.slice(19), 10);
+  }
 });
+
+if (process.argv.indexOf('--framed') !== -1) {
+  // Length-prefixed messages over plain TCP or a Unix socket
+  var net = require('net');
+  var FramedSocket = require('./framing.js');
+
+  var server = net.createServer(function (socket) {
+    socket.setNoDelay(true);
+    new Server(new FramedSocket(socket));
+  });
+
+  var match;
+  if ((match = /^unix:\/\/(.+)$/.exec(port))) {
+    // A socket file left by a previous server prevents binding
+    try {
+      require('fs').unlinkSync(match[1]);
+    } catch (e) {
+      // No such file
+    }
+    server.listen(match[1]);
+  } else if ((match = /^tcp:\/\/(.*):(\d+)$/.exec(port))) {
+    server.listen(match[2], match[1]);
+  } else {
+    server.listen(port);
+  }
+} else {
+  var WebSocketServer = require('ws').Server;
+
+  var wss = new WebSocketServer({port: port});
+
+  wss.on('connection', function (ws) {
+    new Server(ws);
+  });
+}
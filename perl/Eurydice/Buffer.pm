@@ -0,0 +1,44 @@
+package Eurydice::Buffer;
+
+use strict;
+use warnings;
+
+#
+# Binary data to send out of band, after the message referencing it.
+# Received buffers are passed to the Perl code as plain strings.
+#
+sub new {
+	my ($class, $data, %options) = @_;
+
+	my $this = bless {}, $class;
+
+	$this->{data} = $data;
+
+	# Type and shape of the elements, for NumPy arrays
+	$this->{dtype} = $options{dtype};
+	$this->{shape} = $options{shape};
+
+	return $this;
+}
+
+sub data {
+	my ($this) = @_;
+
+	return $this->{data};
+}
+
+#
+# The description of the buffer sent in its place
+#
+sub description {
+	my ($this) = @_;
+
+	my %ref = (size => length $this->{data});
+	if (defined $this->{dtype}) {
+		$ref{dtype} = $this->{dtype};
+		$ref{shape} = $this->{shape};
+	}
+	return \%ref;
+}
+
+1;
@@ -0,0 +1,111 @@
+package Eurydice::Compression;
+
+#
+# Codecs compressing large messages. Compressed messages are prefixed with a
+# zero byte, which neither JSON nor MessagePack messages start with.
+#
+
+use strict;
+use warnings;
+
+use Compress::Raw::Zlib qw(Z_BUF_ERROR);
+use Compress::Zlib qw(deflateInit Z_OK Z_STREAM_END);
+
+our $COMPRESSED = "\0";
+
+# Size in bytes from which the messages are compressed
+our $THRESHOLD = 1024;
+
+# Largest decompressed message to accept, in bytes, undef for no limit
+our $MAX_SIZE;
+
+# Preset dictionary with the strings repeated in most messages, shared by all
+# the implementations
+our $DICTIONARY =
+	q({"_remote_proxy":{"instance":"server","id":) .
+	q({"_remote_proxy":{"id":,"instance":"PY0.","fields":{"pure":[) .
+	q("delete_many",["context",["tagged",["call",["return",) .
+	q({"_remote_proxy": {"id": , "instance": "PY0.);
+
+# Preset dictionaries by the codec name
+my %CODECS = (
+	'zlib-dict' => $DICTIONARY,
+	'zlib' => undef,
+);
+
+#
+# The codec with the given name, undef if unknown
+#
+sub new {
+	my ($class, $name) = @_;
+
+	return unless exists $CODECS{$name};
+
+	my $this = bless {}, $class;
+
+	$this->{name} = $name;
+	$this->{dictionary} = $CODECS{$name};
+
+	return $this;
+}
+
+sub name {
+	my ($this) = @_;
+
+	return $this->{name};
+}
+
+#
+# Compress a message if it is large enough
+#
+sub compress {
+	my ($this, $message) = @_;
+
+	return $message if length($message) < $THRESHOLD;
+
+	my @dictionary = defined $this->{dictionary} ?
+		(-Dictionary => $this->{dictionary}) : ();
+	my ($deflater) = deflateInit(@dictionary);
+	my ($output, $status) = $deflater->deflate($message);
+	die("Compression failed: $status") if $status != Z_OK;
+	my ($rest) = $deflater->flush();
+
+	return $COMPRESSED . $output . $rest;
+}
+
+#
+# Decompress a message if it is compressed. The output is produced a piece
+# at a time, so that a message larger than $MAX_SIZE is refused without
+# being inflated whole.
+#
+sub decompress {
+	my ($this, $message) = @_;
+
+	return $message if substr($message, 0, 1) ne $COMPRESSED;
+
+	my @dictionary = defined $this->{dictionary} ?
+		(-Dictionary => $this->{dictionary}) : ();
+	my ($inflater, $status) = Compress::Raw::Zlib::Inflate->new(
+		-LimitOutput => 1,
+		-AppendOutput => 1,
+		@dictionary,
+	);
+	die("Cannot decompress: $status") if $status != Z_OK;
+
+	my $input = substr($message, 1);
+	my $output = '';
+	while (1) {
+		my $size = length($output);
+		$status = $inflater->inflate($input, $output);
+		die("Decompressed message larger than the limit of $MAX_SIZE bytes")
+			if defined $MAX_SIZE && length($output) > $MAX_SIZE;
+		last if $status == Z_STREAM_END;
+		die("Invalid compressed data received: $status")
+			if ($status != Z_OK && $status != Z_BUF_ERROR) ||
+				length($output) == $size;
+	}
+
+	return $output;
+}
+
+1;
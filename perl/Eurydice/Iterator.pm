@@ -0,0 +1,63 @@
+package Eurydice::Iterator;
+
+use strict;
+use warnings;
+
+use Scalar::Util qw(blessed reftype);
+
+#
+# Iteration over an array, a code reference or an object with a 'next'
+# method; the latter two return undef once exhausted, while arrays can
+# contain undef
+#
+# $this->{next} returns the next item as a list of one, or an empty list
+# once exhausted
+#
+sub new {
+	my ($class, $iterable) = @_;
+
+	my $this = bless {}, $class;
+
+	if (blessed $iterable && $iterable->can('next')) {
+		$this->{next} = sub {
+			my $item = $iterable->next;
+			return defined $item ? ($item) : ();
+		};
+	} elsif (reftype($iterable) && reftype($iterable) eq 'CODE') {
+		$this->{next} = sub {
+			my $item = $iterable->();
+			return defined $item ? ($item) : ();
+		};
+	} elsif (reftype($iterable) && reftype($iterable) eq 'ARRAY') {
+		my $index = 0;
+		$this->{next} = sub {
+			return $index < @{$iterable} ? ($iterable->[$index++]) : ();
+		};
+	} else {
+		die("Object is not iterable.\n");
+	}
+
+	return $this;
+}
+
+#
+# Take up to $size items, returning them and whether the iterator is
+# exhausted
+#
+sub next_chunk {
+	my ($this, $size) = @_;
+
+	my @items;
+	while (!$this->{done} && @items < $size) {
+		my @item = $this->{next}->();
+		if (@item) {
+			push @items, @item;
+		} else {
+			$this->{done} = 1;
+		}
+	}
+
+	return (\@items, @items < $size ? 1 : 0);
+}
+
+1;
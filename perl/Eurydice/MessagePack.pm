@@ -0,0 +1,247 @@
+package Eurydice::MessagePack;
+
+#
+# A minimal MessagePack codec supporting extension types, which are used
+# for the remote object references
+#
+
+use strict;
+use warnings;
+
+use B;
+
+use JSON ();
+
+use Scalar::Util qw(blessed);
+
+sub new {
+	my ($class, %options) = @_;
+
+	my $this = bless {}, $class;
+
+	# Called with a blessed object, must return ($type, $data)
+	$this->{pack_object} = $options{pack_object};
+
+	# Called with ($type, $data), must return the value
+	$this->{unpack_ext} = $options{unpack_ext};
+
+	return $this;
+}
+
+sub encode {
+	my ($this, $value) = @_;
+
+	my $result = '';
+	$this->_pack($value, \$result);
+	return $result;
+}
+
+sub _pack_length {
+	my ($length, $result, $fix_base, $fix_limit, @types) = @_;
+
+	if (defined $fix_base && $length < $fix_limit) {
+		$$result .= chr($fix_base | $length);
+	} elsif (defined $types[0] && $length < 0x100) {
+		$$result .= pack('CC', $types[0], $length);
+	} elsif ($length < 0x10000) {
+		$$result .= pack('Cn', $types[1], $length);
+	} else {
+		$$result .= pack('CN', $types[2], $length);
+	}
+}
+
+my %FIXEXT_TYPE = (1 => 0xd4, 2 => 0xd5, 4 => 0xd6, 8 => 0xd7, 16 => 0xd8);
+
+sub _pack_ext {
+	my ($this, $value, $result) = @_;
+
+	my ($type, $data) = $this->{pack_object}->($value);
+	my $length = length $data;
+	if (exists $FIXEXT_TYPE{$length}) {
+		$$result .= chr($FIXEXT_TYPE{$length});
+	} else {
+		_pack_length($length, $result, undef, undef, 0xc7, 0xc8, 0xc9);
+	}
+	$$result .= pack('c', $type) . $data;
+}
+
+sub _pack {
+	my ($this, $value, $result) = @_;
+
+	if (!defined $value) {
+		$$result .= "\xc0";
+		return;
+	}
+
+	if (blessed $value) {
+		if (JSON::is_bool($value)) {
+			$$result .= $value ? "\xc3" : "\xc2";
+			return;
+		}
+
+		$this->_pack_ext($value, $result);
+		return;
+	}
+
+	my $ref = ref $value;
+	if ($ref eq 'ARRAY') {
+		_pack_length(scalar @$value, $result, 0x90, 16, undef, 0xdc, 0xdd);
+		$this->_pack($_, $result) foreach @$value;
+		return;
+	}
+	if ($ref eq 'HASH') {
+		_pack_length(scalar keys %$value, $result, 0x80, 16, undef, 0xde, 0xdf);
+		foreach my $key (keys %$value) {
+			$this->_pack("$key", $result);
+			$this->_pack($value->{$key}, $result);
+		}
+		return;
+	}
+	if ($ref) {
+		# Other references (code, scalar) are passed as objects
+		$this->_pack_ext($value, $result);
+		return;
+	}
+
+	my $flags = B::svref_2object(\$value)->FLAGS;
+	if (!($flags & B::SVp_POK)) {
+		if ($flags & B::SVp_IOK && $value == int($value)) {
+			if ($value >= 0) {
+				if ($value < 0x80) {
+					$$result .= chr($value);
+				} elsif ($value < 0x100) {
+					$$result .= pack('CC', 0xcc, $value);
+				} elsif ($value < 0x10000) {
+					$$result .= pack('Cn', 0xcd, $value);
+				} elsif ($value <= 0xffffffff) {
+					$$result .= pack('CN', 0xce, $value);
+				} else {
+					$$result .= pack('CQ>', 0xcf, $value);
+				}
+			} elsif ($value >= -32) {
+				$$result .= pack('c', $value);
+			} else {
+				$$result .= pack('Cq>', 0xd3, $value);
+			}
+			return;
+		}
+		if ($flags & B::SVp_NOK) {
+			$$result .= pack('Cd>', 0xcb, $value);
+			return;
+		}
+	}
+
+	my $string = "$value";
+	utf8::encode($string);
+	_pack_length(length $string, $result, 0xa0, 32, 0xd9, 0xda, 0xdb);
+	$$result .= $string;
+}
+
+sub decode {
+	my ($this, $data) = @_;
+
+	my $offset = 0;
+	my $value = $this->_unpack(\$data, \$offset);
+	if ($offset != length $data) {
+		die('Extra data after a MessagePack value.');
+	}
+	return $value;
+}
+
+sub _take {
+	my ($data, $offset, $length) = @_;
+
+	if ($$offset + $length > length $$data) {
+		die('Truncated MessagePack data.');
+	}
+	my $chunk = substr($$data, $$offset, $length);
+	$$offset += $length;
+	return $chunk;
+}
+
+sub _array {
+	my ($this, $data, $offset, $count) = @_;
+
+	return [map { $this->_unpack($data, $offset) } 1 .. $count];
+}
+
+sub _map {
+	my ($this, $data, $offset, $count) = @_;
+
+	my %result;
+	for (1 .. $count) {
+		my $key = $this->_unpack($data, $offset);
+		$result{$key} = $this->_unpack($data, $offset);
+	}
+	return \%result;
+}
+
+sub _string {
+	my ($data, $offset, $length) = @_;
+
+	my $string = _take($data, $offset, $length);
+	utf8::decode($string);
+	return $string;
+}
+
+sub _ext {
+	my ($this, $data, $offset, $length) = @_;
+
+	my $type = unpack('c', _take($data, $offset, 1));
+	return $this->{unpack_ext}->($type, _take($data, $offset, $length));
+}
+
+my %FIXEXT = (0xd4 => 1, 0xd5 => 2, 0xd6 => 4, 0xd7 => 8, 0xd8 => 16);
+
+sub _unpack {
+	my ($this, $data, $offset) = @_;
+
+	my $byte = ord(_take($data, $offset, 1));
+
+	return $byte if $byte < 0x80;
+	return $byte - 0x100 if $byte >= 0xe0;
+	return $this->_map($data, $offset, $byte & 0x0f) if $byte < 0x90;
+	return $this->_array($data, $offset, $byte & 0x0f) if $byte < 0xa0;
+	return _string($data, $offset, $byte & 0x1f) if $byte < 0xc0;
+
+	return undef if $byte == 0xc0;
+	return JSON::false() if $byte == 0xc2;
+	return JSON::true() if $byte == 0xc3;
+
+	# bin 8/16/32
+	return _take($data, $offset, ord(_take($data, $offset, 1))) if $byte == 0xc4;
+	return _take($data, $offset, unpack('n', _take($data, $offset, 2))) if $byte == 0xc5;
+	return _take($data, $offset, unpack('N', _take($data, $offset, 4))) if $byte == 0xc6;
+
+	# ext 8/16/32
+	return $this->_ext($data, $offset, ord(_take($data, $offset, 1))) if $byte == 0xc7;
+	return $this->_ext($data, $offset, unpack('n', _take($data, $offset, 2))) if $byte == 0xc8;
+	return $this->_ext($data, $offset, unpack('N', _take($data, $offset, 4))) if $byte == 0xc9;
+
+	return unpack('f>', _take($data, $offset, 4)) if $byte == 0xca;
+	return unpack('d>', _take($data, $offset, 8)) if $byte == 0xcb;
+
+	return ord(_take($data, $offset, 1)) if $byte == 0xcc;
+	return unpack('n', _take($data, $offset, 2)) if $byte == 0xcd;
+	return unpack('N', _take($data, $offset, 4)) if $byte == 0xce;
+	return unpack('Q>', _take($data, $offset, 8)) if $byte == 0xcf;
+	return unpack('c', _take($data, $offset, 1)) if $byte == 0xd0;
+	return unpack('s>', _take($data, $offset, 2)) if $byte == 0xd1;
+	return unpack('l>', _take($data, $offset, 4)) if $byte == 0xd2;
+	return unpack('q>', _take($data, $offset, 8)) if $byte == 0xd3;
+
+	return $this->_ext($data, $offset, $FIXEXT{$byte}) if exists $FIXEXT{$byte};
+
+	return _string($data, $offset, ord(_take($data, $offset, 1))) if $byte == 0xd9;
+	return _string($data, $offset, unpack('n', _take($data, $offset, 2))) if $byte == 0xda;
+	return _string($data, $offset, unpack('N', _take($data, $offset, 4))) if $byte == 0xdb;
+
+	return $this->_array($data, $offset, unpack('n', _take($data, $offset, 2))) if $byte == 0xdc;
+	return $this->_array($data, $offset, unpack('N', _take($data, $offset, 4))) if $byte == 0xdd;
+	return $this->_map($data, $offset, unpack('n', _take($data, $offset, 2))) if $byte == 0xde;
+	return $this->_map($data, $offset, unpack('N', _take($data, $offset, 4))) if $byte == 0xdf;
+
+	die(sprintf('Invalid MessagePack type 0x%02x.', $byte));
+}
+
+1;
@@ -11,10 +11,9 @@ sub new {
 		my $this = $class;
 		return $this->{module}->new(@args);
 	} else {
-		my ($perl, $module) = @args;
+		my ($module) = @args;
 		my $this = bless {}, $class;
 
-		$this->{perl} = $perl;
 		$this->{module} = $module;
 
 		return $this;
@@ -4,13 +4,20 @@ use strict;
 use warnings;
 
 sub new {
-	my ($class, $perl, $data) = @_;
+	my ($class, $perl, $data, $fields) = @_;
 
 	my $this = bless {}, $class;
 
 	$this->{perl} = $perl;
 	$this->{proxy_data} = $data;
 
+	# Public fields of an immutable object, served without a round trip
+	$this->{fields} = $fields;
+
+	# Number of references the remote side counts for the proxy, all
+	# released along with it
+	$this->{refs} = 1;
+
 	return $this;
 }
 
@@ -21,13 +28,17 @@ sub AUTOLOAD {
 
 	my ($this, @args) = @_;
 
+	if ($this->{fields} && exists $this->{fields}->{$method}) {
+		return $this->{fields}->{$method};
+	}
+
 	return $this->{perl}->call($this, $method, @args);
 }
 
 sub DESTROY {
 	my ($this) = @_;
 
-	$this->{perl}->delete($this);
+	$this->{perl}->release($this);
 }
 
 1;
@@ -9,15 +9,36 @@ use JSON;
 
 use Module::Load;
 
-use Scalar::Util qw(blessed refaddr weaken);
+use Scalar::Util qw(blessed refaddr reftype weaken);
 
+use Eurydice::Buffer;
+use Eurydice::Compression;
+use Eurydice::Iterator;
+use Eurydice::MessagePack;
 use Eurydice::Module;
 use Eurydice::Object;
 
 my $RECEIVE_AGAIN = bless \[], 'PerlServer::ReceiveAgain';
 
+# MessagePack extension type for remote object references
+my $REMOTE_PROXY = 1;
+# ...and for binary buffers sent out of band
+my $BUFFER = 2;
+
+# Tags standing for the instances in the compact references: the side
+# sending the reference and the side receiving it
+my $SENDER = 0;
+my $RECEIVER = 1;
+
+# The server running in this process, see current()
+our $CURRENT;
+
+# Modules imported for the clients, shared by all the sessions in the
+# process, so that every session gets the same objects, see preload()
+our %MODULES;
+
 sub new {
-	my ($class, $transport) = @_;
+	my ($class, $transport, %options) = @_;
 
 	my $this = bless {}, $class;
 
@@ -25,21 +46,88 @@ sub new {
 
 	$this->{transport} = $transport;
 
+	# Length-prefixed messages instead of lines
+	$this->{framed} = $options{framed};
+
 	# Serializer
 	$this->{json} = JSON->new;
 	$this->{json}->pretty(0);
+	# Frame lengths are in bytes
+	$this->{json}->utf8($this->{framed} ? 1 : 0);
 	$this->{json}->filter_json_single_key_object(_remote_proxy => sub {
 		my ($data) = @_;
 
-		if ($data->{instance} eq $this->{identity}) {
-			return $this->{objects}->{$data->{id}};
-		} else {
-			return Eurydice::Object->new($this, $data);
-		}
+		return $this->thaw($data);
 	});
+	$this->{json}->filter_json_single_key_object(_ref => sub {
+		my ($data) = @_;
 
-	# Object registry
+		# Kept as it is unless compact references are agreed upon
+		return unless defined $this->{peer} && ref $data eq 'ARRAY';
+		return $this->thaw_ref($data);
+	});
+	$this->{json}->filter_json_single_key_object(_buffer => sub {
+		my ($data) = @_;
+
+		# Kept as it is unless buffers are agreed upon
+		return unless $this->{buffers} && ref $data eq 'HASH';
+		return $this->thaw_buffer($data);
+	});
+
+	$this->{msgpack} = Eurydice::MessagePack->new(
+		pack_object => sub {
+			my ($object) = @_;
+
+			if (blessed $object && $object->isa('Eurydice::Buffer')) {
+				my $ref = $this->freeze_buffer($object);
+				my @ref = ($ref->{size});
+				push @ref, $ref->{dtype}, $ref->{shape}
+					if exists $ref->{dtype};
+				return ($BUFFER, $this->{msgpack}->encode(\@ref));
+			}
+
+			my $ref = $this->ref_array($this->freeze($object));
+			return ($REMOTE_PROXY, $this->{msgpack}->encode($ref));
+		},
+		unpack_ext => sub {
+			my ($type, $data) = @_;
+
+			if ($type == $BUFFER) {
+				my ($size) = @{$this->{msgpack}->decode($data)};
+				return $this->thaw_buffer({size => $size});
+			}
+			if ($type != $REMOTE_PROXY) {
+				die("Unknown MessagePack extension type $type.");
+			}
+			return $this->thaw_ref($this->{msgpack}->decode($data));
+		},
+	);
+
+	# Serialization used, can be switched by the handshake
+	$this->{serializer} = 'json';
+
+	# Identity of the remote side once compact references are agreed upon,
+	# see ref_array()
+	$this->{peer} = undef;
+
+	# Proxies created for the message being decoded, so that the repeated
+	# references share one
+	$this->{thawed} = {};
+
+	# Whether binary buffers are sent out of band, after the messages, and
+	# the ones to send after the message being encoded and to receive after
+	# the one decoded
+	$this->{buffers} = 0;
+	$this->{outgoing} = [];
+	$this->{incoming} = [];
+
+	# Object registry, with the number of references from the remote side
+	# to each object
 	$this->{objects} = {};
+	$this->{counts} = {};
+
+	# IDs of the remote objects no longer referenced, see release()
+	$this->{released} = [];
 
 	return $this;
 }
@@ -47,80 +135,391 @@ sub new {
 sub run {
 	my ($this) = @_;
 
+	local $CURRENT = $this;
+
 	eval {
 		while (1) {
 			$this->process();
 		}
-	}
+	};
+
+	# The session is over, nothing can reference the objects
+	$this->{objects} = {};
+	$this->{counts} = {};
+}
+
+#
+# The server processing the commands, for the code called from the remote
+# side to send commands back, e.g. invalidate()
+#
+sub current {
+	return $CURRENT;
+}
+
+sub context_key {
+	my ($context) = @_;
+
+	return defined $context ? "context:$context" : '';
 }
 
 sub process {
 	my ($this) = @_;
 
+	#
+	# Commands can be wrapped as ['context', $context, $command, ...] by
+	# clients issuing calls from several threads. The context is kept while
+	# the command is processed, so the replies and the nested calls are sent
+	# in it as well. An untagged reply in a context other than the one
+	# waiting is kept until the call waiting for it is on top of the stack
+	# again.
+	#
+	my $context = $this->{context};
+
 	my $result = $RECEIVE_AGAIN;
 	while (blessed $result && $result->isa('PerlServer::ReceiveAgain')) {
-		my $line = $this->{transport}->getline();
+		my ($message_context, $command, @args);
 
-		if (!defined $line) {
-			die('End of stream.');
+		my $stashed = delete $this->{stashed}->{context_key($context)};
+		if ($stashed) {
+			$message_context = $context;
+			($command, @args) = @{$stashed};
+		} else {
+			my $line = $this->read_message();
+
+			if (!defined $line) {
+				die('End of stream.');
+			}
+
+			$line = $this->decode($line);
+			if (@{$this->{incoming}}) {
+				$line = $this->read_buffers($line);
+			}
+			($command, @args) = @{$line};
+			#
+			# Prevent memory leaks in case @args contains an object
+			# which needs to be destroyed
+			#
+			$line = undef;
+
+			if ($command eq 'context') {
+				($message_context, $command, @args) = @args;
+			}
+
+			if (($command eq 'return' || $command eq 'error') &&
+				context_key($message_context) ne context_key($context)) {
+				$this->{stashed}->{context_key($message_context)} =
+					[$command, @args];
+				next;
+			}
 		}
 
-		$line = $this->{json}->decode($line);
-		my ($command, @args) = @{$line};
-		#
-		# Prevent memory leaks in case @args contains an object
-		# which needs to be destroyed
-		#
-		$line = undef;
+		local $this->{context} = $message_context;
+
+		# Replies to untagged commands are untagged
+		local $this->{reply_tag};
 
 		my $command_func = "command_$command";
 		if ($this->can($command_func)) {
 			$result = $this->$command_func(@args);
 		} else {
-			die("Unknown command $command.");
+			$this->send('error', "Unknown command $command.");
 		}
 	}
 	return $result;
 }
 
+sub read_message {
+	my ($this) = @_;
+
+	my $transport = $this->{transport};
+
+	if (!$this->{framed}) {
+		return $transport->getline();
+	}
+
+	my $header;
+	if ((read($transport, $header, 4) || 0) < 4) {
+		return;
+	}
+
+	my $length = unpack('N', $header);
+	my $message = '';
+	if ((read($transport, $message, $length) || 0) < $length) {
+		return;
+	}
+
+	if ($this->{codec}) {
+		$message = $this->{codec}->decompress($message);
+	}
+
+	return $message;
+}
+
+#
+# Read the buffers following a message, returning the message with the
+# buffers replaced by their data
+#
+sub read_buffers {
+	my ($this, $message) = @_;
+
+	foreach my $buffer (splice @{$this->{incoming}}) {
+		my $size = $buffer->{size};
+		$buffer->{data} = '';
+		if ((read($this->{transport}, $buffer->{data}, $size) || 0) < $size) {
+			die('End of stream.');
+		}
+	}
+
+	return unwrap_buffers($message);
+}
+
+sub write_message {
+	my ($this, $message, @buffers) = @_;
+
+	if ($this->{framed}) {
+		if ($this->{codec}) {
+			$message = $this->{codec}->compress($message);
+		}
+		$this->{transport}->print(pack('N', length($message)) . $message,
+			@buffers);
+	} else {
+		$this->{transport}->print("$message\n");
+	}
+}
+
+sub thaw {
+	my ($this, $data) = @_;
+
+	if ($data->{instance} eq $this->{identity}) {
+		return $this->{objects}->{$data->{id}};
+	}
+
+	# A copy, not to turn the ID into a string when sent back
+	my $id = $data->{id};
+	my $key = "$data->{instance}\0$id";
+	my $object = $this->{thawed}->{$key};
+	if ($object) {
+		$object->{refs}++;
+		return $object;
+	}
+	return $this->{thawed}->{$key} = Eurydice::Object->new($this, {
+		instance => $data->{instance},
+		id => $data->{id},
+	}, $data->{fields});
+}
+
+#
+# The reference to an object as an array: the instance, the ID, the public
+# fields of an immutable object (or undef) and the names of the pure methods,
+# if any. Once compact references are agreed upon, the instances of both
+# sides are sent as the $SENDER and $RECEIVER tags.
+#
+sub ref_array {
+	my ($this, $data) = @_;
+
+	my $instance = $data->{instance};
+	if (defined $this->{peer}) {
+		if ($instance eq $this->{identity}) {
+			$instance = $SENDER;
+		} elsif ($instance eq $this->{peer}) {
+			$instance = $RECEIVER;
+		}
+	}
+	my @ref = ($instance, $data->{id});
+	push @ref, $data->{fields}
+		if exists $data->{fields} || exists $data->{pure};
+	push @ref, $data->{pure} if exists $data->{pure};
+	return \@ref;
+}
+
+#
+# Convert a reference array back into an object
+#
+sub thaw_ref {
+	my ($this, $ref) = @_;
+
+	my ($instance, $id, $fields) = @{$ref};
+	if (defined $this->{peer} && $instance =~ /^\d+$/) {
+		$instance = $instance == $SENDER ? $this->{peer} : $this->{identity};
+	}
+	return $this->thaw({
+		instance => $instance,
+		id => $id,
+		defined $fields ? (fields => $fields) : (),
+	});
+}
+
+#
+# Queue a buffer to be sent after the message, returning its description
+#
+sub freeze_buffer {
+	my ($this, $buffer) = @_;
+
+	push @{$this->{outgoing}}, $buffer->data;
+	return $buffer->description;
+}
+
+#
+# Create a buffer to be filled with the data received after the message
+#
+sub thaw_buffer {
+	my ($this, $ref) = @_;
+
+	my $buffer = Eurydice::Buffer->new(undef);
+	$buffer->{size} = $ref->{size};
+	push @{$this->{incoming}}, $buffer;
+	return $buffer;
+}
+
+#
+# Replace the buffers in a data structure with their data
+#
+sub unwrap_buffers {
+	my ($data) = @_;
+
+	if (blessed $data) {
+		return $data->isa('Eurydice::Buffer') ? $data->data : $data;
+	}
+	if (ref $data eq 'ARRAY') {
+		return [map { unwrap_buffers($_) } @{$data}];
+	}
+	if (ref $data eq 'HASH') {
+		return {map { $_ => unwrap_buffers($data->{$_}) } keys %{$data}};
+	}
+	return $data;
+}
+
+sub freeze {
+	my ($this, $object) = @_;
+
+	if (blessed $object && $object->isa('Eurydice::Object')) {
+		return $object->{proxy_data};
+	}
+
+	my $index = refaddr($object);
+	if (!exists $this->{objects}->{$index}) {
+		$this->{objects}->{$index} = $object;
+	}
+	$this->{counts}->{$index}++;
+
+	my $data = {
+		instance => $this->{identity},
+		id => $index,
+	};
+
+	#
+	# The public fields of immutable objects are sent along with the
+	# reference, so that they can be read without a round trip
+	#
+	if (blessed $object && reftype($object) eq 'HASH' &&
+		$object->can('EURYDICE_IMMUTABLE') && $object->EURYDICE_IMMUTABLE) {
+		$data->{fields} = {
+			map { $_ => $object->{$_} } grep { !/^_/ } keys %{$object}
+		};
+	}
+
+	#
+	# The names of the methods whose results can be cached by the remote
+	# side, declared by an EURYDICE_PURE constant in the package
+	#
+	if (blessed $object) {
+		my $package = $object->isa('Eurydice::Module') ?
+			$object->{module} : $object;
+		if ($package->can('EURYDICE_PURE')) {
+			$data->{pure} = [$package->EURYDICE_PURE];
+		}
+	}
+
+	return $data;
+}
+
 sub encode {
 	my ($this, $args) = @_;
 
+	if ($this->{serializer} eq 'msgpack') {
+		# Without out of band buffers, their data is sent as strings
+		$args = unwrap_buffers($args) unless $this->{buffers};
+		return $this->{msgpack}->encode($args);
+	}
+
+	return $this->{json}->encode($this->freeze_all($args));
+}
+
+#
+# Replace all the objects in a data structure with their references
+#
+sub freeze_all {
+	my ($this, $data) = @_;
+
 	my $visitor = Data::Visitor::Callback->new(
 		object => sub {
 			my (undef, $object) = @_;
 
-			if ($object->isa('Eurydice::Object')) {
-				return { _remote_proxy => $object->{proxy_data} };
-			} else {
-				my $index = refaddr($object);
-				if (!exists $this->{objects}->{$index}) {
-					$this->{objects}->{$index} = $object;
-				}
-
-				return { _remote_proxy => {
-					instance => $this->{identity},
-					id => $index,
-				} };
+			if ($object->isa('Eurydice::Buffer')) {
+				return $this->{buffers} ?
+					{ _buffer => $this->freeze_buffer($object) } :
+					$object->data;
+			}
+
+			my $frozen = $this->freeze($object);
+			if (exists $frozen->{fields}) {
+				$frozen = {
+					%{$frozen},
+					fields => $this->freeze_all($frozen->{fields}),
+				};
+			}
+			if (defined $this->{peer}) {
+				return { _ref => $this->ref_array($frozen) };
 			}
+			return { _remote_proxy => $frozen };
 		},
 	);
-	$args = $visitor->visit($args);
+	return $visitor->visit($data);
+}
+
+sub decode {
+	my ($this, $message) = @_;
+
+	local $this->{thawed} = {};
 
-	return $this->{json}->encode($args);
+	if ($this->{serializer} eq 'msgpack') {
+		return $this->{msgpack}->decode($message);
+	}
+
+	return $this->{json}->decode($message);
 }
 
 sub send {
 	my ($this, $command, @args) = @_;
 
+	$this->flush_released();
+
+	if (defined $this->{context}) {
+		($command, @args) = ('context', $this->{context}, $command, @args);
+	}
+
 	my $line = $this->encode([$command, @args]);
+	my @buffers = splice @{$this->{outgoing}};
 
-	$this->{transport}->print("$line\n");
+	$this->write_message($line, @buffers);
+}
+
+sub reply {
+	my ($this, $tag, $command, $value) = @_;
+
+	if (defined $tag) {
+		$this->send('tagged', $tag, $command, $value);
+	} else {
+		$this->send($command, $value);
+	}
 }
 
 sub wrap_action {
 	my ($this, $action) = @_;
 
+	# The action may process other commands, remember the tag
+	my $tag = $this->{reply_tag};
+
 	my $retval;
 	my $success = eval {
 		$retval = $action->();
@@ -128,10 +527,13 @@ sub wrap_action {
 	};
 
 	if ($success) {
-		$this->send('return', $retval);
+		$this->reply($tag, 'return', $retval);
 	} else {
-		$this->send('error', $@);
+		$this->reply($tag, 'error', $@);
 	}
+
+	# Continue waiting for the result if this was a nested command
+	return $RECEIVE_AGAIN;
 }
 
 sub command_call {
@@ -143,12 +545,65 @@ sub command_call {
 sub command_import {
 	my ($this, $module, @args) = @_;
 
-	$this->wrap_action(sub {
+	$this->wrap_action(sub { return import_module($module); });
+}
+
+# Import a module for the clients, once per process
+sub import_module {
+	my ($module) = @_;
+
+	return $MODULES{$module} ||= do {
 		load $module;
-		return Eurydice::Module->new($this, $module);
+		Eurydice::Module->new($module);
+	};
+}
+
+# Import the modules before serving any session. Servers forking worker
+# processes preload them beforehand, so that the workers share them.
+sub preload {
+	my ($class, @modules) = @_;
+
+	import_module($_) foreach @modules;
+}
+
+sub command_getattr {
+	my ($this, $object, $name) = @_;
+
+	return $this->wrap_action(sub { return $object->{$name}; });
+}
+
+sub command_setattr {
+	my ($this, $object, $name, $value) = @_;
+
+	return $this->wrap_action(sub {
+		$object->{$name} = $value;
+		return;
+	});
+}
+
+sub command_iter {
+	my ($this, $object, $size) = @_;
+
+	return $this->wrap_action(sub {
+		my $iterator = Eurydice::Iterator->new($object);
+		return [$iterator, $iterator->next_chunk($size)];
 	});
 }
 
+sub command_next_chunk {
+	my ($this, $iterator, $size) = @_;
+
+	return $this->wrap_action(sub {
+		return [$iterator->next_chunk($size)];
+	});
+}
+
+sub command_ping {
+	my ($this) = @_;
+
+	return $this->wrap_action(sub { return; });
+}
+
 sub command_delete {
 	my ($this, $object) = @_;
 
@@ -161,11 +616,116 @@ sub command_delete {
 	weaken($_[1]);
 	return $this->wrap_action(sub {
 		my $id = refaddr($object);
-		delete $this->{objects}->{$id};
+		$this->release_object($id) or die("Object not found.\n");
 		return;
 	});
 }
 
+sub command_delete_many {
+	my ($this, $ids) = @_;
+
+	$this->release_object($_) foreach @{$ids};
+
+	# Not replied to
+	return $RECEIVE_AGAIN;
+}
+
+#
+# Release a reference to the object with the ID, returning whether it was
+# exported
+#
+sub release_object {
+	my ($this, $id) = @_;
+
+	return 0 unless exists $this->{objects}->{$id};
+
+	if (--$this->{counts}->{$id} <= 0) {
+		delete $this->{objects}->{$id};
+		delete $this->{counts}->{$id};
+	}
+	return 1;
+}
+
+sub command_invalidate {
+	# Results are not cached on this side
+	return $RECEIVE_AGAIN;
+}
+
+#
+# Make the remote side forget the cached results of a method of an object;
+# either can be undef for all the methods or all the objects
+#
+sub invalidate {
+	my ($this, $object, $method) = @_;
+
+	$this->send('invalidate', $object, $method);
+}
+
+sub command_tagged {
+	my ($this, $tag, $command, @args) = @_;
+
+	local $this->{reply_tag} = $tag;
+
+	my $command_func = "command_$command";
+	if ($command ne 'return' && $command ne 'error' && $command ne 'hello' &&
+		$this->can($command_func)) {
+		return $this->$command_func(@args);
+	}
+
+	$this->reply($tag, 'error', "Invalid tagged command $command.");
+	return $RECEIVE_AGAIN;
+}
+
+sub command_hello {
+	my ($this, $options) = @_;
+
+	my %accepted;
+
+	# MessagePack needs a transport able to carry binary data
+	if ($this->{framed}) {
+		foreach my $serializer (@{$options->{serializers} || []}) {
+			if ($serializer eq 'msgpack' || $serializer eq 'json') {
+				$accepted{serializer} = $serializer;
+				last;
+			}
+		}
+	}
+
+	# Buffers are sent after the messages, which must be delimited
+	if ($this->{framed} && $options->{buffers}) {
+		$accepted{buffers} = 1;
+	}
+
+	# References to the objects of both sides are sent as short tags
+	if (defined $options->{compact_refs}) {
+		$accepted{compact_refs} =
+			[$options->{compact_refs}, $this->{identity}];
+	}
+
+	# Compressed messages are binary as well
+	my $codec;
+	if ($this->{framed}) {
+		foreach my $name (@{$options->{compression} || []}) {
+			$codec = Eurydice::Compression->new($name);
+			if ($codec) {
+				$accepted{compression} = $name;
+				last;
+			}
+		}
+	}
+
+	$this->send('return', \%accepted);
+
+	if ($accepted{serializer}) {
+		$this->{serializer} = $accepted{serializer};
+	}
+	$this->{buffers} = $accepted{buffers} || 0;
+	$this->{codec} = $codec;
+	$this->{peer} = $options->{compact_refs};
+
+	return $RECEIVE_AGAIN;
+}
+
 sub command_return {
 	my ($this, $value) = @_;
 
@@ -192,4 +752,25 @@ sub delete {
 	return $this->process();
 }
 
+#
+# Queue the reference to a remote object to be deleted. The references are
+# sent together as a single 'delete_many' command before the next command.
+#
+sub release {
+	my ($this, $object) = @_;
+
+	push @{$this->{released}},
+		($object->{proxy_data}->{id}) x $object->{refs};
+}
+
+sub flush_released {
+	my ($this) = @_;
+
+	return unless @{$this->{released}};
+
+	my @ids = @{$this->{released}};
+	$this->{released} = [];
+	$this->write_message($this->encode(['delete_many', \@ids]));
+}
+
 1;
@@ -0,0 +1,13 @@
+package Tests::Bounce;
+
+use strict;
+use warnings;
+
+sub bounce {
+	my ($class, $other, $depth) = @_;
+
+	return 0 if $depth <= 0;
+	return $other->bounce($depth - 1) + 1;
+}
+
+1;
@@ -0,0 +1,14 @@
+package Tests::Bytes;
+
+use strict;
+use warnings;
+
+use Eurydice::Buffer;
+
+sub reversed {
+	my ($class, $data) = @_;
+
+	return Eurydice::Buffer->new(scalar reverse $data);
+}
+
+1;
@@ -0,0 +1,23 @@
+package Tests::Counter;
+
+use strict;
+use warnings;
+
+sub new {
+	my ($class, $count) = @_;
+
+	my $this = bless {}, $class;
+
+	$this->{count} = $count;
+	$this->{current} = 0;
+
+	return $this;
+}
+
+sub next {
+	my ($this) = @_;
+
+	return $this->{current} < $this->{count} ? $this->{current}++ : undef;
+}
+
+1;
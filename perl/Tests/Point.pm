@@ -0,0 +1,25 @@
+package Tests::Point;
+
+use strict;
+use warnings;
+
+use constant EURYDICE_IMMUTABLE => 1;
+
+sub new {
+	my ($class, $x, $y) = @_;
+
+	my $this = bless {}, $class;
+
+	$this->{x} = $x;
+	$this->{y} = $y;
+
+	return $this;
+}
+
+sub norm2 {
+	my ($this) = @_;
+
+	return $this->{x} ** 2 + $this->{y} ** 2;
+}
+
+1;
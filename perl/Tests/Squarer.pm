@@ -0,0 +1,40 @@
+package Tests::Squarer;
+
+use strict;
+use warnings;
+
+use Eurydice::Server;
+
+use constant EURYDICE_PURE => qw(square);
+
+sub new {
+	my ($class) = @_;
+
+	my $this = bless {}, $class;
+
+	$this->{count} = 0;
+
+	return $this;
+}
+
+sub square {
+	my ($this, $value) = @_;
+
+	$this->{count}++;
+	return $value * $value;
+}
+
+sub calls {
+	my ($this) = @_;
+
+	return $this->{count};
+}
+
+sub forget {
+	my ($this) = @_;
+
+	Eurydice::Server->current->invalidate($this, 'square');
+	return;
+}
+
+1;
@@ -3,11 +3,26 @@
 use strict;
 use warnings;
 
+use Getopt::Long;
 use IO::Socket;
+use IO::Socket::UNIX;
+use POSIX ();
+use Socket qw(IPPROTO_TCP TCP_NODELAY);
 
 use Eurydice::Server;
 
-my $port = $ARGV[0];
+# Modules to import before serving any client, and the number of worker
+# processes to fork afterwards, sharing them (none to serve the clients one
+# at a time in this process)
+my @preload;
+my $workers = 0;
+GetOptions(
+	'preload=s' => \@preload,
+	'workers=i' => \$workers,
+) or die("Usage: $0 [--preload=Module,...] [--workers=N] address\n");
+
+# A port number or a URL: 'tcp://host:port' or 'unix:///path/to/socket'
+my $address = $ARGV[0];
 
 my $server;
 
@@ -20,21 +35,81 @@ my $shutdown = sub {
 END { $shutdown->(); }
 $SIG{'TERM'} = $shutdown;
 
-$server = IO::Socket::INET->new(
-	Proto => 'tcp',
-	LocalPort => $port,
-	Listen => SOMAXCONN,
-);
+if ($address =~ m{^unix://(.+)$}) {
+	my $path = $1;
+	# A socket file left by a previous server prevents binding
+	unlink $path;
+	$server = IO::Socket::UNIX->new(
+		Type => SOCK_STREAM,
+		Local => $path,
+		Listen => SOMAXCONN,
+	);
+} else {
+	my ($host, $port) = $address =~ m{^tcp://(.*):(\d+)$};
+	$server = IO::Socket::INET->new(
+		Proto => 'tcp',
+		defined $host ? (LocalAddr => $host) : (),
+		LocalPort => defined $port ? $port : $address,
+		Listen => SOMAXCONN,
+		ReuseAddr => 1,
+	);
+}
 
 if (!$server) {
 	die("Cannot set up server: $@");
 }
 
-while (my $client = $server->accept()) {
-	my $responder = Eurydice::Server->new($client);
-	my $success = eval { $responder->run() };
-	if (!$success) {
-		print STDERR $@;
+Eurydice::Server->preload(map { split /,/ } @preload);
+
+sub serve {
+	while (my $client = $server->accept()) {
+		# Messages are written at once, waiting to coalesce them only
+		# delays the replies
+		if ($client->sockdomain() == AF_INET) {
+			$client->setsockopt(IPPROTO_TCP, TCP_NODELAY, 1);
+		}
+		my $responder = Eurydice::Server->new($client, framed => 1);
+		my $success = eval { $responder->run() };
+		if (!$success) {
+			print STDERR $@;
+		}
+		$client->shutdown(2);
+	}
+}
+
+if (!$workers) {
+	serve();
+	exit;
+}
+
+# Workers accept the clients from the shared socket, and are replaced when
+# they exit
+my %children;
+my $stopping = 0;
+$SIG{'TERM'} = sub {
+	$stopping = 1;
+	kill 'TERM', keys %children;
+};
+
+while (!$stopping) {
+	while (keys %children < $workers) {
+		my $pid = fork();
+		die("Cannot fork: $!") unless defined $pid;
+		if (!$pid) {
+			$SIG{'TERM'} = 'DEFAULT';
+			serve();
+			# The socket is the parent's to shut down
+			POSIX::_exit(0);
+		}
+		$children{$pid} = 1;
 	}
-	$client->shutdown(2);
+	my $pid = wait();
+	last if $pid < 0;
+	delete $children{$pid};
+}
+
+while (keys %children) {
+	my $pid = wait();
+	last if $pid < 0;
+	delete $children{$pid};
 }
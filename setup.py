@@ -44,7 +44,7 @@ class RunTests(TestCommand):  # pylint:disable=too-many-public-methods
         import pytest
         errno.append(pytest.main(modules))
 
-        modules += ['setup.py']
+        modules += ['benchmarks', 'setup.py']
 
         import pylint.lint
         pylint_result = pylint.lint.Run(modules, exit=False)
@@ -65,6 +65,10 @@ setup(
     version="0.1",
     packages=['eurydice'],
     install_requires=INSTALL_REQUIRES,
+    extras_require={
+        'msgpack': ['msgpack >= 0.6.0'],
+        'asyncio-websocket': ['websockets >= 10.0'],
+    },
     tests_require=['pep8', 'pylint', 'pytest'],
     dependency_links=DEPENDENCY_LINKS,
     cmdclass={'test': RunTests},
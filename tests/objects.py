@@ -2,6 +2,9 @@
 Simple objects for the tests
 """
 
+import eurydice.endpoint
+from eurydice import immutable, pure
+
 
 class Concat(object):
     """
@@ -39,6 +42,47 @@ class Concat(object):
         raise Exception(how)
 
 
+def numbers(count):
+    """
+    Generate the numbers from 0 to count - 1
+    """
+    for number in range(count):
+        yield number
+
+
+def reverse_bytes(data):
+    """
+    Return the bytes in the reverse order
+    """
+    return bytes(data)[::-1]
+
+
+def bounce(other, depth):
+    """
+    Call back the object with one level less, returning the depth reached
+    """
+    if depth <= 0:
+        return 0
+    return other.bounce(depth - 1) + 1
+
+
+class Bouncer(object):
+    """
+    An object calling back a remote bounce() function
+    """
+    def __init__(self, rbounce):
+        self.rbounce = rbounce
+
+    def bounce(self, depth):
+        """
+        Call the remote function with one level less, returning the depth
+        reached
+        """
+        if depth <= 0:
+            return 0
+        return self.rbounce(self, depth - 1) + 1
+
+
 class Source(object):
     """
     An object providing a string to concatenate
@@ -65,3 +109,77 @@ class BadSource(object):
         Raise an error instead of returning a string
         """
         raise Exception(self.string)
+
+
+class AsyncConcat(object):
+    """
+    A test class concatenating strings, asking the source asynchronously
+    """
+
+    def __init__(self, own):
+        self.own = own
+        self.source = None
+
+    def set_source(self, source):
+        """
+        Add an object to ask for a string to concatenate from
+        """
+        self.source = source
+
+    async def concat(self, other):
+        """
+        Concatenate all the strings
+        """
+        if self.source:
+            try:
+                source_str = await self.source.get_string()
+            except Exception as exc:  # pylint:disable=broad-except
+                source_str = '[' + str(exc) + ']'
+        else:
+            source_str = ''
+
+        return self.own + source_str + other
+
+
+@immutable
+class Point(object):
+    """
+    An immutable point
+    """
+    def __init__(self, x, y):  # pylint:disable=invalid-name
+        self.x = x  # pylint:disable=invalid-name
+        self.y = y  # pylint:disable=invalid-name
+
+    def norm2(self):
+        """
+        Return the square of the distance from the origin
+        """
+        return self.x ** 2 + self.y ** 2
+
+
+class Squarer(object):
+    """
+    Squares numbers, counting the calls
+    """
+    def __init__(self):
+        self.count = 0
+
+    @pure
+    def square(self, value):
+        """
+        Return the square of the value
+        """
+        self.count += 1
+        return value * value
+
+    def calls(self):
+        """
+        Return the number of the values squared
+        """
+        return self.count
+
+    def forget(self):
+        """
+        Make the remote side forget the cached squares
+        """
+        eurydice.endpoint.current().invalidate(self, 'square')
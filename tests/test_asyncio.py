@@ -0,0 +1,348 @@
+"""
+Tests for asyncio endpoints
+"""
+
+import asyncio
+import gc
+import weakref
+
+import pytest
+
+import eurydice
+import eurydice.asyncio
+import eurydice.cache
+import eurydice.stats
+from eurydice.common import TransportException
+
+from tests.objects import BadSource, Source
+from tests.test_socket import (
+    PerlServerClient,
+    PythonServerClient,
+    old_server,
+    random_address,
+    random_unix_address,
+)
+
+
+class AsyncSource(object):
+    """
+    An object providing a string to concatenate asynchronously
+    """
+    def __init__(self, string):
+        self.string = string
+
+    async def get_string(self):
+        """
+        Return a string
+        """
+        await asyncio.sleep(0)
+        return self.string
+
+
+def run(coroutine):
+    """
+    Run a coroutine on a new event loop
+    """
+    return asyncio.run(coroutine)
+
+
+async def async_pair(test):
+    """
+    Run the test with an asyncio client connected to an asyncio server in
+    the same event loop
+    """
+    address = random_address()
+    server = await eurydice.asyncio.serve(address)
+    try:
+        async with await eurydice.asyncio.connect(address) as client:
+            await test(client)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def async_concat(client):
+    """
+    Create a test remote object on an asyncio server
+    """
+    robjects = await client.use('tests.objects')
+    return await robjects.AsyncConcat('one')
+
+
+def test_call():
+    """
+    Test a call to an asyncio server
+    """
+    async def test(client):
+        robj = await async_concat(client)
+        assert await robj.concat('two') == 'onetwo'
+
+    run(async_pair(test))
+
+
+def test_concurrent_calls():
+    """
+    Test many calls outstanding at once, each calling back
+    """
+    async def test(client):
+        robj = await async_concat(client)
+        await robj.set_source(AsyncSource('three'))
+        results = await asyncio.gather(*(robj.concat(str(i))
+                                         for i in range(100)))
+        assert results == ['onethree%s' % i for i in range(100)]
+
+    run(async_pair(test))
+
+
+def test_remote_exception():
+    """
+    Test an exception raised on the remote side
+    """
+    async def test(client):
+        robj = await async_concat(client)
+        await robj.set_source(None)
+        with pytest.raises(eurydice.RemoteError) as exc:
+            await robj.breakdown('four')
+        assert "'AsyncConcat' object has no attribute 'breakdown'" in \
+            str(exc.value)
+
+    run(async_pair(test))
+
+
+def test_local_exception():
+    """
+    Test an exception raised locally
+    """
+    async def test(client):
+        robj = await async_concat(client)
+        await robj.set_source(BadSource('five'))
+        assert await robj.concat('six') == 'one[five]six'
+
+    run(async_pair(test))
+
+
+def test_callback():
+    """
+    Test the asyncio server calling back into a local object
+    """
+    async def test(client):
+        robj = await async_concat(client)
+        source = Source('seven')
+        await robj.set_source(source)
+        assert await robj.concat('eight') == 'oneseveneight'
+
+    run(async_pair(test))
+
+
+def test_release():
+    """
+    Test the references to the remote objects are released
+    """
+    async def test(client):
+        robj = await async_concat(client)
+        source = Source('eleven')
+        await robj.set_source(source)
+        source = weakref.ref(source)
+
+        del robj
+        gc.collect()
+        await client.ping()
+
+        assert source() is None
+
+    run(async_pair(test))
+
+
+def test_iterate():
+    """
+    Test iterating over a remote object while the next chunks are fetched
+    """
+    async def test(client):
+        robjects = await client.use('tests.objects')
+        numbers = await robjects.numbers(250)
+        result = [number async for number in
+                  client.iterate(numbers, chunk_size=100, prefetch=2)]
+        assert result == list(range(250))
+        assert [number async for number in await robjects.numbers(3)] == \
+            [0, 1, 2]
+
+    run(async_pair(test))
+
+
+def test_unix_socket():
+    """
+    Test an asyncio client and server talking over a Unix socket
+    """
+    async def main():
+        address = random_unix_address()
+        server = await eurydice.asyncio.serve(address)
+        try:
+            async with await eurydice.asyncio.connect(address) as client:
+                await test(client)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def test(client):
+        robj = await async_concat(client)
+        assert await robj.concat('two') == 'onetwo'
+
+    run(main())
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, PerlServerClient))
+def test_synchronous_server(server_client):
+    """
+    Test an asyncio client talking to a synchronous server
+    """
+    context = server_client()
+    with context as sync_client:
+        # Only the server process is needed
+        sync_client.transport.socket.close()
+        address = context.address
+
+        async def test():
+            async with await eurydice.asyncio.connect(address) as client:
+                if server_client is PerlServerClient:
+                    rclass = await client.use('Tests::Concat')
+                    robj = await rclass.new('one')
+                else:
+                    robjects = await client.use('tests.objects')
+                    robj = await robjects.Concat('one')
+                await robj.set_source(Source('nine'))
+                results = await asyncio.gather(*(robj.concat(str(i))
+                                                 for i in range(10)))
+                assert results == ['onenine%s' % i for i in range(10)]
+
+        run(test())
+
+
+def test_invalidate():
+    """
+    Test an invalidation from a synchronous server is not replied to,
+    keeping the session in step
+    """
+    context = PythonServerClient()
+    with context as sync_client:
+        sync_client.transport.socket.close()
+        address = context.address
+
+        async def test():
+            async with await eurydice.asyncio.connect(address) as client:
+                robjects = await client.use('tests.objects')
+                squarer = await robjects.Squarer()
+                await squarer.forget()
+                assert await squarer.square(3) == 9
+                assert await squarer.calls() == 1
+
+        run(test())
+
+
+def test_cache_stats():
+    """
+    Test the results of the pure methods are cached, and the statistics
+    collected, as by the synchronous endpoints
+    """
+    async def test(client):
+        client.stats = stats = eurydice.stats.Stats()
+        client.cache = eurydice.cache.ResultCache()
+        robjects = await client.use('tests.objects')
+        squarer = await robjects.Squarer()
+        assert await squarer.square(3) == 9
+        assert await squarer.square(3) == 9
+        assert await squarer.calls() == 1
+
+        snapshot = stats.snapshot()
+        assert snapshot['calls']['square']['count'] == 1
+        assert snapshot['calls']['calls']['count'] == 1
+        assert snapshot['messages_received'] >= 4
+
+    run(async_pair(test))
+
+
+def test_invalid_message():
+    """
+    Test the calls waiting fail when a message cannot be processed
+    """
+    async def handle(reader, writer):
+        """
+        Accept no options in the handshake, then answer the first command
+        with an incomplete tagged reply
+        """
+        header = eurydice.asyncio.AsyncSocketTransport.HEADER
+        while True:
+            (size,) = header.unpack(await reader.readexactly(header.size))
+            message = await reader.readexactly(size)
+            if message.startswith(b'["hello"'):
+                reply = b'["return", {}]'
+            else:
+                reply = b'["tagged", 0]'
+            writer.write(header.pack(len(reply)) + reply)
+            await writer.drain()
+            if reply != b'["return", {}]':
+                break
+        await reader.read()
+        writer.close()
+
+    async def test():
+        address = random_address()
+        server = await asyncio.start_server(handle, *address)
+        try:
+            async with await eurydice.asyncio.connect(address) as client:
+                with pytest.raises(TransportException):
+                    await asyncio.wait_for(client.ping(), 10)
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    run(test())
+
+
+@pytest.mark.parametrize('behaviours', (
+    ['error'],
+    ['drop', 'error'],
+    ['ignore', 'error'],
+))
+def test_old_server(behaviours, monkeypatch):
+    """
+    Test falling back to JSON with a server not knowing about the
+    handshake
+    """
+    monkeypatch.setattr(eurydice.asyncio, 'HANDSHAKE_TIMEOUT', 0.5)
+    address = old_server(behaviours)
+
+    async def test():
+        client = await eurydice.asyncio.connect(address, compression=['zlib'])
+        async with client:
+            assert client.transport.serializer.name == 'json'
+            robjects = await client.use('tests.objects')
+            robj = await robjects.Concat('one')
+            assert await robj.concat('two') == 'onetwo'
+
+    run(test())
+
+
+def test_websocket():
+    """
+    Test an asyncio WebSocket client and server
+    """
+    pytest.importorskip('websockets')
+
+    async def test():
+        address = random_address()
+        server = await eurydice.asyncio.serve_websocket(address)
+        try:
+            url = 'ws://%s:%s' % address
+            client = await eurydice.asyncio.connect_websocket(url)
+            async with client:
+                robj = await async_concat(client)
+                await robj.set_source(AsyncSource('ten'))
+                results = await asyncio.gather(*(robj.concat(str(i))
+                                                 for i in range(10)))
+                assert results == ['oneten%s' % i for i in range(10)]
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    run(test())
@@ -0,0 +1,190 @@
+"""
+Tests for in-process endpoints
+"""
+
+import threading
+import time
+
+import pytest
+
+import eurydice
+import eurydice.local
+from eurydice.common import TransportException
+from eurydice.endpoint import RECEIVE_AGAIN, callback, unpack_args
+
+from tests import MultiplexedInteractionTest, PythonInteractionTest
+
+
+class LocalServerClient(object):
+    """
+    In-process client as a context object
+    """
+    client_class = eurydice.local.Client
+
+    def __init__(self):
+        self.endpoint = None
+
+    def client(self):
+        """
+        Create an in-process client, with a server of its own
+        """
+        return self.client_class()
+
+    def __enter__(self):
+        self.endpoint = self.client()
+        return self.endpoint
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.endpoint.close()
+        return False
+
+
+class MultiplexedLocalServerClient(LocalServerClient):
+    """
+    In-process multiplexed client as a context object
+    """
+    client_class = eurydice.local.MultiplexedClient
+
+
+class TestLocal(PythonInteractionTest):
+    """
+    Test interaction with an in-process server
+    """
+    def client(self):
+        return LocalServerClient()
+
+
+class TestLocalMultiplexed(MultiplexedInteractionTest,
+                           PythonInteractionTest):
+    """
+    Test interaction with an in-process server from several threads
+    """
+    def client(self):
+        return MultiplexedLocalServerClient()
+
+
+def test_values_copied():
+    """
+    Test the values passed are copied rather than shared
+    """
+    with LocalServerClient() as client:
+        rcopy = client.use('copy')
+        value = {'list': [1, 2]}
+        result = rcopy.copy(value)
+        assert result == value
+        assert result is not value
+        assert result['list'] is not value['list']
+
+
+class DoublingEndpoint(eurydice.local.LocalEndpoint):
+    """
+    An endpoint with a command of its own
+    """
+    @callback
+    @unpack_args
+    def command_double(self, value):  # pylint:disable=no-self-use
+        """
+        Process a 'double the value' command
+        """
+        return value * 2
+
+
+def test_subclass_command():
+    """
+    Test the commands added by subclasses are dispatched
+    """
+    client = eurydice.local.LocalEndpoint()
+    server = DoublingEndpoint()
+    client.transport.connect(server.transport)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        # pylint:disable=protected-access
+        assert client._send_receive('double', 21) == 42
+        assert client._send_tagged('double', 4).result() == 8
+        with pytest.raises(eurydice.RemoteError):
+            client._send_receive('triple', 21)
+    finally:
+        client.close()
+
+
+def test_reserved_keys():
+    """
+    Test the data using the keys of the references is passed as it is
+    """
+    values = [
+        {'_remote_proxy': 1, 'x': 2},
+        {'_remote_proxy': 'abc'},
+        {'_remote_proxy': {'id': 1, 'instance': 'x'}, 'x': 1},
+    ]
+    with LocalServerClient() as client:
+        assert client.use('copy').deepcopy(values) == values
+
+
+class RecordingClient(eurydice.local.MultiplexedClient):
+    """
+    A multiplexed client recording the threads processing a command
+    """
+    def __init__(self):
+        self.threads = []
+        self.recorded = threading.Semaphore(0)
+        super(RecordingClient, self).__init__()
+
+    @unpack_args
+    def command_record(self):
+        """
+        Record the thread processing the command, without replying
+        """
+        self.threads.append(threading.current_thread().name)
+        self.recorded.release()
+        return RECEIVE_AGAIN
+
+
+def test_uncontexted_pool():
+    """
+    Test the messages outside of any context are processed by a bounded
+    number of threads
+    """
+    client = RecordingClient()
+    try:
+        for _ in range(100):
+            client.server.transport.send_message(['record'])
+        for _ in range(100):
+            assert client.recorded.acquire(timeout=10)
+        assert len(client.threads) == 100
+        assert len(set(client.threads)) <= client.answer_threads
+    finally:
+        client.close()
+
+
+def test_invalid_reference_multiplexed():
+    """
+    Test the threads waiting for replies are woken up when the reader
+    fails to decode a message
+    """
+    client = eurydice.local.MultiplexedClient()
+    errors = []
+
+    def wait():
+        """
+        Wait for a reply which does not arrive
+        """
+        try:
+            client.use('time').sleep(0.5)
+        except TransportException as exc:
+            errors.append(exc)
+
+    try:
+        waiting = threading.Thread(target=wait)
+        waiting.start()
+        time.sleep(0.1)
+        client.transport.queue.put(['return', {'_remote_proxy': {
+            'instance': client.transport.identity, 'id': 0}}])
+        waiting.join(10)
+        assert not waiting.is_alive()
+        assert len(errors) == 1
+        with pytest.raises(TransportException):
+            client.ping()
+    finally:
+        client.close()
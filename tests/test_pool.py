@@ -0,0 +1,187 @@
+"""
+Tests for the client pool
+"""
+
+import threading
+
+try:
+    import socketserver  # pylint:disable=import-error
+except ImportError:
+    import SocketServer as socketserver
+
+import pytest
+
+import eurydice.socket
+from eurydice.common import TransportException
+from eurydice.pool import ClientPool, PoolTimeout
+
+from tests.test_socket import random_address
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, eurydice.socket.Server):
+    """
+    A server accepting several clients at once
+    """
+    daemon_threads = True
+
+
+@pytest.fixture(name='address')
+def fixture_address():
+    """
+    Run a server in a background thread, returning its address
+    """
+    address = random_address()
+    server = ThreadingServer(address)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield address
+    server.shutdown()
+    server.server_close()
+
+
+def make_pool(address, **kwargs):
+    """
+    A pool of clients connecting to the address
+    """
+    return ClientPool(lambda: eurydice.socket.Client(address), **kwargs)
+
+
+def test_reuse(address):
+    """
+    Test the released clients are handed out again
+    """
+    pool = make_pool(address)
+    with pool.checkout() as client:
+        robjects = client.use('tests.objects')
+        assert robjects.Concat('one').concat('two') == 'onetwo'
+    with pool.checkout() as client2:
+        assert client2 is client
+        assert client2.use('tests.objects') is robjects
+    assert pool.size == 1
+    pool.close()
+
+
+def test_imports(address):
+    """
+    Test the modules are imported into the new clients in advance
+    """
+    pool = make_pool(address, min_size=2, imports=['tests.objects'])
+    assert pool.size == 2
+    with pool.checkout() as client:
+        assert 'tests.objects' in client.modules
+    pool.close()
+
+
+def test_max_size(address):
+    """
+    Test the number of clients is limited
+    """
+    pool = make_pool(address, max_size=2)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    with pytest.raises(PoolTimeout):
+        pool.acquire(timeout=0.1)
+
+    result = []
+
+    def wait():
+        """
+        Wait for a client to be released
+        """
+        result.append(pool.acquire(timeout=5))
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    pool.release(second)
+    waiter.join()
+    assert result == [second]
+    pool.close()
+
+
+def test_close_waiting(address):
+    """
+    Test the threads waiting for a client fail when the pool is closed
+    """
+    pool = make_pool(address, max_size=1)
+    client = pool.acquire()
+
+    result = []
+
+    def wait():
+        """
+        Wait for a client until the pool is closed
+        """
+        try:
+            result.append(pool.acquire())
+        except TransportException as exc:
+            result.append(exc)
+
+    waiter = threading.Thread(target=wait)
+    waiter.daemon = True
+    waiter.start()
+    waiter.join(0.1)
+    pool.close()
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert isinstance(result[0], TransportException)
+
+    pool.release(client)
+    assert pool.size == 0
+
+
+def test_idle_timeout(address):
+    """
+    Test the clients idle for too long are closed
+    """
+    pool = make_pool(address, idle_timeout=0)
+    client = pool.acquire()
+    pool.release(client)
+    assert pool.size == 0
+    assert pool.acquire() is not client
+    pool.close()
+
+
+def test_broken_client(address):
+    """
+    Test the clients failing the health check are replaced
+    """
+    pool = make_pool(address, check_after=0)
+    client = pool.acquire()
+    pool.release(client)
+    client.transport.socket.close()
+    client2 = pool.acquire()
+    assert client2 is not client
+    assert client2.ping() is None
+    assert pool.size == 1
+    pool.close()
+
+
+class InterruptingSource(object):
+    """
+    A source interrupting the call asking it for a string
+    """
+    def get_string(self):  # pylint:disable=no-self-use
+        """
+        Interrupt the caller
+        """
+        raise KeyboardInterrupt()
+
+
+def test_interrupted_call(address):
+    """
+    Test a client interrupted during a call is not handed out again
+    """
+    pool = make_pool(address, max_size=1)
+    with pytest.raises(KeyboardInterrupt):
+        with pool.checkout() as client:
+            robj = client.use('tests.objects').Concat('one')
+            robj.set_source(InterruptingSource())
+            robj.concat('two')
+    with pool.checkout() as client2:
+        assert client2 is not client
+        robj = client2.use('tests.objects').Concat('three')
+        assert robj.concat('four') == 'threefour'
+    assert pool.size == 1
+    pool.close()
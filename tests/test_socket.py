@@ -2,15 +2,31 @@
 Tests for socket endpoints
 """
 
+import gc
 import os
 import random
 import signal
 import socket
+import tempfile
+import threading
+import time
+
+import pytest
 
 import eurydice
 import eurydice.socket
+import eurydice.stats
+from eurydice.common import TransportException
+from eurydice.serializer import msgpack
 
-from tests import ServerClient, PythonInteractionTest, PerlInteractionTest
+from tests import (
+    JavaScriptInteractionTest,
+    MultiplexedInteractionTest,
+    PerlInteractionTest,
+    PythonInteractionTest,
+    ServerClient,
+)
+from tests.objects import Source
 
 
 def random_address():
@@ -21,11 +37,30 @@ def random_address():
     return ('127.0.0.1', port)
 
 
+def random_unix_address():
+    """
+    Generate a random Unix socket path for a test server
+    """
+    return 'unix://' + os.path.join(
+        tempfile.gettempdir(),
+        'eurydice-test-%d.sock' % random.randrange(1000000))
+
+
 class SocketServerClient(ServerClient):
     """
     Socket client with a temporary server as a context object
     """
 
+    # Serializers to offer, None for all available
+    serializers = None
+
+    # Statistics to collect, see eurydice.stats
+    stats = None
+
+    # Compression codecs to offer, and the size to compress messages from
+    compression = ()
+    compression_threshold = None
+
     def __init__(self):
         super(SocketServerClient, self).__init__()
         self.address = random_address()
@@ -38,11 +73,18 @@ class SocketServerClient(ServerClient):
             "run_server() not implemented in base SocketServerClient.")
 
     def client(self):
-        return eurydice.socket.Client(self.address)
+        client = eurydice.socket.Client(self.address,
+                                        serializers=self.serializers,
+                                        stats=self.stats,
+                                        compression=self.compression)
+        if self.compression_threshold is not None:
+            client.transport.compression_threshold = \
+                self.compression_threshold
+        return client
 
     def server_ready(self):
         try:
-            socket.create_connection(self.address)
+            eurydice.socket.connect(self.address).close()
             return True
         except socket.error:
             return False
@@ -52,8 +94,14 @@ class PythonServerClient(SocketServerClient):
     """
     Python server returning a client connected to it as a context object
     """
+
+    # Concurrency mode and options of the server
+    mode = 'single'
+    options = {}
+
     def run_server(self):
-        server = eurydice.socket.Server(self.address)
+        server = eurydice.socket.make_server(self.address, self.mode,
+                                             **self.options)
         server.serve_forever()
 
 
@@ -77,8 +125,11 @@ class ProcessServerClient(SocketServerClient):
         """
         Start the external process
         """
-        port = self.address[1]
-        os.execvp(self.arguments[0], self.arguments + [str(port)])
+        if isinstance(self.address, tuple):
+            address = str(self.address[1])
+        else:
+            address = self.address
+        os.execvp(self.arguments[0], self.arguments + [address])
 
     def __exit__(self, exc_type, exc_value, traceback):
         """
@@ -97,6 +148,20 @@ class PerlServerClient(ProcessServerClient):
     termination_signal = signal.SIGKILL
 
 
+class JavaScriptServerClient(ProcessServerClient):
+    """
+    JavaScript server using the length-prefixed framing, returning a client
+    connected to it as a context object
+    """
+
+    arguments = ['node',
+                 '-harmony-proxies',
+                 '-harmony-collections',
+                 '-expose-gc',
+                 'javascript/server.js',
+                 '--framed']
+
+
 class TestPythonPython(PythonInteractionTest):
     """
     Test interaction with a Python server
@@ -111,3 +176,657 @@ class TestPythonPerl(PerlInteractionTest):
     """
     def client(self):
         return PerlServerClient()
+
+
+class TestPythonJavaScript(JavaScriptInteractionTest):
+    """
+    Test interaction with a JavaScript server using the length-prefixed
+    framing
+    """
+    def client(self):
+        return JavaScriptServerClient()
+
+
+class JSONPythonServerClient(PythonServerClient):
+    """
+    Python server with the client only allowing JSON
+    """
+    serializers = ['json']
+
+
+class JSONPerlServerClient(PerlServerClient):
+    """
+    Perl server with the client only allowing JSON
+    """
+    serializers = ['json']
+
+
+class MultiplexedPythonServerClient(PythonServerClient):
+    """
+    Python server returning a multiplexed client connected to it
+    """
+    def client(self):
+        return eurydice.socket.MultiplexedClient(self.address)
+
+
+class MultiplexedPerlServerClient(PerlServerClient):
+    """
+    Perl server returning a multiplexed client connected to it
+    """
+    def client(self):
+        return eurydice.socket.MultiplexedClient(self.address)
+
+
+class TestPythonPythonJSON(PythonInteractionTest):
+    """
+    Test interaction with a Python server using JSON
+    """
+    def client(self):
+        return JSONPythonServerClient()
+
+
+class TestPythonPerlJSON(PerlInteractionTest):
+    """
+    Test interaction with a Perl server using JSON
+    """
+    def client(self):
+        return JSONPerlServerClient()
+
+
+class TestPythonPythonMultiplexed(MultiplexedInteractionTest,
+                                  PythonInteractionTest):
+    """
+    Test interaction with a Python server from several threads
+    """
+    def client(self):
+        return MultiplexedPythonServerClient()
+
+
+class TestPythonPerlMultiplexed(MultiplexedInteractionTest,
+                                PerlInteractionTest):
+    """
+    Test interaction with a Perl server from several threads
+    """
+    def client(self):
+        return MultiplexedPerlServerClient()
+
+
+class UnixServerClient(SocketServerClient):
+    """
+    Base class for the servers listening on a Unix socket, combined with
+    the class of the server
+    """
+    def __init__(self):
+        super(UnixServerClient, self).__init__()
+        self.address = random_unix_address()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = super(UnixServerClient, self).__exit__(
+            exc_type, exc_value, traceback)
+        try:
+            os.unlink(self.address[len('unix://'):])
+        except OSError:
+            pass
+        return result
+
+
+class UnixPythonServerClient(UnixServerClient, PythonServerClient):
+    """
+    Python server listening on a Unix socket
+    """
+
+
+class UnixPerlServerClient(UnixServerClient, PerlServerClient):
+    """
+    Perl server listening on a Unix socket
+    """
+
+
+class TestPythonPythonUnix(PythonInteractionTest):
+    """
+    Test interaction with a Python server over a Unix socket
+    """
+    def client(self):
+        return UnixPythonServerClient()
+
+
+class TestPythonPerlUnix(PerlInteractionTest):
+    """
+    Test interaction with a Perl server over a Unix socket
+    """
+    def client(self):
+        return UnixPerlServerClient()
+
+
+class CompressedServerClient(object):
+    """
+    Mixin for the clients compressing all their messages
+    """
+    compression = ('zlib-dict',)
+    compression_threshold = 0
+
+
+class CompressedPythonServerClient(CompressedServerClient,
+                                   PythonServerClient):
+    """
+    Python server with compressed messages
+    """
+
+
+class CompressedPerlServerClient(CompressedServerClient, PerlServerClient):
+    """
+    Perl server with compressed messages
+    """
+
+
+class TestPythonPythonCompressed(PythonInteractionTest):
+    """
+    Test interaction with a Python server with compressed messages
+    """
+    def client(self):
+        return CompressedPythonServerClient()
+
+
+class TestPythonPerlCompressed(PerlInteractionTest):
+    """
+    Test interaction with a Perl server with compressed messages
+    """
+    def client(self):
+        return CompressedPerlServerClient()
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, JSONPythonServerClient))
+def test_receive_buffer_size(server_client):
+    """
+    Test the receive buffer is not kept at the size of a long message, and
+    the long JSON messages are decoded in pieces
+    """
+    with server_client() as client:
+        robj = PythonInteractionTest().concat_object(client)
+        text = 'x' * 200000
+        assert robj.concat(text) == 'one' + text
+        assert len(client.transport.buffer) <= \
+            client.transport.max_buffer_size
+
+        # Pieces splitting the characters, the strings and the references
+        client.transport.max_buffer_size = 7
+        values = ['é' * 50, {'a': [1.5, None, 'ü']}, robj]
+        assert client.use('copy').copy(values) == values
+        assert robj.concat('é' * 30) == 'one' + 'é' * 30
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, JSONPythonServerClient))
+def test_receive_references_incrementally(server_client):
+    """
+    Test the references and the buffers in a message decoded in pieces are
+    decoded once
+    """
+    with server_client() as client:
+        rdeque = client.use('collections').deque()
+        source = Source('ten')
+        rdeque.extend([source, 'x' * 100000, b'data', b'more'])
+        client.use('gc').collect()
+        client.ping()
+        assert rdeque.popleft() is source
+        assert rdeque.popleft() == 'x' * 100000
+        assert bytes(rdeque.popleft()) == b'data'
+        assert bytes(rdeque.popleft()) == b'more'
+        assert source.get_string() == 'ten'
+
+
+def test_parse_address():
+    """
+    Test parsing the server addresses
+    """
+    parse_address = eurydice.socket.parse_address
+    assert parse_address(('localhost', 5000)) == \
+        (socket.AF_INET, ('localhost', 5000))
+    assert parse_address('tcp://localhost:5000') == \
+        (socket.AF_INET, ('localhost', 5000))
+    assert parse_address('unix:///tmp/eurydice.sock') == \
+        (socket.AF_UNIX, '/tmp/eurydice.sock')
+    with pytest.raises(ValueError):
+        parse_address('udp://localhost:5000')
+
+
+# pylint:disable=no-member
+@pytest.mark.skipif(msgpack is None, reason="MessagePack is not installed")
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, PerlServerClient))
+def test_negotiate_msgpack(server_client):
+    """
+    Test MessagePack is chosen when available on both sides
+    """
+    with server_client() as client:
+        assert client.transport.serializer.name == 'msgpack'
+
+
+def test_server_serializers():
+    """
+    Test the server only accepts the serializers it is restricted to
+    """
+    with ModeServerClient('single', serializers=['json']) as client:
+        assert client.transport.serializer.name == 'json'
+        robj = PythonInteractionTest().concat_object(client)
+        assert robj.concat('two') == 'onetwo'
+
+
+class OldEndpoint(eurydice.socket.SocketEndpoint):
+    """
+    A server endpoint not knowing about the handshake
+    """
+    command_hello = None
+
+
+def old_server(behaviours):
+    """
+    Start a server not knowing about the handshake, treating the
+    connections as listed: 'drop' the connection on receiving a command,
+    'ignore' the commands, or answer them with an 'error' for an unknown
+    one. Returns the address of the server.
+    """
+    address = random_address()
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(address)
+    listener.listen(len(behaviours))
+
+    def serve():
+        """
+        Treat the connections in turn
+        """
+        ignored = []
+        for behaviour in behaviours:
+            (sock, _) = listener.accept()
+            if behaviour == 'drop':
+                sock.recv(1)
+                sock.close()
+            elif behaviour == 'ignore':
+                ignored.append(sock)
+            else:
+                thread = threading.Thread(
+                    target=OldEndpoint(sock).serve_forever)
+                thread.daemon = True
+                thread.start()
+        listener.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return address
+
+
+class QuickClient(eurydice.socket.Client):
+    """
+    A client not waiting long for the reply to the handshake
+    """
+    handshake_timeout = 0.5
+
+
+@pytest.mark.parametrize('behaviours', (
+    ['error'],
+    ['drop', 'error'],
+    ['ignore', 'error'],
+))
+def test_old_server(behaviours):
+    """
+    Test falling back to JSON with a server not knowing about the
+    handshake
+    """
+    client = QuickClient(old_server(behaviours), compression=['zlib'])
+    try:
+        assert client.transport.serializer.name == 'json'
+        assert client.transport.codec is None
+        robj = PythonInteractionTest().concat_object(client)
+        assert robj.concat('x' * 2000) == 'one' + 'x' * 2000
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, PerlServerClient))
+def test_unknown_command(server_client):
+    """
+    Test an unknown command is answered with an error, keeping the session
+    """
+    with server_client() as client:
+        with pytest.raises(eurydice.RemoteError):
+            # pylint:disable=protected-access
+            client._send_receive('unknown', 1)
+        client.ping()
+
+
+@pytest.mark.parametrize(('server_client', 'interaction', 'remote_time'), (
+    (PythonServerClient, PythonInteractionTest, True),
+    (JSONPythonServerClient, PythonInteractionTest, True),
+    (PerlServerClient, PerlInteractionTest, False),
+))
+def test_stats(server_client, interaction, remote_time):
+    """
+    Test collecting the statistics of a connection
+    """
+    server_client = server_client()
+    server_client.stats = stats = eurydice.stats.Stats()
+    with server_client as client:
+        robj = interaction().concat_object(client)
+        assert robj.concat('two') == 'onetwo'
+        future = client.call_future(robj, 'concat', 'three')
+        assert future.result() == 'onethree'
+
+        snapshot = stats.snapshot()
+        assert snapshot['messages_sent'] >= 3
+        assert snapshot['bytes_sent'] > 0
+        assert snapshot['messages_received'] >= 3
+        assert snapshot['bytes_received'] > 0
+        assert snapshot['encode_time']['count'] == snapshot['messages_sent']
+        assert snapshot['calls']['concat']['count'] == 2
+        assert (snapshot['execute_time']['count'] > 0) == remote_time
+
+        exported = stats.prometheus()
+        assert 'eurydice_bytes_sent_total %d\n' % snapshot['bytes_sent'] \
+            in exported
+        assert 'eurydice_call_seconds_count{method="concat"} 2\n' in exported
+
+
+@pytest.mark.parametrize(('server_client', 'interaction'), (
+    (PythonServerClient, PythonInteractionTest),
+    (JSONPythonServerClient, PythonInteractionTest),
+    (PerlServerClient, PerlInteractionTest),
+    (JSONPerlServerClient, PerlInteractionTest),
+))
+def test_compact_refs(server_client, interaction):
+    """
+    Test the references are sent with the instances as short tags once
+    agreed upon
+    """
+    with server_client() as client:
+        serializer = client.transport.serializer
+        assert serializer.peer is not None
+
+        robj = interaction().concat_object(client)
+        assert robj.ref['_remote_proxy']['instance'] == serializer.peer
+        source = Source('ten')
+        encoded = serializer.encode(['call', robj, 'set_source', source])
+        if not isinstance(encoded, str):
+            encoded = str(encoded, 'utf-8', 'replace')
+        assert '_remote_proxy' not in encoded
+        assert serializer.identity not in encoded
+        assert serializer.peer not in encoded
+        robj.set_source(source)
+        assert robj.concat('x') == 'onetenx'
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, JSONPythonServerClient))
+def test_proxy_identity(server_client):
+    """
+    Test a remote object received several times gets a single proxy,
+    releasing all the references once garbage collected
+    """
+    with server_client() as client:
+        rcopy = client.use('copy')
+        robj = PythonInteractionTest().concat_object(client)
+        # A shallow copy of the list keeps the same object
+        assert rcopy.copy([robj])[0] is robj
+        (first, second) = rcopy.copy([robj, robj])
+        assert first is robj and second is robj
+        assert robj == first
+        assert {robj: 'one'}[second] == 'one'
+        assert robj != PythonInteractionTest().concat_object(client)
+        proxy = robj.ref['_remote_proxy']
+        key = (proxy['instance'], proxy['id'])
+        gc.collect()
+        client.flush_released()
+
+        del robj, first, second
+        gc.collect()
+        assert len(client.released) == 4
+        assert key not in client.proxies.entries
+
+
+@pytest.mark.parametrize(('server_client', 'interaction'), (
+    (PythonServerClient, PythonInteractionTest),
+    (PerlServerClient, PerlInteractionTest),
+))
+@pytest.mark.parametrize('codec', ('zlib-dict', 'zlib'))
+def test_compression(server_client, interaction, codec):
+    """
+    Test the large messages are compressed with the negotiated codec
+    """
+    server_client = server_client()
+    server_client.compression = ('unknown', codec)
+    server_client.stats = stats = eurydice.stats.Stats()
+    with server_client as client:
+        assert client.transport.codec.name == codec
+
+        robj = interaction().concat_object(client)
+        before = stats.snapshot()
+        text = 'abc' * 10000
+        assert robj.concat(text) == 'one' + text
+        after = stats.snapshot()
+        assert after['bytes_sent'] - before['bytes_sent'] < len(text) / 10
+        assert after['bytes_received'] - before['bytes_received'] < \
+            len(text) / 10
+
+
+def test_compressed_size_limit():
+    """
+    Test a compressed message decompressing beyond the size limit is refused
+    """
+    server_client = PythonServerClient()
+    server_client.compression = ('zlib',)
+    with server_client as client:
+        robj = PythonInteractionTest().concat_object(client)
+        client.transport.max_message_size = 10000
+        with pytest.raises(TransportException):
+            robj.concat('x' * 100000)
+
+
+class LimitedJavaScriptServerClient(JavaScriptServerClient):
+    """
+    JavaScript server refusing messages decompressing beyond 10000 bytes
+    """
+    arguments = JavaScriptServerClient.arguments + [
+        '--max-message-size=10000']
+    compression = ('zlib',)
+
+
+def test_remote_compressed_size_limit():
+    """
+    Test the remote side refuses a small compressed message decompressing
+    beyond its size limit
+    """
+    with LimitedJavaScriptServerClient() as client:
+        robj = JavaScriptInteractionTest().concat_object(client)
+        assert robj.concat('x' * 1000) == 'one' + 'x' * 1000
+        with pytest.raises(TransportException):
+            robj.concat('x' * 100000)
+
+
+def test_javascript_buffers():
+    """
+    Test several binary buffers are passed out of band to and from the
+    JavaScript server in a single message
+    """
+    with JavaScriptServerClient() as client:
+        assert client.transport.serializer.buffers
+        rmodule = client.use('./concat.js')
+        payloads = [b'abc', b'', bytes(bytearray(range(256))) * 1000, b'd']
+        result = rmodule.reverse_all(payloads)
+        assert [bytes(item) for item in result] == \
+            [payload[::-1] for payload in payloads]
+        assert rmodule.create('one').concat('two') == 'onetwo'
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, JSONPythonServerClient))
+def test_numpy_buffers(server_client):
+    """
+    Test NumPy arrays are passed as buffers, keeping their type and shape
+    """
+    numpy = pytest.importorskip('numpy')
+    with server_client() as client:
+        array = numpy.arange(12, dtype='<f4').reshape((3, 4))
+        result = client.use('copy').copy(array)
+        assert result.dtype == array.dtype
+        assert result.shape == array.shape
+        assert (result == array).all()
+        assert (client.use('copy').copy(array.T) == array.T).all()
+
+
+@pytest.mark.parametrize('server_client',
+                         (PythonServerClient, JSONPythonServerClient))
+def test_reserved_keys(server_client):
+    """
+    Test the data using the keys of the references is passed as it is
+    """
+    values = [
+        {'_buffer': 5},
+        {'_buffer': {'size': 3}, 'x': 1},
+        {'_ref': 'abc'},
+        {'_ref': 'abc', 'x': 1},
+        {'_ref': [0, 1], 'x': 1},
+        {'_remote_proxy': {'id': 1, 'instance': 'x'}, 'x': 1},
+    ]
+    with server_client() as client:
+        assert client.use('copy').deepcopy(values) == values
+
+
+class ModeServerClient(PythonServerClient):
+    """
+    Python server in the given concurrency mode
+    """
+    def __init__(self, mode, **options):
+        super(ModeServerClient, self).__init__()
+        self.mode = mode
+        self.options = options
+
+
+def sleep_concurrently(address, clients, delay):
+    """
+    Connect several clients at once, each sleeping on the server, and
+    return the time taken by all of them
+    """
+    def sleep():
+        """
+        Sleep on the server
+        """
+        client = eurydice.socket.Client(address)
+        client.use('time').sleep(delay)
+        client.close()
+
+    threads = [threading.Thread(target=sleep) for _ in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+@pytest.mark.parametrize('mode,options', (
+    ('thread', {}),
+    ('fork', {}),
+    ('prefork', {'workers': 4}),
+))
+def test_concurrent_clients(mode, options):
+    """
+    Test several clients are served at once
+    """
+    context = ModeServerClient(mode, **options)
+    with context as client:
+        # The first client stays connected while the others are served
+        robjects = client.use('tests.objects')
+        assert sleep_concurrently(context.address, 3, 0.5) < 1.2
+        assert robjects.Concat('one').concat('two') == 'onetwo'
+
+
+def test_max_connections():
+    """
+    Test the number of clients served at once is limited
+    """
+    context = ModeServerClient('thread', max_connections=2, backlog=10)
+    with context as client:
+        client.close()
+        assert sleep_concurrently(context.address, 4, 0.5) >= 1.0
+
+
+@pytest.mark.parametrize('mode,options', (
+    ('thread', {'max_connections': 1}),
+    ('prefork', {'workers': 2}),
+))
+def test_shutdown(mode, options):
+    """
+    Test a server serving in a thread is shut down, even with every worker
+    or slot busy
+    """
+    address = random_address()
+    server = eurydice.socket.make_server(address, mode, **options)
+    thread = threading.Thread(target=server.serve_forever, args=(0.1,))
+    thread.daemon = True
+    thread.start()
+    try:
+        client = eurydice.socket.Client(address)
+        assert client.use('tests.objects').Concat('a').concat('b') == 'ab'
+        # Waits for the first client to disconnect
+        waiting = eurydice.socket.connect(address)
+
+        stopper = threading.Thread(target=server.shutdown)
+        stopper.daemon = True
+        stopper.start()
+        stopper.join(5)
+        assert not stopper.is_alive()
+        thread.join(5)
+        assert not thread.is_alive()
+
+        waiting.close()
+        client.close()
+    finally:
+        server.server_close()
+
+
+class PreforkPythonServerClient(ModeServerClient):
+    """
+    Python server forking two workers after preloading the test module
+    """
+    def __init__(self):
+        super(PreforkPythonServerClient, self).__init__(
+            'prefork', workers=2, preload=['tests.objects'])
+
+
+class PreforkPerlServerClient(PerlServerClient):
+    """
+    Perl server forking two workers after preloading the test module
+    """
+    arguments = PerlServerClient.arguments + [
+        '--preload=Tests::Concat', '--workers=2']
+    # Stops the workers as well
+    termination_signal = signal.SIGTERM
+
+
+@pytest.mark.parametrize(('server_client', 'module'), (
+    (PreforkPythonServerClient, 'tests.objects'),
+    (PreforkPerlServerClient, 'Tests::Concat'),
+))
+def test_preload(server_client, module):
+    """
+    Test the preloaded modules have the same IDs in all the sessions, served
+    by different workers
+    """
+    context = server_client()
+    with context as client:
+        rmodule = client.use(module)
+        # Served by the other worker while the first client is connected
+        other = eurydice.socket.Client(context.address)
+        other_module = other.use(module)
+        assert other_module.ref['_remote_proxy']['id'] == \
+            rmodule.ref['_remote_proxy']['id']
+        other.close()
+
+        # In a later session of either worker
+        other = eurydice.socket.Client(context.address)
+        assert other.use(module).ref['_remote_proxy']['id'] == \
+            rmodule.ref['_remote_proxy']['id']
+        other.close()
@@ -0,0 +1,140 @@
+"""
+Tests for stream transports
+"""
+
+import json
+import socket
+import threading
+
+import pytest
+
+from eurydice.common import TransportException
+from eurydice.endpoint import Endpoint
+from eurydice.jsonstream import IncrementalDecoder
+from eurydice.transport import StreamLineTransport
+
+from tests import PythonInteractionTest
+
+
+class SocketStream(object):
+    """
+    Text stream reading from and writing to a socket. Unlike a single
+    read-write file, it does not lose the data read ahead when writing.
+    """
+    def __init__(self, sock):
+        self.reader = sock.makefile('r', encoding='utf-8', newline='\n')
+        self.writer = sock.makefile('w', encoding='utf-8', newline='\n')
+        self.readline = self.reader.readline
+        self.write = self.writer.write
+        self.flush = self.writer.flush
+
+    def close(self):
+        """
+        Close both directions
+        """
+        self.writer.close()
+        self.reader.close()
+
+
+class StreamEndpoint(Endpoint):
+    """
+    Endpoint sending lines through a socket stream
+    """
+    def __init__(self, sock, chunk_size):
+        self.socket = sock
+        transport = StreamLineTransport(SocketStream(sock), self)
+        transport.chunk_size = chunk_size
+        super(StreamEndpoint, self).__init__(transport)
+
+    def close(self):
+        super(StreamEndpoint, self).close()
+        self.socket.close()
+
+
+class StreamServerClient(object):
+    """
+    Client talking to a server in a thread over a socket pair as a context
+    object
+    """
+
+    # Decode all but the shortest messages incrementally
+    chunk_size = 16
+
+    def __init__(self):
+        self.endpoint = None
+
+    def __enter__(self):
+        (client, server) = socket.socketpair()
+        server = StreamEndpoint(server, self.chunk_size)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.endpoint = StreamEndpoint(client, self.chunk_size)
+        return self.endpoint
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.endpoint.close()
+        return False
+
+
+class TestPythonPythonStream(PythonInteractionTest):
+    """
+    Test interaction with a Python server through line streams
+    """
+    def client(self):
+        return StreamServerClient()
+
+
+def test_incremental_decoder():
+    """
+    Test decoding JSON split into pieces at every position
+    """
+    text = json.dumps({
+        'list': [1, -2.5e10, True, False, None, [], {}],
+        'string': 'quoted "\\" é',
+        'nested': [{'a': [{'b': 'c'}]}],
+    })
+    for size in (1, 2, 3, 7, len(text)):
+        decoder = IncrementalDecoder(object_hook=lambda obj: ('hook', obj))
+        for start in range(0, len(text), size):
+            decoder.feed(text[start:start + size])
+        assert decoder.close() == \
+            json.loads(text, object_hook=lambda obj: ('hook', obj))
+
+    # The hook runs once for the objects in an incomplete container
+    objects = []
+    decoder = IncrementalDecoder(object_hook=objects.append)
+    decoder.feed('[[{"a": 1}, {"b": 2}], ')
+    decoder.feed('3]')
+    decoder.close()
+    assert objects == [{'a': 1}, {'b': 2}]
+
+    for invalid in ('[1,]', '{"a" 1}', '[1}', '"abc', '[1]x', '[', 'tru'):
+        decoder = IncrementalDecoder()
+        with pytest.raises(ValueError):
+            decoder.feed(invalid)
+            decoder.close()
+
+
+def test_max_message_size():
+    """
+    Test messages larger than the limit are refused
+    """
+    with StreamServerClient() as client:
+        robj = client.use('tests.objects').Concat('one')
+        assert robj.concat('x' * 100) == 'one' + 'x' * 100
+        client.transport.max_message_size = 1000
+        with pytest.raises(TransportException):
+            robj.concat('x' * 10000)
+
+
+def test_no_handshake():
+    """
+    Test no handshake is made when there are no options to agree upon, for
+    the peers not knowing about it
+    """
+    with StreamServerClient() as client:
+        assert client.transport.options() == {}
+        assert client.transport.serializer.peer is None
+        robj = client.use('tests.objects').Concat('one')
+        assert robj.concat('two') == 'onetwo'
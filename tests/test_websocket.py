@@ -40,6 +40,7 @@ class JavaScriptWebSocketClient(WebSocketServerClient, ProcessServerClient):
 
     arguments = ['node',
                  '-harmony-proxies',
+                 '-harmony-collections',
                  '-expose-gc',
                  'javascript/server.js']
 